@@ -0,0 +1,200 @@
+"""
+Benchmarks for loading grids, creating grid entities, stepping and getting
+data with synthetic grids of different sizes (see
+:mod:`mosaik_pypower.gridgen`).
+
+Each phase is timed separately.  Its peak memory is recorded with
+:mod:`tracemalloc` in a second run, because tracing slows down Python
+considerably.  The results can be saved as a baseline and compared
+against one::
+
+    $ python benchmarks/bench.py --save benchmarks/baseline.json
+    $ python benchmarks/bench.py --compare benchmarks/baseline.json
+
+"""
+import argparse
+import json
+import os.path
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy
+import scipy
+
+from mosaik_pypower import gridgen, model, registry
+from mosaik_pypower import mosaik as mosaik_pypower
+
+
+PHASES = ['load_case', 'create', 'step', 'get_data']
+OUTPUTS = {
+    'RefBus': ['P', 'Q'],
+    'PQBus': ['P', 'Q', 'Vm', 'Va'],
+    'Transformer': ['P_from', 'Q_from'],
+    'Branch': ['P_from', 'Q_from', 'I_real', 'I_imag'],
+}
+
+
+class Phase:
+    """Context manager that measures the time (per *repeat*) or, if
+    :mod:`tracemalloc` is tracing, the peak memory of a phase."""
+    def __init__(self, results, name, repeat=1):
+        self.results = results.setdefault(name, {})
+        self.repeat = repeat
+
+    def __enter__(self):
+        if tracemalloc.is_tracing():
+            if hasattr(tracemalloc, 'reset_peak'):  # Python >= 3.9
+                tracemalloc.reset_peak()
+            else:
+                # Restarting clears the traces, so only the allocations of
+                # this phase are counted:
+                tracemalloc.stop()
+                tracemalloc.start()
+            self._mem = tracemalloc.get_traced_memory()[0]
+        self._start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        if tracemalloc.is_tracing():
+            peak = tracemalloc.get_traced_memory()[1] - self._mem
+            self.results['peak_mb'] = peak / 2**20
+        else:
+            duration = (time.perf_counter() - self._start) / self.repeat
+            self.results['time'] = min(duration,
+                                       self.results.get('time', duration))
+
+
+def run_benchmark(results, gridfile, instances, steps, init_args):
+    """Run all phases for *gridfile* and store their *results*."""
+    model._compiled_cases.clear()
+    model.Excel.cache.clear()
+
+    with Phase(results, 'load_case'):
+        model.load_case(gridfile, 0, {})
+    model._compiled_cases.clear()
+    model.Excel.cache.clear()
+    registry._grids.clear()
+
+    sim = mosaik_pypower.PyPower()
+    sim.init('PyPower-0', 1., 60, battery_capacity=0, **init_args)
+    with Phase(results, 'create'):
+        grids = sim.create(instances, 'Grid', gridfile)
+
+    buses = [e['eid'] for g in grids for e in g['children']
+             if e['type'] == 'PQBus']
+    rnd = random.Random(0)
+    p_max = 2e7 * instances / len(buses)  # 20 MW per grid
+    inputs = [{eid: {'P': {'src': rnd.uniform(0, p_max)},
+                     'Q': {'src': rnd.uniform(0, p_max / 5)}}
+               for eid in buses} for i in range(steps)]
+    with Phase(results, 'step', repeat=steps):
+        for i in range(steps):
+            sim.step(i * 60, inputs[i], (i + 1) * 60)
+
+    outputs = {e['eid']: OUTPUTS[e['type']]
+               for g in grids for e in g['children']
+               if e['type'] in OUTPUTS}
+    with Phase(results, 'get_data'):
+        sim.get_data(outputs)
+    sim.finalize()
+
+
+def compare(results, baseline, threshold, min_time):
+    """Print the changes of *results* compared to *baseline* and return the
+    list of regressions (phases that are more than *threshold* times slower
+    and take at least *min_time* seconds)."""
+    regressions = []
+    for key, phases in sorted(results.items()):
+        base = baseline.get(key)
+        if base is None:
+            continue
+        for phase in PHASES:
+            t, t0 = phases[phase]['time'], base[phase]['time']
+            ratio = t / t0 if t0 > 0 else float('inf')
+            flag = ''
+            if ratio > threshold and t >= min_time:
+                flag = '  REGRESSION'
+                regressions.append((key, phase))
+            print('%-24s %-10s %10.4f s  %6.2fx%s' %
+                  (key, phase, t, ratio, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', default='10,100,1000,10000',
+                        help='Comma separated numbers of buses '
+                             '(default: 10,100,1000,10000)')
+    parser.add_argument('--topologies', default='radial,meshed')
+    parser.add_argument('--formats', default='json,xlsx')
+    parser.add_argument('--instances', type=int, default=1,
+                        help='Number of grid instances per create() call')
+    parser.add_argument('--steps', type=int, default=5)
+    parser.add_argument('--solver', default='auto')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Number of timing runs (the fastest counts)')
+    parser.add_argument('--save', metavar='FILE',
+                        help='Save the results (e.g., as new baseline)')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='Compare the results with a baseline')
+    parser.add_argument('--threshold', type=float, default=1.5,
+                        help='Slowdown factor that counts as regression')
+    parser.add_argument('--min-time', type=float, default=0.005,
+                        help='Ignore regressions of faster phases [s]')
+    args = parser.parse_args(argv)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for size in [int(s) for s in args.sizes.split(',')]:
+            for topology in args.topologies.split(','):
+                grid = gridgen.make_grid(size, meshed=(topology == 'meshed'),
+                                         seed=size)
+                for fmt in args.formats.split(','):
+                    key = '%s-%d-%s' % (topology, size, fmt)
+                    gridfile = os.path.join(tmpdir, '%s.%s' % (key, fmt))
+                    getattr(gridgen, 'write_%s' % fmt)(grid, gridfile)
+                    results[key] = {}
+                    for trace in [False] * args.repeat + [True]:
+                        if trace:
+                            tracemalloc.start()
+                        run_benchmark(results[key], gridfile, args.instances,
+                                      args.steps, {'solver': args.solver})
+                        tracemalloc.stop()
+                    print('%-24s %s' % (key, '  '.join(
+                        '%s: %.4f s / %.1f MiB' %
+                        (p, results[key][p]['time'],
+                         results[key][p]['peak_mb']) for p in PHASES)))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({
+                'environment': {
+                    'python': platform.python_version(),
+                    'numpy': numpy.__version__,
+                    'scipy': scipy.__version__,
+                    'machine': platform.machine(),
+                },
+                'settings': {
+                    'instances': args.instances,
+                    'steps': args.steps,
+                    'solver': args.solver,
+                },
+                'results': results,
+            }, f, indent=1, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold,
+                              args.min_time)
+        if regressions:
+            print('%d regression(s)' % len(regressions))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
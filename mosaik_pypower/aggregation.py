@@ -0,0 +1,111 @@
+"""
+This module contains :class:`InputAggregator` which sums up the inputs of a
+simulation step.
+
+mosaik passes the inputs of a step as nested dicts (entity → attribute →
+source → value) and each attribute's values have to be summed up.  With
+many sources per entity (e.g., thousands of household loads connected to a
+few buses), doing that separately for each attribute dominates the step.
+
+"""
+from itertools import chain
+
+import numpy
+
+from mosaik_pypower.registry import BUS_INPUT_CODES
+
+
+class InputAggregator:
+    """Sums up the input values of all entities of a step at once.
+
+    The aggregator learns the connection pattern of the inputs, i.e. the
+    *slots* (pairs of an entity ID and an attribute) and the number of
+    sources of each slot.  All values of a step are then read into one flat
+    vector and summed per slot with a single :func:`numpy.bincount()`.  When
+    the pattern changes (e.g., because sources are connected or
+    disconnected), it is learned again.
+
+    For the learned pattern, the aggregator also provides the targets of
+    the sums: for each grid, the rows of the buses with inputs and the
+    slots of their *P* and *Q* values in *bus_inputs*, the other entities
+    with inputs in *others*, the power nodes in *nodes* and the number of
+    entities with inputs in *n_inputs*.
+
+    """
+    def __init__(self, registry, inputs, nodes):
+        self._registry = registry
+        self._inputs = inputs  # Allowed input attributes
+        self._nodes = nodes  # Entity IDs of the power nodes
+        self._pattern = None  # (slots, counts, number of grids)
+        self._owner = numpy.empty(0, dtype=numpy.int64)  # Slot of each value
+        self.learned = 0  # Number of times the pattern was learned
+        self.bus_inputs = []
+        self.others = []
+        self.nodes = []
+        self.n_inputs = []
+
+    def update(self, inputs):
+        """Learn the pattern of *inputs* if it differs from the known one.
+
+        Raise a :exc:`RuntimeError` if an input attribute is not allowed.
+
+        """
+        pattern = (
+            [(eid, attr) for eid, attrs in inputs.items() for attr in attrs],
+            [len(values) for attrs in inputs.values()
+             for values in attrs.values()],
+            len(self._registry.layouts),
+        )
+        if pattern != self._pattern:
+            self._learn(inputs, pattern)
+
+    def sums(self, inputs):
+        """Return an array with the sum of the values of each slot of
+        *inputs* (which must match the learned pattern).
+
+        The array has an additional last element ``0`` for missing slots.
+
+        """
+        values = numpy.fromiter(
+            chain.from_iterable(values.values() for attrs in inputs.values()
+                                for values in attrs.values()),
+            dtype=float, count=len(self._owner))
+        return numpy.bincount(self._owner, weights=values,
+                              minlength=len(self._pattern[0]) + 1)
+
+    def _learn(self, inputs, pattern):
+        slots, counts, n_grids = pattern
+        missing = len(slots)  # Index of the extra "0" in "sums()"
+        buses = [([], [], []) for _ in range(n_grids)]
+        others = []
+        nodes = []
+        n_inputs = [0] * n_grids
+
+        slot = 0
+        for eid, attrs in inputs.items():
+            for attr in attrs:
+                if attr not in self._inputs:
+                    raise RuntimeError('Unexpected attribute requested %s' %
+                                       attrs.items())
+            grid_idx, code, row, pos = self._registry.lookup(eid)
+            n_inputs[grid_idx] += 1
+            if eid in self._nodes:
+                nodes.append(eid)
+            attr_slots = {attr: slot + i for i, attr in enumerate(attrs)}
+            slot += len(attrs)
+            if code in BUS_INPUT_CODES:
+                rows, p, q = buses[grid_idx]
+                rows.append(row)
+                p.append(attr_slots.get('P', missing))
+                q.append(attr_slots.get('Q', missing))
+            else:
+                others.append((eid, grid_idx, code, row, attr_slots))
+
+        self.others = others
+        self.nodes = nodes
+        self.n_inputs = n_inputs
+        self.bus_inputs = [tuple(numpy.array(a, dtype=numpy.int64) for a in b)
+                           for b in buses]
+        self._owner = numpy.repeat(numpy.arange(len(slots)), counts)
+        self._pattern = pattern
+        self.learned += 1
@@ -0,0 +1,27 @@
+"""
+This module converts grid files (JSON or Excel) into the binary grid format
+(see :func:`mosaik_pypower.model.write_binary_case()`).
+
+Usage::
+
+    mosaik-pypower-convert grid.xlsx grid.npgrid
+
+"""
+import argparse
+import json
+
+from mosaik_pypower import model
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Convert a grid file into the binary grid format.')
+    parser.add_argument('gridfile', help='JSON or Excel file with the grid')
+    parser.add_argument('outfile', help='Name of the binary grid (*%s)' %
+                                        model.BINARY_SUFFIX)
+    parser.add_argument('--sheetnames', type=json.loads, default={},
+                        help='JSON object with the Excel sheet names, e.g. '
+                             '\'{"bus": "Buses"}\'')
+    args = parser.parse_args(argv)
+
+    model.convert_case(args.gridfile, args.outfile, args.sheetnames)
@@ -0,0 +1,146 @@
+"""
+This module generates synthetic grids of arbitrary size, e.g. for
+benchmarks.
+
+The grids consist of a 110 kV reference bus, a HV/MV transformer and a
+medium voltage grid whose buses are connected by cables from
+:mod:`mosaik_pypower.resource_db`.  Radial grids are random trees; meshed
+grids additionally get one extra cable per ten buses.  The grids can be
+written in the JSON and Excel formats that :func:`mosaik_pypower.model.
+load_case()` reads.
+
+"""
+from xml.sax.saxutils import escape
+import json
+import random
+import zipfile
+
+from mosaik_pypower import resource_db as rdb
+
+
+TRAFO_TYPE = 'TRAFO_40'
+LINE_TYPES = ['NA2XS2Y_120', 'NA2XS2Y_185']
+
+
+def make_grid(n_buses, meshed=False, seed=None):
+    """Return a grid with *n_buses* PQ buses in the JSON format.
+
+    The grid is radial unless *meshed* is ``True``.  The same *seed* always
+    produces the same grid.
+
+    """
+    if n_buses < 1:
+        raise ValueError('A grid needs at least one PQ bus.')
+    rnd = random.Random(seed)
+    assert TRAFO_TYPE in rdb.transformers
+    buses = [['Grid', 'REF', 110.0]]
+    buses.extend(['Bus%d' % i, 'PQ', 20.0] for i in range(n_buses))
+    trafos = [['Trafo0', 'Grid', 'Bus0', TRAFO_TYPE, True, 0]]
+
+    # Random tree: Connect each bus to one of the previous ones
+    edges = [(rnd.randrange(i), i) for i in range(1, n_buses)]
+    if meshed and n_buses > 2:
+        known = set(edges)
+        for i in range(n_buses // 10):
+            f, t = sorted(rnd.sample(range(n_buses), 2))
+            if (f, t) not in known:
+                known.add((f, t))
+                edges.append((f, t))
+
+    branches = []
+    for i, (f, t) in enumerate(edges):
+        length = round(rnd.uniform(0.05, 0.5), 3)
+        branches.append(['B_%d' % i, 'Bus%d' % f, 'Bus%d' % t,
+                         rnd.choice(LINE_TYPES), length, True])
+
+    return {'bus': buses, 'trafo': trafos, 'branch': branches}
+
+
+def write_json(grid, path):
+    """Write the *grid* to the JSON file *path*."""
+    with open(path, 'w') as f:
+        json.dump(grid, f)
+
+
+def write_xlsx(grid, path):
+    """Write the *grid* to the Excel file *path*.
+
+    The file is written directly (as zipped XML) so that no Excel library is
+    needed.
+
+    """
+    nodes = [['Node name', 'Node type {REF, PQ}', 'Base voltage [kV]']]
+    nodes.extend(grid['bus'])
+    lines = [['Name', 'From', 'To', 'Type', 'Length [km]', 'Online', 'Tap']]
+    for tid, fbus, tbus, ttype, online, tap in grid['trafo']:
+        lines.append([tid, fbus, tbus, ttype, 1.0, float(online), tap])
+    for bid, fbus, tbus, btype, length, online in grid['branch']:
+        lines.append([bid, fbus, tbus, btype, length, float(online), ''])
+    sheets = [('Nodes', nodes), ('Lines', lines)]
+
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr('[Content_Types].xml', _XLSX_CONTENT_TYPES % ''.join(
+            _XLSX_SHEET_TYPE % (i + 1) for i in range(len(sheets))))
+        zf.writestr('_rels/.rels', _XLSX_RELS)
+        zf.writestr('xl/workbook.xml', _XLSX_WORKBOOK % ''.join(
+            '<sheet name="%s" sheetId="%d" r:id="rId%d"/>' %
+            (escape(name), i + 1, i + 1)
+            for i, (name, rows) in enumerate(sheets)))
+        zf.writestr('xl/_rels/workbook.xml.rels', _XLSX_WORKBOOK_RELS % ''.join(
+            _XLSX_SHEET_REL % (i + 1, i + 1) for i in range(len(sheets))))
+        for i, (name, rows) in enumerate(sheets):
+            zf.writestr('xl/worksheets/sheet%d.xml' % (i + 1),
+                        _XLSX_SHEET % ''.join(_xlsx_rows(rows)))
+
+
+def _xlsx_rows(rows):
+    for r, row in enumerate(rows, 1):
+        cells = []
+        for c, value in enumerate(row):
+            ref = '%s%d' % (chr(ord('A') + c), r)
+            if isinstance(value, str):
+                cells.append('<c r="%s" t="inlineStr"><is><t>%s</t></is></c>'
+                             % (ref, escape(value)))
+            else:
+                cells.append('<c r="%s"><v>%r</v></c>' % (ref, float(value)))
+        yield '<row r="%d">%s</row>' % (r, ''.join(cells))
+
+
+_XLSX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/'
+    'content-types">'
+    '<Default Extension="rels" ContentType="application/'
+    'vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" ContentType="application/'
+    'vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '%s</Types>')
+_XLSX_SHEET_TYPE = (
+    '<Override PartName="/xl/worksheets/sheet%d.xml" ContentType="'
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.'
+    'worksheet+xml"/>')
+_XLSX_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/'
+    'relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/'
+    'officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/></Relationships>')
+_XLSX_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/'
+    'main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/'
+    'relationships"><sheets>%s</sheets></workbook>')
+_XLSX_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/'
+    'relationships">%s</Relationships>')
+_XLSX_SHEET_REL = (
+    '<Relationship Id="rId%d" Type="http://schemas.openxmlformats.org/'
+    'officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet%d.xml"/>')
+_XLSX_SHEET = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/'
+    'main"><sheetData>%s</sheetData></worksheet>')
@@ -0,0 +1,54 @@
+"""
+This module contains :class:`StepMetrics` which measures where the time of
+a simulation step goes.
+
+"""
+import json
+import time
+
+
+# Phases of a step and of "get_data()"
+PHASES = ('inputs', 'reset', 'lookup', 'solve', 'results', 'get_data')
+
+
+class StepMetrics:
+    """Measures the wall time of the phases of a step (see :data:`PHASES`).
+
+    Call :meth:`start()` at the beginning of a step (or of ``get_data()``)
+    and :meth:`lap()` at the end of each phase.  If *path* is set, each
+    call of :meth:`write()` appends one JSON line to that file.
+
+    """
+    def __init__(self, path=None):
+        self.times = dict.fromkeys(PHASES, 0.)
+        self._file = None if path is None else open(path, 'a')
+        self._last = None
+
+    def start(self):
+        """Start timing the first phase."""
+        self._last = time.perf_counter()
+
+    def lap(self, phase):
+        """Record the time since the last call (or :meth:`start()`) as the
+        duration of *phase*."""
+        now = time.perf_counter()
+        self.times[phase] = now - self._last
+        self._last = now
+
+    @property
+    def step_time(self):
+        """Total wall time of the last step."""
+        return sum(t for p, t in self.times.items() if p != 'get_data')
+
+    def write(self, record):
+        """Append the *record* (a dict) and the phase times to the metrics
+        file (if there is one)."""
+        if self._file is not None:
+            record = dict(record, times=self.times)
+            self._file.write(json.dumps(record) + '\n')
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -4,17 +4,19 @@ This module contains the model types for PYPOWER (:class:`Bus`,
 
 """
 from __future__ import division
+import collections.abc
+import hashlib
 import json
 import math
 import os.path
+import shutil
 
 from pypower import idx_bus, idx_brch, idx_gen
-from pypower.api import ppoption, runpf
-from xlrd.biffh import XLRDError
 import numpy
-import xlrd
 
+from mosaik_pypower import __version__
 from mosaik_pypower import resource_db as rdb
+from mosaik_pypower import solver, xlsx
 
 
 # The line params that we read are for 1 of 3 wires within a cable,
@@ -32,6 +34,23 @@ BUS_BASE_KV = 2
 BUS_PQ_FACTOR = power_factor * 1e6  # from MW to W
 BRANCH_PQ_FACTOR = power_factor * 1e6  # from MW to W
 
+# Entity types whose (re)active power can be set via "set_bus_inputs()"
+BUS_INPUT_TYPES = ('PQBus', 'PowerNode')
+
+# Entity types of the bus types in grid files
+BUS_TYPES = {
+    'REF': 'RefBus',
+    'PQ': 'PQBus',
+    'NODE': 'PowerNode',
+}
+
+# Increase when the format of compiled cases changes
+COMPILED_CASE_VERSION = 1
+
+# Suffix and version of the binary grid format (see "write_binary_case()")
+BINARY_SUFFIX = '.npgrid'
+BINARY_VERSION = 1
+
 
 DEFAULT_SHEETS = {
     'bus': 'Nodes',
@@ -40,149 +59,629 @@ DEFAULT_SHEETS = {
     'trafo_types': 'Transformer types',
 }
 
+# Compiled cases by file path, modification time and sheet names
+_compiled_cases = {}
 
-def load_case(path, grid_idx, sheetnames):
+
+def load_case(path, grid_idx, sheetnames, cache_dir=None):
     """Load the case from *path* and create a PYPOWER case and an entity map.
+
+    Each file is only compiled once (see :func:`load_compiled_case()`).
+    Further calls copy the compiled case and relabel its entities with
+    *grid_idx*.
+
     """
-    loaders = {
-        '.json': JSON,
-        '.xlsx': Excel,
-    }
+    compiled = load_compiled_case(path, sheetnames, cache_dir)
+    return _instantiate_case(compiled, grid_idx)
+
+
+def load_compiled_case(path, sheetnames, cache_dir=None):
+    """Return the compiled case for *path* (see :func:`compile_case()`).
+
+    Each file is only compiled once as long as its modification time does
+    not change.  If *cache_dir* is set, compiled cases are also stored in and
+    loaded from ``.npz`` files in that directory, named after the hash of the
+    file's content.
+
+    *path* can also be a grid in the binary format (see
+    :func:`write_binary_case()`), which is memory-mapped instead.
+
+    The compiled case is shared by all callers and must not be modified.
+
+    """
+    key = case_key(path, sheetnames)
+    compiled = _compiled_cases.get(key)
+    if compiled is None:
+        compiled = _compiled_cases[key] = read_case(path, sheetnames,
+                                                    cache_dir)
+    return compiled
+
+
+def case_key(path, sheetnames):
+    """Return the key of the compiled case for *path* and *sheetnames*.
+
+    The key changes with the file's modification time.
+
+    """
+    if not _is_binary(path):
+        _get_loader(path)
+    return (os.path.abspath(path), os.stat(path).st_mtime_ns,
+            tuple(sorted(sheetnames.items())))
+
+
+def read_case(path, sheetnames, cache_dir=None):
+    """Compile the case for *path* or read it from *cache_dir* like
+    :func:`load_compiled_case()`, but without keeping it in memory."""
+    if _is_binary(path):
+        return read_binary_case(path)
+    if cache_dir is None:
+        return compile_case(path, sheetnames)
+    filename = os.path.join(cache_dir, '%s.npz' %
+                            _content_hash(path, sheetnames))
     try:
-        ext = os.path.splitext(path)[-1]
-        loader = loaders[ext]
-    except KeyError:
-        raise ValueError("Don't know how to open '%s'" % path)
+        return read_compiled_case(filename)
+    except (OSError, KeyError, ValueError):
+        compiled = compile_case(path, sheetnames)
+        write_compiled_case(filename, compiled)
+        return compiled
+
+
+def compile_case(path, sheetnames):
+    """Load the case from *path* and return a tuple ``(ppc, entities)``.
+
+    The keys of *entities* and the *related* entities are the entity names
+    without a grid index.
 
+    """
+    loader = _get_loader(path)
     entity_map = UniqueKeyDict()
 
     raw_case = loader.open(path)
-    buses = _get_buses(loader, raw_case, entity_map, grid_idx, sheetnames)
-    branches = _get_branches(loader, raw_case, entity_map, grid_idx,
-                             sheetnames)
+    buses = _get_buses(loader, raw_case, entity_map, 0, sheetnames)
+    branches = _get_branches(loader, raw_case, entity_map, 0, sheetnames)
     base_mva = loader.base_mva(raw_case, buses)
 
     ppc = _make_ppc(base_mva, buses, branches)
-    return ppc, entity_map
+    entities = {}
+    for eid, attrs in entity_map.items():
+        if 'related' in attrs:
+            attrs['related'] = [strip_eid(e) for e in attrs['related']]
+        entities[strip_eid(eid)] = attrs
+    return ppc, entities
+
+
+def read_compiled_case(filename):
+    """Read a compiled case written by :func:`write_compiled_case()`."""
+    with numpy.load(filename) as data:
+        if int(data['version']) != COMPILED_CASE_VERSION:
+            raise ValueError('Outdated compiled case "%s"' % filename)
+        ppc = {
+            'baseMVA': float(data['base_mva']),
+            'bus': data['bus'],
+            'gen': data['gen'],
+            'branch': data['branch'],
+        }
+        entities = json.loads(str(data['entities']))
+
+    # JSON only knows string keys, but tap positions are integers:
+    for attrs in entities.values():
+        taps = attrs['static'].get('taps')
+        if taps is not None:
+            attrs['static']['taps'] = {int(k): v for k, v in taps.items()}
+    return ppc, entities
+
+
+def write_compiled_case(filename, compiled):
+    """Write the *compiled* case (see :func:`compile_case()`) to the
+    ``.npz`` file *filename*."""
+    ppc, entities = compiled
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    # Write to a temporary file first, so that concurrent simulations never
+    # read an incomplete file:
+    tmp = '%s.%d.tmp' % (filename, os.getpid())
+    with open(tmp, 'wb') as f:
+        numpy.savez(f, version=COMPILED_CASE_VERSION,
+                    base_mva=ppc['baseMVA'], bus=ppc['bus'], gen=ppc['gen'],
+                    branch=ppc['branch'], entities=json.dumps(entities))
+    os.replace(tmp, filename)
+
+
+def convert_case(gridfile, path, sheetnames=None):
+    """Convert the grid *gridfile* (JSON or Excel) to the binary format and
+    write it to *path* (see :func:`write_binary_case()`)."""
+    write_binary_case(path, compile_case(gridfile, sheetnames or {}))
+
+
+def write_binary_case(path, compiled):
+    """Write the *compiled* case (see :func:`compile_case()`) to the
+    directory *path* in the binary grid format.
+
+    The directory contains one ``.npy`` file for the bus, gen and branch
+    matrices, the entity names, type codes, rows and related entities and for
+    each static attribute of each entity type, plus a ``meta.json`` file with
+    the remaining data.  The suffix of *path* must be ``.npgrid``.
+
+    """
+    if not _is_binary(path):
+        raise ValueError('Binary grids need the suffix "%s": %s' %
+                         (BINARY_SUFFIX, path))
+    ppc, entities = compiled
+    columns = entity_columns(entities)
+    static = columns['static']
+    # The tap dicts go into the meta data:
+    taps = [sorted(t.items())
+            for t in static.get('Transformer', {}).get('taps', [])]
+
+    arrays = {
+        # Column-major, so that the columns written by each instance are
+        # contiguous (see "copy_case()"):
+        'bus': numpy.asfortranarray(ppc['bus']),
+        'gen': numpy.asfortranarray(ppc['gen']),
+        'branch': numpy.asfortranarray(ppc['branch']),
+        'names': numpy.array(columns['names'], dtype=str),
+        'etypes': columns['codes'],
+        'rows': columns['rows'],
+        'related': columns['related'],
+    }
+    for etype, attrs in static.items():
+        for attr, vals in attrs.items():
+            if attr != 'taps':
+                arrays['%s.%s' % (etype, attr)] = numpy.array(vals)
+    meta = {
+        'version': BINARY_VERSION,
+        'base_mva': ppc['baseMVA'],
+        'etypes': columns['etypes'],
+        'static': {etype: list(attrs) for etype, attrs in static.items()},
+        'taps': taps,
+    }
+
+    # Write to a temporary directory first, so that concurrent simulations
+    # never read an incomplete grid:
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    os.makedirs(tmp)
+    for name, arr in arrays.items():
+        numpy.save(os.path.join(tmp, '%s.npy' % name), arr)
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    if os.path.isdir(path):
+        old = '%s.%d.old' % (path, os.getpid())
+        os.rename(path, old)
+        os.rename(tmp, path)
+        shutil.rmtree(old)
+    else:
+        os.rename(tmp, path)
+
+
+def entity_columns(entities):
+    """Return the *entities* of a compiled case (see :func:`compile_case()`)
+    in a columnar form.
+
+    The result is a dict with the entity *names*, the sorted entity types
+    *etypes*, the index of each entity's type in *etypes* (*codes*), the
+    *rows* of the entities in their matrix, the indices of the two
+    *related* entities of each entity (or ``-1``) and the *static*
+    attributes (a dict mapping each entity type to a dict with one column
+    per attribute; the columns follow the order of *names*).
+
+    """
+    names = list(entities)
+    pos = {name: i for i, name in enumerate(names)}
+    etypes = sorted(set(e['etype'] for e in entities.values()))
+    codes = {etype: i for i, etype in enumerate(etypes)}
+    related = numpy.full((len(names), 2), -1, dtype=numpy.int64)
+    static = {etype: {} for etype in etypes}
+    for i, name in enumerate(names):
+        attrs = entities[name]
+        if 'related' in attrs:
+            related[i] = [pos[n] for n in attrs['related']]
+        for attr, val in attrs['static'].items():
+            static[attrs['etype']].setdefault(attr, []).append(val)
+    for attrs in static.values():
+        for attr, vals in attrs.items():
+            if all(isinstance(v, (bool, int, float)) for v in vals):
+                attrs[attr] = numpy.array(vals)
+    return {
+        'names': names,
+        'etypes': etypes,
+        'codes': numpy.array([codes[entities[n]['etype']] for n in names],
+                             dtype=numpy.int8),
+        'rows': numpy.array([entities[n]['idx'] for n in names],
+                            dtype=numpy.int64),
+        'related': related,
+        'static': static,
+    }
+
+
+def read_binary_case(path):
+    """Read a grid written by :func:`write_binary_case()` and return it
+    like :func:`compile_case()`.
+
+    See :func:`read_binary_columns()` for the matrices.
+
+    """
+    ppc, columns = read_binary_columns(path)
+    names = columns['names']
+    rows = columns['rows'].tolist()
+    related = columns['related'].tolist()
+    entities = dict.fromkeys(names)
+    for code, etype in enumerate(columns['etypes']):
+        members = numpy.flatnonzero(columns['codes'] == code).tolist()
+        static = columns['static'][etype]
+        keys = list(static)
+        values = [col.tolist() if isinstance(col, numpy.ndarray) else col
+                  for col in static.values()]
+        statics = zip(*values) if keys else [()] * len(members)
+        for i, values in zip(members, statics):
+            attrs = {
+                'etype': etype,
+                'idx': rows[i],
+                'static': dict(zip(keys, values)),
+            }
+            if related[i][0] >= 0:
+                attrs['related'] = [names[k] for k in related[i]]
+            entities[names[i]] = attrs
+    return ppc, entities
+
+
+def read_binary_columns(path):
+    """Read a grid written by :func:`write_binary_case()` and return a tuple
+    ``(ppc, columns)`` (see :func:`entity_columns()`).
+
+    The bus, gen and branch matrices, the numerical static attributes and the
+    entities' type codes, rows and related entities are read-only memory
+    maps of the files, so they share their pages with all other simulators
+    that load the same grid.
+
+    """
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    if meta['version'] != BINARY_VERSION:
+        raise ValueError('Unsupported version of binary grid "%s"' % path)
+
+    def load(name):
+        return numpy.load(os.path.join(path, '%s.npy' % name), mmap_mode='r')
+
+    ppc = {
+        'baseMVA': meta['base_mva'],
+        'bus': load('bus'),
+        'gen': load('gen'),
+        'branch': load('branch'),
+    }
+
+    static = {}
+    for etype in meta['etypes']:
+        static[etype] = {}
+        for attr in meta['static'][etype]:
+            if attr == 'taps':
+                col = [dict(t) for t in meta['taps']]
+            else:
+                col = load('%s.%s' % (etype, attr))
+                if col.dtype.kind not in 'biuf':
+                    col = col.tolist()
+            static[etype][attr] = col
+    return ppc, {
+        'names': load('names').tolist(),
+        'etypes': meta['etypes'],
+        'codes': load('etypes'),
+        'rows': load('rows'),
+        'related': load('related'),
+        'static': static,
+    }
+
+
+def read_case_columns(path, sheetnames, cache_dir=None):
+    """Return the compiled case for *path* like :func:`read_case()`, but as
+    a tuple ``(ppc, columns)`` (see :func:`entity_columns()`).
+
+    Binary grids are read without creating the entity dicts.
+
+    """
+    if _is_binary(path):
+        return read_binary_columns(path)
+    ppc, entities = read_case(path, sheetnames, cache_dir)
+    return ppc, entity_columns(entities)
 
 
 def reset_inputs(case):
     """Set the (re)active power demand for all buses to zero."""
-    for bus in case['bus']:
-        bus[idx_bus.PD] = 0
-        bus[idx_bus.QD] = 0
+    case['bus'][:, [idx_bus.PD, idx_bus.QD]] = 0
+
+
+def set_bus_inputs(case, rows, p, q):
+    """Set the (re)active power demand of the buses *rows* in one go.
+
+    *rows* is an index array into ``case['bus']``, *p* and *q* are arrays of
+    the same length with the active [W] and reactive [VAr] power of each bus.
+
+    """
+    bus = case['bus']
+    bus[rows, idx_bus.PD] = numpy.asarray(p, dtype=float) / BUS_PQ_FACTOR
+    bus[rows, idx_bus.QD] = numpy.asarray(q, dtype=float) / BUS_PQ_FACTOR
+
+
+def get_input_state(case):
+    """Return a tuple with copies of the (re)active power demand of all buses
+    and of the taps and states of all branches of *case*."""
+    return (case['bus'][:, [idx_bus.PD, idx_bus.QD]],
+            case['branch'][:, [idx_brch.TAP, idx_brch.BR_STATUS]])
+
+
+def inputs_within(case, state, deadband):
+    """Return ``True`` if the branch inputs of *case* are equal to those in
+    *state* (see :func:`get_input_state()`) and if the (re)active power
+    demand of no bus differs by more than *deadband* (a pair of the PD and
+    QD limits) from it."""
+    bus, branch = get_input_state(case)
+    return bool((branch == state[1]).all() and
+                (abs(bus - state[0]) <= deadband).all())
 
 
 def set_inputs(case, etype, idx, data, static):
+    """Set the inputs *data* of the entity *idx* of type *etype* in *case*.
+
+    Return ``True`` if a branch's status or a transformer's tap changed, so
+    that the admittance matrices of the case need to be rebuilt.
+
+    """
+    changed = False
     if etype == 'PQBus' or etype == 'PowerNode':
         if 'P' in data:
             case['bus'][idx][idx_bus.PD] = data['P'] / BUS_PQ_FACTOR
         if 'Q' in data:
             # Some models may not provide a Q
             case['bus'][idx][idx_bus.QD] = data['Q'] / BUS_PQ_FACTOR
-    elif etype in ('PQBus', 'Transformer'):
+    elif etype in ('Branch', 'Transformer'):
+        branch = case['branch'][idx]
         if 'tap_turn' in data and etype == 'Transformer':
             tap = 1 / static['taps'][data['tap_turn']]
-            case['branch'][idx][idx_brch.TAP] = tap
+            changed = branch[idx_brch.TAP] != tap
+            branch[idx_brch.TAP] = tap
         if 'online' in data:
-            case['branch'][idx][idx_brch.BR_STATUS] = int(data['online'])
+            online = int(data['online'])
+            changed = changed or branch[idx_brch.BR_STATUS] != online
+            branch[idx_brch.BR_STATUS] = online
     else:
         raise ValueError('etype %s unknown' % etype)
+    return bool(changed)
+
 
+def perform_powerflow(case, ppo=None):
+    """Run an AC power flow (Newton's method) for *case* and return the
+    results.
+
+    The solver starts from the voltages in ``case['bus']`` (see
+    :func:`set_start_voltages()`).  Apart from the fields set by PYPOWER's
+    ``runpf()``, the results contain the number of Newton ``'iterations'``.
+
+    Use a :class:`~mosaik_pypower.solver.Solver` to reuse the admittance
+    matrices for multiple power flows of the same case.
+
+    """
+    return solver.Solver(case, ppo).solve()
 
-def perform_powerflow(case):
-    ppo = ppoption(OUT_ALL=0, VERBOSE=0)
-    res = runpf(case, ppo)
-    return res[0]
+
+def set_start_voltages(case, results=None):
+    """Set the voltages that the next power flow for *case* starts from.
+
+    If *results* are the converged results of the previous power flow, use
+    its voltages (warm start).  Else, reset *case* to a flat start.
+
+    """
+    if results is not None and results['success']:
+        case['bus'][:, [idx_bus.VM, idx_bus.VA]] = \
+            results['bus'][:, [idx_bus.VM, idx_bus.VA]]
+    else:
+        case['bus'][:, idx_bus.VM] = 1
+        case['bus'][:, idx_bus.VA] = 0
+
+
+def get_result_index(entity_map):
+    """Group the entities of a single grid in *entity_map* by their type.
+
+    Return a dict mapping each entity type to a tuple ``(eids, rows, vl)``.
+    *eids* is the list of entity IDs, *rows* an array with their row indices
+    in the case's bus or branch matrix and *vl* an array with their nominal
+    voltage [V] (or *nan* for branches).  The results computed by
+    :func:`get_results()` use the same order.
+
+    """
+    groups = {}
+    for eid, attrs in sorted(entity_map.items(), key=lambda i: i[1]['idx']):
+        eids, rows, vl = groups.setdefault(attrs['etype'], ([], [], []))
+        eids.append(eid)
+        rows.append(attrs['idx'])
+        vl.append(attrs['static'].get('Vl', float('nan')))
+
+    return {etype: (eids, numpy.array(rows, dtype=int), numpy.array(vl))
+            for etype, (eids, rows, vl) in groups.items()}
+
+
+def get_results(case, index):
+    """Return the outputs of all entities in *index* for the solved *case*.
+
+    *index* is the result of :func:`get_result_index()`.  Return a dict
+    mapping each entity type to a :class:`Outputs` mapping with one array per
+    output attribute.  The arrays are only computed when they are first
+    accessed.
+
+    """
+    return {etype: Outputs(case, rows, vl, OUTPUTS.get(etype, {}))
+            for etype, (eids, rows, vl) in index.items()}
 
 
 def get_cache_entries(cases, entity_map):
-    cache = {}
+    """Return a dict mapping each eid in *entity_map* to a dict with its
+    outputs computed from the solved *cases*."""
+    grids = {}
     for eid, attrs in entity_map.items():
-        case = case_for_eid(eid, cases)
-        etype = attrs['etype']
-        idx = attrs['idx']
-        data = {}
-
-        if case['success']:
-            if etype == 'RefBus':
-                gen = case['gen'][idx]
-                bus = case['bus'][idx]
-                data['P'] = gen[idx_gen.PG] * BUS_PQ_FACTOR
-                data['Q'] = gen[idx_gen.QG] * BUS_PQ_FACTOR
-                data['Vm'] = bus[idx_bus.VM] * attrs['static']['Vl']
-                data['Va'] = bus[idx_bus.VA]
-            elif etype == 'PQBus' or etype == 'PowerNode':
-                bus = case['bus'][idx]
-                data['P'] = bus[idx_bus.PD] * BUS_PQ_FACTOR
-                data['Q'] = bus[idx_bus.QD] * BUS_PQ_FACTOR
-                data['Vm'] = bus[idx_bus.VM] * attrs['static']['Vl']
-                data['Va'] = bus[idx_bus.VA]
-                # data['excess_pv_power'] = bus[31]
-            elif etype in ('Branch', 'Transformer'):
-                branch = case['branch'][idx]
-
-                # Compute complex current for branches
-                if etype == 'Branch':
-                    fbus = case['bus'][int(branch[idx_brch.F_BUS])]
-                    tbus = case['bus'][int(branch[idx_brch.T_BUS])]
-                    fbus_v = fbus[idx_bus.VM]
-                    tbus_v = tbus[idx_bus.VM]
-                    base_kv = fbus[idx_bus.BASE_KV]
-
-                    # Use side with higher voltage to calculate I
-                    if fbus_v >= tbus_v:
-                        ir = branch[idx_brch.PF] / fbus_v
-                        ii = branch[idx_brch.QF] / fbus_v
-                    else:
-                        ir = branch[idx_brch.PT] / tbus_v
-                        ii = branch[idx_brch.QT] / tbus_v
-
-                    # ir/ii are in [MVA]; [MVA] * 1000 / [kV] = [A]
-                    data['I_real'] = ir * 1000 / base_kv
-                    data['I_imag'] = ii * 1000 / base_kv
-
-                data['P_from'] = branch[idx_brch.PF] * BRANCH_PQ_FACTOR
-                data['Q_from'] = branch[idx_brch.QF] * BRANCH_PQ_FACTOR
-                data['P_to'] = branch[idx_brch.PT] * BRANCH_PQ_FACTOR
-                data['Q_to'] = branch[idx_brch.QT] * BRANCH_PQ_FACTOR
-        else:
-            # Failed to converge.
-            if etype in ('RefBus', 'PQBus', 'PowerNode'):
-                data['P'] = float('nan')
-                data['Q'] = float('nan')
-                data['Vm'] = float('nan')
-                data['Va'] = float('nan')
-                data['excess_pv_power'] = float('nan')
-            elif etype in ('Branch', 'Transformer'):
-                if etype == 'Branch':
-                    data['I_real'] = float('nan')
-                    data['I_imag'] = float('nan')
-                data['P_from'] = float('nan')
-                data['Q_from'] = float('nan')
-                data['P_to'] = float('nan')
-                data['Q_to'] = float('nan')
-
-        cache[eid] = data
+        grids.setdefault(int(eid.split('-')[0]), {})[eid] = attrs
+
+    cache = {}
+    for grid_idx, grid_map in grids.items():
+        index = get_result_index(grid_map)
+        results = get_results(cases[grid_idx], index)
+        for etype, (eids, rows, vl) in index.items():
+            columns = results[etype].items()
+            for i, eid in enumerate(eids):
+                cache[eid] = {attr: col[i] for attr, col in columns}
     return cache
 
 
+def _branch_current(case, rows, vl):
+    """Return the real and imaginary current [A] of the branches *rows*."""
+    branch = case['branch'][rows]
+    bus = case['bus']
+    fbus = bus[branch[:, idx_brch.F_BUS].astype(int)]
+    tbus = bus[branch[:, idx_brch.T_BUS].astype(int)]
+    fbus_v = fbus[:, idx_bus.VM]
+    tbus_v = tbus[:, idx_bus.VM]
+    base_kv = fbus[:, idx_bus.BASE_KV]
+
+    # Use side with higher voltage to calculate I
+    use_from = fbus_v >= tbus_v
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        ir = numpy.where(use_from, branch[:, idx_brch.PF] / fbus_v,
+                         branch[:, idx_brch.PT] / tbus_v)
+        ii = numpy.where(use_from, branch[:, idx_brch.QF] / fbus_v,
+                         branch[:, idx_brch.QT] / tbus_v)
+
+    # ir/ii are in [MVA]; [MVA] * 1000 / [kV] = [A]
+    return ir * 1000 / base_kv, ii * 1000 / base_kv
+
+
+def _column(matrix, col, factor=1):
+    """Return a function that reads column *col* of *matrix* for some rows
+    and multiplies it with *factor*."""
+    return lambda case, rows, vl: case[matrix][rows, col] * factor
+
+
+_BUS_OUTPUTS = {
+    'P': _column('bus', idx_bus.PD, BUS_PQ_FACTOR),
+    'Q': _column('bus', idx_bus.QD, BUS_PQ_FACTOR),
+    'Vm': lambda case, rows, vl: case['bus'][rows, idx_bus.VM] * vl,
+    'Va': _column('bus', idx_bus.VA),
+}
+_TRAFO_OUTPUTS = {
+    'P_from': _column('branch', idx_brch.PF, BRANCH_PQ_FACTOR),
+    'Q_from': _column('branch', idx_brch.QF, BRANCH_PQ_FACTOR),
+    'P_to': _column('branch', idx_brch.PT, BRANCH_PQ_FACTOR),
+    'Q_to': _column('branch', idx_brch.QT, BRANCH_PQ_FACTOR),
+}
+
+# Functions that compute the output attributes of each entity type.  A pair
+# ``(func, i)`` selects the *i*-th of multiple arrays returned by *func*.
+OUTPUTS = {
+    'RefBus': dict(_BUS_OUTPUTS, **{
+        'P': _column('gen', idx_gen.PG, BUS_PQ_FACTOR),
+        'Q': _column('gen', idx_gen.QG, BUS_PQ_FACTOR),
+    }),
+    'PQBus': _BUS_OUTPUTS,
+    'PowerNode': _BUS_OUTPUTS,
+    'Transformer': _TRAFO_OUTPUTS,
+    'Branch': dict(_TRAFO_OUTPUTS, **{
+        'I_real': (_branch_current, 0),
+        'I_imag': (_branch_current, 1),
+    }),
+}
+
+
 def make_eid(name, grid_idx):
     return '%s-%s' % (grid_idx, name)
 
 
+def strip_eid(eid):
+    """Remove the grid index from *eid*."""
+    return eid.split('-', 1)[1]
+
+
 def case_for_eid(eid, case):
     idx = eid.split('-')[0]
     return case[int(idx)]
 
 
+def _get_loader(path):
+    loaders = {
+        '.json': JSON,
+        '.xlsx': Excel,
+    }
+    try:
+        ext = os.path.splitext(path)[-1]
+        return loaders[ext]
+    except KeyError:
+        raise ValueError("Don't know how to open '%s'" % path)
+
+
+def _is_binary(path):
+    return os.path.splitext(os.path.normpath(path))[-1] == BINARY_SUFFIX
+
+
+def _content_hash(path, sheetnames):
+    """Return a hash of the content of *path* and the *sheetnames*.
+
+    The hash also covers the package version and the resource database,
+    because they affect the compiled case, too.
+
+    """
+    sha = hashlib.sha1(b'%d' % COMPILED_CASE_VERSION)
+    sha.update(__version__.encode())
+    for types in [rdb.transformers, rdb.lines, rdb.base_mva]:
+        sha.update(repr(sorted(types.items())).encode())
+    sha.update(json.dumps(sorted(sheetnames.items())).encode())
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def copy_case(case):
+    """Return a copy of *case* with writable copies of its matrices.
+
+    Matrices that are memory maps of a binary grid (see
+    :func:`read_binary_columns()`) are mapped again copy-on-write, so only
+    the pages that the copy writes to are copied.  Since the matrices are
+    stored column-major, these are the pages of the input and voltage
+    columns (PD, QD, VM, VA, TAP and BR_STATUS) and all other columns stay
+    shared.
+
+    """
+    return {
+        'baseMVA': case['baseMVA'],
+        'bus': _copy_matrix(case['bus']),
+        'gen': _copy_matrix(case['gen']),
+        'branch': _copy_matrix(case['branch']),
+    }
+
+
+def _copy_matrix(matrix):
+    if isinstance(matrix, numpy.memmap) and matrix.filename:
+        return numpy.load(matrix.filename, mmap_mode='c')
+    return numpy.array(matrix)
+
+
+def _instantiate_case(compiled, grid_idx):
+    """Return a copy of the *compiled* case and its entity map for the grid
+    *grid_idx*."""
+    ppc, entities = compiled
+    ppc = copy_case(ppc)
+    entity_map = UniqueKeyDict()
+    for name, attrs in entities.items():
+        attrs = dict(attrs, static=dict(attrs['static']))
+        if 'related' in attrs:
+            attrs['related'] = [make_eid(n, grid_idx)
+                                for n in attrs['related']]
+        entity_map[make_eid(name, grid_idx)] = attrs
+    return ppc, entity_map
+
+
 def _get_buses(loader, raw_case, entity_map, grid_idx, sheetnames):
     buses = []
     for idx, (bid, btype, base_kv) in enumerate(loader.buses(raw_case,
                                                              sheetnames)):
         eid = make_eid(bid, grid_idx)
+        etype = BUS_TYPES.get(btype, 'PQBus')
+        if btype == 'NODE':
+            btype = 'PQ'  # Power nodes are PQ buses
         buses.append((idx, btype, base_kv))
-        etype = 'RefBus' if btype == 'REF' else 'PQBus'
         entity_map[eid] = {
             'etype': etype,
             'idx': idx,
@@ -275,6 +774,52 @@ def _make_ppc(base_mva, bus_data, branch_data):
     }
 
 
+class Outputs(collections.abc.Mapping):
+    """Read-only mapping from attribute names to the output arrays of one
+    entity type.
+
+    Each array is computed from *case* when it is first requested and then
+    memoized.  Functions that compute the arrays of multiple attributes at
+    once (see :data:`OUTPUTS`) are only called once.  If the power flow did
+    not converge, all values are *nan*.
+
+    """
+    def __init__(self, case, rows, vl, outputs):
+        self._case = case
+        self._rows = rows
+        self._vl = vl
+        self._outputs = outputs
+        self._columns = {}
+        self._parts = {}  # Results of the functions for multiple attributes
+
+    def __getitem__(self, attr):
+        try:
+            return self._columns[attr]
+        except KeyError:
+            func = self._outputs[attr]
+
+        if self._case['success']:
+            if isinstance(func, tuple):
+                func, i = func
+                if func not in self._parts:
+                    self._parts[func] = func(self._case, self._rows,
+                                             self._vl)
+                col = self._parts[func][i]
+            else:
+                col = func(self._case, self._rows, self._vl)
+        else:
+            # Failed to converge.
+            col = numpy.full(len(self._rows), float('nan'))
+        self._columns[attr] = col
+        return col
+
+    def __iter__(self):
+        return iter(self._outputs)
+
+    def __len__(self):
+        return len(self._outputs)
+
+
 class UniqueKeyDict(dict):
     """A :class:`dict` that won't let you insert the same key twice."""
     def __setitem__(self, key, value):
@@ -345,68 +890,64 @@ class JSON:
 
 
 class Excel:
-    """Namespace that provides functions for loading cases in the JSON format.
+    """Namespace that provides functions for loading cases in the Excel
+    format.
     """
+    # Workbooks by file path and modification time
     cache = {}
 
     def open(path):
+        key = (path, os.stat(path).st_mtime_ns)
         try:
-            return Excel.cache[path]
+            return Excel.cache[key]
         except KeyError:
-            wb = xlrd.open_workbook(path, on_demand=True)
-            Excel.cache[path] = wb
+            wb = xlsx.Workbook(path)
+            Excel.cache[key] = wb
             return wb
 
     def buses(wb, sheetnames):
-        sheet = Excel._sheet(wb, 'bus', sheetnames)
-        for bus_id, bus_type, base_kv in Excel._iter(sheet, 3):
+        for bus_id, bus_type, base_kv in Excel._rows(wb, 'bus', sheetnames,
+                                                     3):
             if type(bus_id) is float:
                 bus_id = str(int(bus_id))
             yield (bus_id, bus_type, base_kv)
 
     def branches(wb, entity_map, sheetnames):
-        # Get trafo dB
-        try:
-            sheet = Excel._sheet(wb, 'trafo_types', sheetnames)
-            data = Excel._iter(sheet, len(rdb.Transformer._fields) + 1)
-            # Parse transformer taps:
-            data = (d[:-1] + [eval(d[-1])] for d in data)
-        except XLRDError:
-            data = []
+        # Get trafo DB
         trafos = dict(rdb.transformers)
-        trafos.update((n, rdb.Transformer(*d)) for n, *d in data)
+        if Excel._has_sheet(wb, 'trafo_types', sheetnames):
+            data = Excel._rows(wb, 'trafo_types', sheetnames,
+                               len(rdb.Transformer._fields) + 1)
+            # Parse transformer taps:
+            trafos.update((n, rdb.Transformer(*d, xlsx.parse_taps(taps)))
+                          for n, *d, taps in data)
 
         # Get line DB
-        try:
-            sheet = Excel._sheet(wb, 'branch_types', sheetnames)
-            data = Excel._iter(sheet, len(rdb.Line._fields) + 1)
-        except XLRDError:
-            data = []
-        data = list(data)
         lines = dict(rdb.lines)
-        lines.update((n, rdb.Line(*d)) for n, *d in data)
+        if Excel._has_sheet(wb, 'branch_types', sheetnames):
+            data = Excel._rows(wb, 'branch_types', sheetnames,
+                               len(rdb.Line._fields) + 1)
+            lines.update((n, rdb.Line(*d)) for n, *d in data)
 
-        sheet = Excel._sheet(wb, 'branch', sheetnames)
-        for bid, fbus, tbus, btype, l, online, tap in Excel._iter(sheet, 7):
+        for bid, fbus, tbus, btype, l, online, tap in Excel._rows(
+                wb, 'branch', sheetnames, 7):
             if type(bid) is float:
                 bid = str(int(bid))
-            try:
-                info = trafos[btype]
-                is_trafo = True
-            except KeyError:
+            info = trafos.get(btype)
+            is_trafo = info is not None
+            if not is_trafo:
                 info = lines[btype]
-                is_trafo = False
             yield (is_trafo, bid, fbus, tbus, l, info, online, tap)
 
     def base_mva(raw_case, buses):
         return rdb.base_mva.get(buses[0][BUS_BASE_KV], 1)
 
-    def _iter(sheet, ncols):
-        for i in range(1, sheet.nrows):
-            if str(sheet.cell_value(i, 0)).startswith('#'):
-                continue
-            yield sheet.row_values(i)[:ncols]
+    def _rows(wb, name, sheetnames, ncols):
+        """Return the first *ncols* columns of all rows of a sheet except for
+        the header and comments (rows starting with ``#``)."""
+        rows = wb.rows(sheetnames.get(name, DEFAULT_SHEETS[name]))
+        return [row[:ncols] + [''] * (ncols - len(row)) for row in rows[1:]
+                if not str(row[0]).startswith('#')]
 
-    def _sheet(wb, name, sheetnames):
-        name = sheetnames.get(name, DEFAULT_SHEETS[name])
-        return wb.sheet_by_name(name)
+    def _has_sheet(wb, name, sheetnames):
+        return sheetnames.get(name, DEFAULT_SHEETS[name]) in wb.sheet_names
@@ -5,15 +5,47 @@ This module implements the mosaik API for `PYPOWER
 """
 from __future__ import division
 
+from fnmatch import fnmatchcase
+from concurrent.futures import ThreadPoolExecutor
+import base64
+import copy
 import logging
 import os
 
 import mosaik_api
+import numpy
 
 from mosaik_pypower import model
+from mosaik_pypower.aggregation import InputAggregator
+from mosaik_pypower.metrics import PHASES, StepMetrics
+from mosaik_pypower.parallel import make_pool
+from mosaik_pypower.powernode import PowerNodes
+from mosaik_pypower.registry import ETYPES, EntityRegistry, load_grid
+from mosaik_pypower.solver import (BATCH_SOLVERS, SOLVERS, BatchSolver,
+                                   LinearizedSolver, ResultCache,
+                                   make_ppoption)
 
 logger = logging.getLogger('pypower.mosaik')
 
+# Input attributes that are written into the bus and branch matrices:
+BUS_INPUTS = ('P', 'Q', 'container_need')
+BRANCH_INPUTS = ('tap_turn', 'online')
+
+# Outputs of the power nodes' energy management:
+NODE_OUTPUTS = ('battery_action', 'net_metering_power', 'grid_energy')
+
+# Default patterns for the IDs of the power nodes' input sources:
+NODE_SOURCES = {
+    'pv': 'CSV-*.PV_*',
+    'battery': 'BatterySimulator-*',
+    'container_need': 'ComputeNodeSimulator-*',
+}
+
+STEP_MODES = ('time-based', 'event-based', 'hybrid')
+
+# Models with inputs that trigger a step if the simulator isn't time-based:
+INPUT_MODELS = model.BUS_INPUT_TYPES + ('Transformer', 'Branch')
+
 meta = {
     'type': 'time-based',
     'models': {
@@ -23,7 +55,23 @@ meta = {
                 'gridfile',  # Name of the file containing the grid topology.
                 'sheetnames',  # Mapping of Excel sheet names, optional.
             ],
-            'attrs': [],
+            'attrs': [
+                'iterations',  # Solver iterations of the last power flow
+                'mismatch',  # Largest power mismatch of the last results [pu]
+                'cache_hits',  # Steps that reused previous results
+                'cache_misses',  # Steps that needed a power flow
+                'approximated',  # Whether the last results were estimated
+                # Wall times of the last step (all grids) [s] (timing=True):
+                't_step',  # Total
+                't_inputs',  # Aggregating and setting the inputs
+                't_reset',  # Writing the bus inputs into the cases
+                't_lookup',  # Looking up reusable results
+                't_solve',  # Power flows
+                't_results',  # Post-processing the results
+                't_get_data',  # The last "get_data()" call
+                'n_entities',  # Number of entities in the grid
+                'n_inputs',  # Number of entities with inputs in the last step
+            ],
         },
         'RefBus': {
             'public': False,
@@ -104,9 +152,32 @@ meta = {
             ],
         },
     },
+    'extra_methods': [
+        'get_eids',  # Entity IDs of one type in the order of "get_array()"
+        'get_array',  # One attribute of all entities of a type (packed)
+    ],
 }
 
 
+def make_meta(step_mode):
+    """Return a copy of :data:`meta` for the simulator type *step_mode*.
+
+    If the simulator isn't time-based, the inputs trigger a step and all
+    attributes are persistent, because they keep their values until the next
+    step.
+
+    """
+    result = copy.deepcopy(meta)
+    result['type'] = step_mode
+    if step_mode != 'time-based':
+        for name, desc in result['models'].items():
+            if name in INPUT_MODELS:
+                desc['trigger'] = [attr for attr in BUS_INPUTS + BRANCH_INPUTS
+                                   if attr in desc['attrs']]
+            desc['persistent'] = list(desc['attrs'])
+    return result
+
+
 class PyPower(mosaik_api.Simulator):
     def __init__(self):
         super(PyPower, self).__init__(meta)
@@ -118,222 +189,478 @@ class PyPower(mosaik_api.Simulator):
         # this attribute must be set to -1.
         self.pos_loads = None
 
-        self._entities = {}
+        self._registry = EntityRegistry()  # The entities of all grids
         self._relations = []  # List of pair-wise related entities (IDs)
         self._ppcs = []  # The pypower cases
-        self._cache = {}  # Cache for load flow outputs
+        self._solvers = []  # The power flow solvers (of one or more cases)
+        self._grid_solvers = []  # The solver of each case
+        self._solver_grids = []  # The grid indices of each solver
+        self._memos = []  # Cache with previous results of each grid
+        self._memo_size = 0
+        self._memo_tolerance = 0
+        self._approx_interval = 0
+        self._approx_max_change = 0
+        self._deadband = None  # Max. PD/QD changes that don't need a solve
+        self._solved = []  # Inputs and results of each grid's last solve
+        self._last_inputs = {}  # Inputs of the previous steps (event-based)
+        self._metrics = None  # Measures the step phases if timing is enabled
+        self._solver_cls = SOLVERS['auto']
+        self._batch_solver_cls = BATCH_SOLVERS['auto']
+        self._ppo = make_ppoption()  # PYPOWER options of the solvers
+        self._batch = False
+        self._case_cache = None  # Directory for compiled cases
+        self._pool = make_pool(None)  # Runs the solvers of all grids
+        self._pipeline = None  # Runs the power flows in the background
+        self._pending = None  # Future of the running power flows
+        self._results = {}  # Load flow outputs (arrays) of each grid
+        self._grids = {}  # Maps the eids of the grids to their index
+        self._grid_stats = []  # Solver statistics of each grid
 
-        self.container_need = 0
-        self.pv_power = 0
-        self.battery_power = 0
         self.battery_max_capacity = None
-        self.battery_action = None
-        self.net_metering_power = 0
-        self.grid_energy = 0
-
-    def init(self, sid, time_resolution, step_size, battery_capacity,
-             pos_loads=True, converge_exception=False):
-        logger.debug('Power flow will be computed every %d seconds.' %
-                     step_size)
+        self._nodes = PowerNodes()  # Energy management of the power nodes
+        self._node_sources = NODE_SOURCES
+        self._source_kinds = {}  # Maps source IDs to their kind (see above)
+        # Sums up the inputs of each step:
+        self._aggregator = InputAggregator(
+            self._registry, BUS_INPUTS + BRANCH_INPUTS, self._nodes)
+
+    def init(self, sid, time_resolution, step_size, battery_capacity=None,
+             node_sources=None, pos_loads=True, converge_exception=False,
+             warm_start=False, solver='auto', parallel=None, workers=None,
+             batch=False, case_cache=None, memoize=0, memo_tolerance=0,
+             approx_interval=0, approx_max_change=100000,
+             step_mode='time-based', deadband=None, timing=False,
+             metrics_file=None, tolerance=None, max_iterations=None,
+             algorithm='NR', enforce_q_limits=False, pipeline=False):
+        if step_mode not in STEP_MODES:
+            raise ValueError('Unknown step mode: "%s"' % step_mode)
+        self.meta.update(make_meta(step_mode))
+        if step_size:
+            logger.debug('Power flow will be computed every %d seconds.' %
+                         step_size)
+        else:
+            logger.debug('Power flow will be computed when inputs arrive.')
         signs = ('positive', 'negative')
         logger.debug('Loads will be %s numbers, feed-in %s numbers.' %
                      signs if pos_loads else tuple(reversed(signs)))
 
         self.step_size = step_size
+        # Battery capacity of all (or of each) power node(s):
         self.battery_max_capacity = battery_capacity
+        if node_sources is not None:
+            unknown = set(node_sources) - set(NODE_SOURCES)
+            if unknown:
+                raise ValueError('Unknown node source(s): %s' %
+                                 ', '.join(sorted(unknown)))
+            self._node_sources = dict(NODE_SOURCES, **node_sources)
         self.pos_loads = 1 if pos_loads else -1
         self._converge_exception = converge_exception
+        # Start each power flow from the previous step's voltages:
+        self._warm_start = warm_start
+        try:
+            self._solver_cls = SOLVERS[solver]
+            self._batch_solver_cls = BATCH_SOLVERS[solver]
+        except KeyError:
+            raise ValueError('Unknown solver: "%s"' % solver)
+        # Convergence tolerance [pu], iteration limit and algorithm of the
+        # power flows (PYPOWER's defaults if not set):
+        self._ppo = make_ppoption(tolerance, max_iterations, algorithm,
+                                  enforce_q_limits)
+        # Solve all instances created by one "create()" call together:
+        self._batch = batch
+        self._case_cache = case_cache
+        # Reuse the results of the last *memoize* operating points per grid:
+        self._memo_size = memoize
+        self._memo_tolerance = memo_tolerance / model.BUS_PQ_FACTOR
+        # Estimate the power flows with the sensitivities of the last full
+        # power flow and run a full one at least every *approx_interval*
+        # steps:
+        self._approx_interval = approx_interval
+        self._approx_max_change = approx_max_change / model.BUS_PQ_FACTOR
+        # Only solve a grid if a bus input changed by more than the deadband
+        # of its attribute or if a branch input changed:
+        if deadband is not None:
+            unknown = set(deadband) - {'P', 'Q'}
+            if unknown:
+                raise ValueError('No deadband for attribute(s): %s' %
+                                 ', '.join(sorted(unknown)))
+            self._deadband = numpy.array([deadband.get('P', 0),
+                                          deadband.get('Q', 0)],
+                                         dtype=float) / model.BUS_PQ_FACTOR
+        self._pool = make_pool(parallel, workers)
+        # Solve in a background thread and only wait for the results when
+        # they are needed:
+        if pipeline:
+            self._pipeline = ThreadPoolExecutor(1)
+        # Measure the wall time of each step's phases and optionally append
+        # them to a file (one JSON object per line):
+        if timing or metrics_file:
+            self._metrics = StepMetrics(metrics_file)
 
         return self.meta
 
     def create(self, num, modelname, gridfile, sheetnames=None):
         if modelname != 'Grid':
             raise ValueError('Unknown model: "%s"' % modelname)
-        if not os.path.isfile(gridfile):
+        if not os.path.exists(gridfile):
             raise ValueError('File "%s" does not exist!' % gridfile)
 
         if not sheetnames:
             sheetnames = {}
 
+        self._wait()  # Don't change the grids while they are solved
         grids = []
+        ppcs = []
         for i in range(num):
             grid_idx = len(self._ppcs)
-            ppc, entities = model.load_case(gridfile, grid_idx, sheetnames)
+            ppc, layout = load_grid(gridfile, sheetnames, self._case_cache)
+            ppc = model.copy_case(ppc)
             self._ppcs.append(ppc)
-
-            children = []
-            for eid, attrs in sorted(entities.items()):
-                assert eid not in self._entities
-                self._entities[eid] = attrs
-
-                # We'll only add relations from branches to nodes (and not from
-                # nodes to branches) because this is sufficient for mosaik to
-                # build the entity graph.
-                relations = []
-                if attrs['etype'] in ['Transformer', 'Branch']:
-                    relations = attrs['related']
-
-                if "node_a1" in eid:
-                    attrs['etype'] = 'PowerNode'
-
-                children.append({
-                    'eid': eid,
-                    'type': attrs['etype'],
-                    'rel': relations,
-                })
+            ppcs.append(ppc)
+            self._registry.add(grid_idx, layout)
+            children = self._registry.children(grid_idx)
+            nodes = [c['eid'] for c in children if c['type'] == 'PowerNode']
+            if nodes:
+                if self.battery_max_capacity is None:
+                    raise ValueError('"battery_capacity" must be set for '
+                                     'grids with power nodes.')
+                self._nodes.add(nodes, self.battery_max_capacity)
+
+            grid_eid = model.make_eid('grid', grid_idx)
+            self._grids[grid_eid] = grid_idx
+            stats = {'iterations': 0, 'mismatch': 0., 'cache_hits': 0,
+                     'cache_misses': 0, 'approximated': False,
+                     'n_entities': len(layout), 'n_inputs': 0,
+                     't_step': 0.}
+            stats.update(('t_%s' % phase, 0.) for phase in PHASES)
+            self._grid_stats.append(stats)
+            self._memos.append(ResultCache(self._memo_size,
+                                           self._memo_tolerance))
+            self._solved.append(None)
 
             grids.append({
-                'eid': model.make_eid('grid', grid_idx),
+                'eid': grid_eid,
                 'type': 'Grid',
                 'rel': [],
                 'children': children,
             })
 
+        grid_idxs = list(range(len(self._ppcs) - num, len(self._ppcs)))
+        if self._batch and num > 1:
+            solvers = [BatchSolver(ppcs, self._ppo,
+                                   factory=self._batch_solver_cls)]
+            solver_grids = [grid_idxs]
+        else:
+            solvers = [self._solver_cls(ppc, self._ppo) for ppc in ppcs]
+            solver_grids = [[i] for i in grid_idxs]
+        if self._approx_interval > 0:
+            solvers = [LinearizedSolver(s, self._approx_max_change,
+                                        self._approx_interval)
+                       for s in solvers]
+        for solver, idxs in zip(solvers, solver_grids):
+            self._grid_solvers.extend(solver for _ in idxs)
+        self._solvers.extend(solvers)
+        self._solver_grids.extend(solver_grids)
+
         return grids
 
     def step(self, time, inputs, max_advance):
-        for ppc in self._ppcs:
+        self._wait()
+        metrics = self._metrics
+        if metrics is not None:
+            metrics.start()
+
+        if self.meta['type'] != 'time-based':
+            # Only changed inputs are sent, so remember the other ones:
+            inputs = self._merge_inputs(inputs)
+
+        # Sum up the values of all inputs at once and write the bus inputs
+        # into each case with a single scatter operation:
+        aggregator = self._aggregator
+        aggregator.update(inputs)
+        for eid in aggregator.nodes:
+            self._set_node_inputs(eid, inputs[eid])
+        sums = aggregator.sums(inputs)
+        for eid, grid_idx, code, idx, slots in aggregator.others:
+            data = {name: float(sums[slot]) for name, slot in slots.items()}
+            if model.set_inputs(self._ppcs[grid_idx], ETYPES[code], idx,
+                                data, self._registry.static(eid)):
+                self._grid_solvers[grid_idx].invalidate()
+        self._nodes.step()
+        if metrics is not None:
+            metrics.lap('inputs')
+
+        for ppc, (rows, p, q) in zip(self._ppcs, aggregator.bus_inputs):
             model.reset_inputs(ppc)
+            # Some models may not provide a Q (its slot is then "0"):
+            model.set_bus_inputs(ppc, rows, sums[p] * self.pos_loads, sums[q])
+        if metrics is not None:
+            metrics.lap('reset')
 
-        for eid, attrs in inputs.items():
-            ppc = model.case_for_eid(eid, self._ppcs)
-            idx = self._entities[eid]['idx']
-            etype = self._entities[eid]['etype']
-            static = self._entities[eid]['static']
-            for name, values in attrs.items():
-                # values is a dict of p/q values, sum them up
-                attrs[name] = sum(float(v) for v in values.values())
-                if name == 'P' and eid == '0-node_a1':
-                    attrs[name] *= self.pos_loads
-                    if values['CSV-0.PV_0'] is None or values['BatterySimulator-0.battery'] is None:
-                        raise RuntimeError('[P] input value expected from battery and PV nodes.')
-
-                    self.pv_power = abs(values['CSV-0.PV_0'])
-                    self.battery_power = values['BatterySimulator-0.battery']
-
-                elif name == 'container_need' and eid == '0-node_a1':
-                    if values['ComputeNodeSimulator-0.computeNode'] is None:
-                        raise RuntimeError('[container_need] input value expected from compute node.')
-                    self.container_need = values['ComputeNodeSimulator-0.computeNode']
-
-                else:
-                    print('Unexpected attribute requested {}'.format(attrs.items()))
-                    raise RuntimeError('Unexpected attribute requested {}'.format(attrs.items()))
-
-            model.set_inputs(ppc, etype, idx, attrs, static)
-
-        self.handle_power_input()
-
-        res = []
-        for ppc in self._ppcs:
-            res.append(model.perform_powerflow(ppc))
-            if self._converge_exception and not res[-1]['success']:
+        if self._pipeline is not None:
+            self._pending = self._pipeline.submit(self._solve, time)
+        else:
+            self._solve(time)
+
+        if self.meta['type'] == 'time-based' or self.step_size:
+            return time + self.step_size
+        return None
+
+    def _solve(self, time):
+        """Run the power flows for the current inputs and process their
+        results."""
+        metrics = self._metrics
+        # Keep the results of grids whose inputs stayed within the deadband,
+        # look up the results of grids whose inputs did not change and only
+        # run the solvers of the remaining grids:
+        keys = [None] * len(self._ppcs)
+        cached = [None] * len(self._ppcs)
+        unchanged = [False] * len(self._ppcs)
+        for grid_idx, ppc in enumerate(self._ppcs):
+            solved = self._solved[grid_idx]
+            if (self._deadband is not None and solved is not None and
+                    model.inputs_within(ppc, solved[0], self._deadband)):
+                cached[grid_idx] = solved[1]
+                unchanged[grid_idx] = True
+            elif self._memo_size > 0:
+                memo = self._memos[grid_idx]
+                keys[grid_idx] = memo.key(ppc)
+                cached[grid_idx] = memo.get(keys[grid_idx])
+                self._grid_stats[grid_idx]['cache_hits'] = memo.hits
+                self._grid_stats[grid_idx]['cache_misses'] = memo.misses
+        todo = [i for i, grids in enumerate(self._solver_grids)
+                if any(cached[g] is None for g in grids)]
+
+        if metrics is not None:
+            metrics.lap('lookup')
+        results = self._pool.solve([self._solvers[i] for i in todo])
+        if metrics is not None:
+            metrics.lap('solve')
+        solved = [g for i in todo for g in self._solver_grids[i]]
+        for grid_idx, res in zip(solved, results):
+            if cached[grid_idx] is not None:
+                continue  # Solved as part of a batch
+            ppc = self._ppcs[grid_idx]
+            stats = self._grid_stats[grid_idx]
+            stats['iterations'] = res['iterations']
+            stats['mismatch'] = res['mismatch']
+            stats['approximated'] = bool(res['approximated'])
+            if res['approximated']:
+                logger.debug('Power flow for grid %d was approximated.' %
+                             grid_idx)
+            else:
+                logger.debug('Power flow for grid %d took %d iterations '
+                             '(mismatch: %g pu).' %
+                             (grid_idx, res['iterations'], res['mismatch']))
+            if self._warm_start:
+                # Fall back to a flat start if the power flow failed
+                model.set_start_voltages(ppc, res)
+            if self._converge_exception and not res['success']:
                 raise RuntimeError(
                     'Loadflow did not converge for eid "%s" at time %i!' %
-                    (eid, time))
-        self._cache = model.get_cache_entries(res, self._entities)
-
-        return time + self.step_size
+                    (model.make_eid('grid', grid_idx), time))
+            self._results[grid_idx] = model.get_results(
+                res, self._registry.layouts[grid_idx].index)
+            entry = (res, self._results[grid_idx])
+            if (self._memo_size > 0 and res['success'] and
+                    not res['approximated']):
+                self._memos[grid_idx].put(keys[grid_idx], entry)
+            self._solved[grid_idx] = None
+            if res['success']:
+                self._solved[grid_idx] = (model.get_input_state(ppc), entry)
+
+        for grid_idx, entry in enumerate(cached):
+            if entry is None:
+                continue
+            if not unchanged[grid_idx]:
+                self._solved[grid_idx] = (
+                    model.get_input_state(self._ppcs[grid_idx]), entry)
+            res, self._results[grid_idx] = entry
+            self._grid_stats[grid_idx]['iterations'] = 0
+            self._grid_stats[grid_idx]['mismatch'] = res['mismatch']
+            self._grid_stats[grid_idx]['approximated'] = False
+            if self._warm_start:
+                model.set_start_voltages(self._ppcs[grid_idx], res)
+
+        for stats, n in zip(self._grid_stats, self._aggregator.n_inputs):
+            stats['n_inputs'] = n
+        if metrics is not None:
+            metrics.lap('results')
+            self._record_metrics(time)
+
+    def _wait(self):
+        """Wait until the power flows of a pipelined step are done.
+
+        Exceptions raised by the power flows (e.g., if they did not
+        converge) are raised here.
+
+        """
+        if self._pending is not None:
+            pending, self._pending = self._pending, None
+            pending.result()
+
+    def _merge_inputs(self, inputs):
+        """Update the inputs of the previous steps with *inputs* and return
+        all of them."""
+        for eid, attrs in inputs.items():
+            known = self._last_inputs.setdefault(eid, {})
+            for attr, values in attrs.items():
+                known.setdefault(attr, {}).update(values)
+        return self._last_inputs
+
+    def _set_node_inputs(self, eid, attrs):
+        """Pass the inputs of the power node *eid* to the energy management.
+
+        The PV and battery power are taken from the *P* inputs and the
+        container need from the *container_need* inputs of the sources that
+        match the node source patterns.  Other sources (e.g., loads) are
+        ignored here, but their *P* is still part of the bus' power.
+
+        Raise a :exc:`RuntimeError` if an attribute has no value (or
+        ``None``) from a source of one of the expected kinds.
+
+        """
+        inputs = {}
+        for attr, kinds in [('P', ('pv', 'battery')),
+                            ('container_need', ('container_need',))]:
+            if attr not in attrs:
+                continue
+            values = {kind: [] for kind in kinds}
+            for src, val in attrs[attr].items():
+                kind = self._source_kind(src)
+                if kind in values:
+                    values[kind].append(val)
+            for kind, vals in values.items():
+                if not vals or None in vals:
+                    raise RuntimeError('[%s] input value expected from %s '
+                                       'source(s) of node "%s".' %
+                                       (attr, kind, eid))
+                inputs[kind] = sum(vals)
+
+        self._nodes.set_inputs(eid, inputs.get('pv'), inputs.get('battery'),
+                               inputs.get('container_need'))
+
+    def _source_kind(self, src):
+        """Return the kind of the input source *src* (see
+        :data:`NODE_SOURCES`) or ``None``."""
+        try:
+            return self._source_kinds[src]
+        except KeyError:
+            kind = next((k for k, pattern in self._node_sources.items()
+                         if fnmatchcase(src, pattern)), None)
+            self._source_kinds[src] = kind
+            return kind
+
+    def _record_metrics(self, time):
+        """Copy the step's phase times to the grid stats and write them to
+        the metrics file."""
+        metrics = self._metrics
+        times = {'t_%s' % p: t for p, t in metrics.times.items()}
+        times['t_step'] = metrics.step_time
+        for stats in self._grid_stats:
+            stats.update(times)
+        metrics.write({
+            'time': time,
+            'iterations': [s['iterations'] for s in self._grid_stats],
+            'n_inputs': [s['n_inputs'] for s in self._grid_stats],
+        })
 
     def get_data(self, outputs):
+        self._wait()
+        if self._metrics is not None:
+            self._metrics.start()
         data = {}
+        results = self._results
+        lookup = self._registry.lookup
         for eid, attrs in outputs.items():
+            if eid in self._grids:
+                stats = self._grid_stats[self._grids[eid]]
+                data[eid] = {attr: stats[attr] for attr in attrs}
+                continue
+
+            grid_idx, code, row, pos = lookup(eid)
+            outs = results.get(grid_idx, {}).get(ETYPES[code], {})
             for attr in attrs:
-                if attr == 'battery_action':
-                    val = self.battery_action
-                    if val is not None:
-                        print('self.battery_action = {}'.format(self.battery_action))
-                    self.battery_action = None
-                elif attr == 'net_metering_power':
-                    val = self.net_metering_power
-                    if val > 0:
-                        print('self.net_metering_power = {}'.format(self.net_metering_power))
-                    self.net_metering_power = 0
-                elif attr == 'grid_energy':
-                    val = self.grid_energy
-                    if val > 0:
-                        print('self.grid_energy = {}'.format(self.grid_energy))
-                    self.grid_energy = 0
+                if attr in NODE_OUTPUTS:
+                    val = self._nodes.get(eid, attr)
                 else:
                     try:
-                        val = self._cache[eid][attr]
+                        val = float(outs[attr][pos])
                         if attr == 'P':
                             val *= self.pos_loads
                     except KeyError:
-                        val = self._entities[eid]['static'][attr]
+                        val = self._registry.static_value(eid, attr)
                 data.setdefault(eid, {})[attr] = val
 
+        if self._metrics is not None:
+            self._metrics.lap('get_data')
+            for stats in self._grid_stats:
+                stats['t_get_data'] = self._metrics.times['get_data']
         return data
 
-    def handle_power_input(self):
-
-        if self.pv_power == 0 and self.battery_power == 0:
-            self.grid_energy = self.container_need
-
-        else:
-            if self.pv_power > 0:
-                if self.pv_power >= self.container_need:
-                    #print('pv power is larger than or equal to container node need')
-                    pv_extra_power = self.pv_power - self.container_need
-                    if pv_extra_power == 0:
-                        #print('pv power and container need are equal, no pv extra power, do nothing')
-                        self.battery_action = 'noAction'
-
-                    if pv_extra_power > 0:
-                       # print('still have extra pv power, checking battery')
-                        battery_full_charge_need = self.battery_max_capacity - self.battery_power
-                        if battery_full_charge_need > 0:
-                            #print('battery not full [current charge = {}], going to charge it'.format(self.battery_power))
-                            if battery_full_charge_need >= pv_extra_power:
-                                #print('using all pv extra power [{}] to charge battery'.format(pv_extra_power))
-                                self.battery_action = 'charge:' + str(pv_extra_power)
-                            else:
-                                #print('we have more pv extra power than the battery needs, using some of the pv extra power [{}] to charge battery and the rest will be net-metered'.format(battery_full_charge_need))
-                                self.battery_action = 'charge:' + str(battery_full_charge_need)
-                                pv_extra_power = pv_extra_power - battery_full_charge_need
-                                print('using rest of pv extra power [{}] for net-metering'.format(pv_extra_power))
-                                self.net_metering_power += pv_extra_power
-                else:
-                    # print('pv extra power less than container need, we need to use battery to cover, checking battery')
-                    needed_extra_power = self.container_need - self.pv_power
-                    if self.battery_power > 0:
-                        #print('battery has [{}] power, will use some or all for the container'.format(self.battery_power))
-                        battery_extra_power = self.battery_power - needed_extra_power
-                        if battery_extra_power >= 0:
-                            #print('battery has sufficient power to cover container need [{}]'.format(self.container_need))
-                            self.battery_action = 'discharge:' + str(needed_extra_power)
-                        else:
-                            #print('battery power does not cover container need [{}], will take it all and cover the rest from the grid'.format(self.container_need))
-                            self.battery_action = 'discharge:' + str(self.battery_power)
-                            # todo: take power from the grid (equal to abs(battery_extra_power)), do something? coded!
-                            self.grid_energy = abs(battery_extra_power)
-                    else: # self.battery_power = 0
-                        #print('battery is empty, will use grid power')
-                        self.grid_energy = needed_extra_power
-
-            else:
-                #print('no pv_power, will check battery')
-                if self.battery_power > 0:
-                    #print('battery has [{}] power, will use some or all for the container'.format(self.battery_power))
-                    battery_extra_power = self.battery_power - self.container_need
-                    if battery_extra_power >= 0:
-                        #print('battery has sufficient power to cover container need [{}]'.format(self.container_need))
-                        self.battery_action = 'discharge:' + str(self.container_need)
-                    else:
-                        #print('battery power does not cover container need [{}], will take it all and cover the rest from the grid'.format(self.container_need))
-                        self.battery_action = 'discharge:' + str(self.battery_power)
-                        self.grid_energy = abs(battery_extra_power)
-                else:
-                    #print('battery is empty, will use grid power')
-                    self.grid_energy = self.container_need
-
-
-def get_control_node(entities):
-    for item in entities.items():
-        if item[0] == '0-node_a1':
-            return item
-    else:
-        raise ValueError('Grid node 0-node_a1 not found')
+    def get_eids(self, grid, etype):
+        """Return the IDs of all entities of type *etype* in the grid with
+        the entity ID *grid* in the order used by :meth:`get_array()`.
+
+        The order does not change, so the IDs only need to be queried once.
+
+        """
+        grid_idx = self._grid_index(grid)
+        names = self._registry.layouts[grid_idx].index.get(etype, ([],))[0]
+        return [model.make_eid(name, grid_idx) for name in names]
+
+    def get_array(self, grid, etype, attr, start=0, stop=None):
+        """Return the attribute *attr* of the entities
+        ``get_eids(grid, etype)[start:stop]`` as packed array (see
+        :func:`pack_array()`).
+
+        *attr* can be any numerical output or static attribute of *etype*.
+        Raise a :exc:`ValueError` if the entities don't have it.
+
+        """
+        self._wait()
+        grid_idx = self._grid_index(grid)
+        layout = self._registry.layouts[grid_idx]
+        if etype not in layout.index:
+            return pack_array([])
+        try:
+            values = self._results[grid_idx][etype][attr]
+        except KeyError:
+            values = layout.static[etype].get(attr)
+            if not isinstance(values, numpy.ndarray):
+                raise ValueError('No numerical attribute "%s" for %s '
+                                 'entities' % (attr, etype))
+        values = numpy.asarray(values[start:stop], dtype=float)
+        if attr == 'P':
+            values = values * self.pos_loads
+        return pack_array(values)
+
+    def _grid_index(self, grid):
+        try:
+            return self._grids[grid]
+        except KeyError:
+            raise ValueError('Unknown grid: "%s"' % grid)
+
+    def finalize(self):
+        if self._pipeline is not None:
+            self._pipeline.shutdown()
+            self._wait()
+        self._pool.close()
+        if self._metrics is not None:
+            self._metrics.close()
+
+
+def pack_array(values):
+    """Return the float array *values* as base64 encoded string of
+    little-endian doubles, so that it can be sent to mosaik as a single
+    JSON value."""
+    data = numpy.asarray(values, dtype='<f8').tobytes()
+    return base64.b64encode(data).decode('ascii')
+
+
+def unpack_array(data):
+    """Return the float array packed by :func:`pack_array()`."""
+    return numpy.frombuffer(base64.b64decode(data), dtype='<f8')
 
 
 def main():
@@ -0,0 +1,201 @@
+"""
+This module contains pools that run the power flows of multiple independent
+grids (:class:`~mosaik_pypower.solver.Solver` or
+:class:`~mosaik_pypower.solver.BatchSolver` instances) in parallel.
+
+"""
+from concurrent.futures import ThreadPoolExecutor
+import multiprocessing
+import os
+
+from pypower import idx_bus, idx_brch, idx_gen
+import numpy
+
+
+# Columns of the case matrices that are sent to or received from a worker
+BUS_INPUTS = [idx_bus.PD, idx_bus.QD, idx_bus.VM, idx_bus.VA]
+BRANCH_INPUTS = [idx_brch.TAP, idx_brch.BR_STATUS]
+BUS_RESULTS = [idx_bus.VM, idx_bus.VA]
+GEN_RESULTS = [idx_gen.PG, idx_gen.QG]
+BRANCH_RESULTS = [idx_brch.PF, idx_brch.QF, idx_brch.PT, idx_brch.QT]
+
+
+def make_pool(kind, workers=None):
+    """Return a pool of type *kind* (``None``, ``'thread'`` or
+    ``'process'``) with *workers* workers (default: number of CPUs)."""
+    pools = {
+        None: SerialPool,
+        'thread': ThreadPool,
+        'process': ProcessPool,
+    }
+    try:
+        cls = pools[kind]
+    except KeyError:
+        raise ValueError('Unknown pool type: "%s"' % kind)
+    return cls(workers or os.cpu_count() or 1)
+
+
+class SerialPool:
+    """Solves all power flows one after another in the calling thread."""
+    def __init__(self, workers):
+        pass
+
+    def solve(self, solvers):
+        """Run the power flows of all *solvers* and return the list of
+        results (for all cases of all solvers)."""
+        return _flatten(s.solve_all() for s in solvers)
+
+    def close(self):
+        pass
+
+
+class ThreadPool(SerialPool):
+    """Solves the power flows in a pool of threads.
+
+    This only pays off for large grids where most of the time is spent in
+    NumPy and SciPy routines that release the GIL.
+
+    """
+    def __init__(self, workers):
+        self._executor = ThreadPoolExecutor(workers)
+
+    def solve(self, solvers):
+        return _flatten(self._executor.map(lambda s: s.solve_all(),
+                                           solvers))
+
+    def close(self):
+        self._executor.shutdown()
+
+
+class ProcessPool(SerialPool):
+    """Solves the power flows in a pool of persistent worker processes.
+
+    Each solver is assigned to a fixed worker that keeps a copy of it and
+    its cases (with the cached admittance matrices).  For each power
+    flow, only the input columns of the bus and branch matrices are sent to
+    the worker and only the result columns are sent back.
+
+    """
+    def __init__(self, workers):
+        ctx = multiprocessing.get_context()
+        self._conns = []
+        self._procs = []
+        for i in range(workers):
+            conn, child_conn = ctx.Pipe()
+            proc = ctx.Process(target=_worker, args=(child_conn,),
+                               daemon=True)
+            proc.start()
+            child_conn.close()
+            self._conns.append(conn)
+            self._procs.append(proc)
+        self._ids = {}  # Maps solvers sent to the workers to their ID
+
+    def solve(self, solvers):
+        n_workers = len(self._conns)
+        batches = [[] for _ in self._conns]
+        for pos, s in enumerate(solvers):
+            try:
+                i = self._ids[id(s)]
+            except KeyError:
+                i = len(self._ids)
+                self._ids[id(s)] = i
+                self._conns[i % n_workers].send(('add', i, s))
+            batches[i % n_workers].append((
+                pos,
+                i,
+                [c['bus'][:, BUS_INPUTS] for c in s.cases],
+                [c['branch'][:, BRANCH_INPUTS] for c in s.cases],
+            ))
+        for conn, batch in zip(self._conns, batches):
+            conn.send(('solve', batch))
+
+        # Receive the replies of all workers before raising an error, so
+        # that no reply is left in a pipe for the next step:
+        replies = [conn.recv() for conn in self._conns]
+        for reply in replies:
+            if isinstance(reply, Exception):
+                raise reply
+
+        results = [None] * len(solvers)
+        for reply in replies:
+            for pos, packed in reply:
+                results[pos] = [_unpack_results(c, p)
+                                for c, p in zip(solvers[pos].cases, packed)]
+        return _flatten(results)
+
+    def close(self):
+        for conn in self._conns:
+            conn.send(None)
+            conn.close()
+        for proc in self._procs:
+            proc.join()
+        self._conns = []
+        self._procs = []
+
+
+def _worker(conn):
+    """Main loop of a :class:`ProcessPool` worker."""
+    solvers = {}
+    while True:
+        msg = conn.recv()
+        if msg is None:
+            break
+
+        if msg[0] == 'add':
+            i, solver = msg[1:]
+            solvers[i] = solver
+            continue
+
+        try:
+            results = []
+            for pos, i, bus, branch in msg[1]:
+                s = solvers[i]
+                for case, bus_i, branch_i in zip(s.cases, bus, branch):
+                    case['bus'][:, BUS_INPUTS] = bus_i
+                    if (case['branch'][:, BRANCH_INPUTS] != branch_i).any():
+                        case['branch'][:, BRANCH_INPUTS] = branch_i
+                        s.invalidate()
+                results.append((pos, [_pack_results(r)
+                                      for r in s.solve_all()]))
+        except Exception as e:
+            results = e
+        conn.send(results)
+    conn.close()
+
+
+def _flatten(lists):
+    """Concatenate the result *lists* of multiple solvers."""
+    return [res for results in lists for res in results]
+
+
+def _pack_results(res):
+    """Return a tuple with the result columns of *res*."""
+    return (
+        res['bus'][:, BUS_RESULTS],
+        res['gen'][:, GEN_RESULTS],
+        res['branch'][:, BRANCH_RESULTS],
+        res['success'],
+        res['iterations'],
+        res['mismatch'],
+        res['approximated'],
+    )
+
+
+def _unpack_results(case, packed):
+    """Create a results dict from *case* and the *packed* result columns."""
+    bus, gen, branch, success, iterations, mismatch, approximated = packed
+    res = {
+        'baseMVA': case['baseMVA'],
+        'bus': case['bus'].copy(),
+        'gen': case['gen'].copy(),
+        'branch': numpy.zeros((len(case['branch']), idx_brch.QT + 1)),
+        'success': success,
+        'iterations': iterations,
+        'mismatch': mismatch,
+        'approximated': approximated,
+    }
+    res['branch'][:, :case['branch'].shape[1]] = case['branch']
+    res['bus'][:, BUS_RESULTS] = bus
+    res['gen'][:, GEN_RESULTS] = gen
+    res['branch'][:, BRANCH_RESULTS] = branch
+    return res
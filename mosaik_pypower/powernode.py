@@ -0,0 +1,136 @@
+"""
+This module contains :class:`PowerNodes`, the energy management of the
+*PowerNode* entities.
+
+A power node is a bus with a PV system, a battery and a compute node.  In
+each step, the PV power first covers the compute node's demand (the
+*container need*).  Surplus PV power charges the battery, and what the
+battery can't take is fed into the grid (net metering).  If the PV power
+is too low, the battery is discharged and the remaining demand is taken
+from the grid.
+
+"""
+import logging
+
+import numpy
+
+
+logger = logging.getLogger('pypower.mosaik')
+
+# Battery actions (the strings are created in "get()")
+NO_ACTION = 1
+CHARGE = 2
+DISCHARGE = 3
+
+
+class PowerNodes:
+    """Energy management for any number of power nodes.
+
+    The state of all nodes is kept in arrays with one entry per node and
+    :meth:`step()` makes the decisions for all nodes at once.
+
+    """
+    def __init__(self):
+        self._index = {}  # Maps eids to node numbers
+        self.capacity = numpy.empty(0)  # Battery capacity
+        self.pv_power = numpy.empty(0)
+        self.battery_power = numpy.empty(0)  # Charge of the battery
+        self.container_need = numpy.empty(0)
+        self.action = numpy.empty(0, dtype=numpy.int8)  # Battery actions
+        self.amount = numpy.empty(0)  # (Dis)charged power
+        self.net_metering_power = numpy.empty(0)
+        self.grid_energy = numpy.empty(0)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, eid):
+        return eid in self._index
+
+    def add(self, eids, capacity):
+        """Add nodes for the entities *eids* whose batteries have the
+        given *capacity* (a number or a dict mapping eids to numbers)."""
+        if isinstance(capacity, dict):
+            capacity = [capacity[eid] for eid in eids]
+        n = len(eids)
+        self._index.update((eid, i) for i, eid in
+                           enumerate(eids, start=len(self._index)))
+        self.capacity = numpy.r_[self.capacity,
+                                 numpy.broadcast_to(capacity, n)]
+        for attr in ['pv_power', 'battery_power', 'container_need',
+                     'amount', 'net_metering_power', 'grid_energy']:
+            setattr(self, attr, numpy.r_[getattr(self, attr), numpy.zeros(n)])
+        self.action = numpy.r_[self.action, numpy.zeros(n, dtype=numpy.int8)]
+
+    def set_inputs(self, eid, pv_power=None, battery_power=None,
+                   container_need=None):
+        """Update the inputs of node *eid*.  Inputs that are ``None`` keep
+        their previous values."""
+        i = self._index[eid]
+        if pv_power is not None:
+            self.pv_power[i] = abs(pv_power)
+        if battery_power is not None:
+            self.battery_power[i] = battery_power
+        if container_need is not None:
+            self.container_need[i] = container_need
+
+    def step(self):
+        """Decide how each node covers its container need."""
+        pv = self.pv_power
+        battery = self.battery_power
+        need = self.container_need
+
+        # No PV power and an empty battery: Take everything from the grid
+        idle = (pv == 0) & (battery == 0)
+        self.grid_energy[idle] = need[idle]
+
+        # Enough PV power: Charge the battery with the surplus and feed
+        # in what does not fit into the battery
+        extra = pv - need
+        surplus = ~idle & (pv > 0) & (pv >= need)
+        self.action[surplus & (extra == 0)] = NO_ACTION
+        free = self.capacity - battery
+        charge = surplus & (extra > 0) & (free > 0)
+        self.action[charge] = CHARGE
+        self.amount[charge] = numpy.minimum(extra, free)[charge]
+        feed_in = charge & (free < extra)
+        self.net_metering_power[feed_in] += (extra - free)[feed_in]
+        if feed_in.any():
+            logger.debug('Net metering of %s W at %d node(s).' %
+                         ((extra - free)[feed_in].sum(), feed_in.sum()))
+
+        # Not enough PV power: Discharge the battery and take the rest from
+        # the grid
+        missing = numpy.where(pv > 0, need - pv, need)
+        deficit = ~idle & ~surplus
+        discharge = deficit & (battery > 0)
+        self.action[discharge] = DISCHARGE
+        self.amount[discharge] = numpy.minimum(missing, battery)[discharge]
+        empty = discharge & (battery < missing)
+        self.grid_energy[empty] = (missing - battery)[empty]
+        no_battery = deficit & ~(battery > 0)
+        self.grid_energy[no_battery] = missing[no_battery]
+
+    def get(self, eid, attr):
+        """Return the output *attr* of node *eid* and reset it.
+
+        *attr* is ``'battery_action'`` (``None``, ``'noAction'``,
+        ``'charge:<power>'`` or ``'discharge:<power>'``),
+        ``'net_metering_power'`` or ``'grid_energy'``.
+
+        """
+        i = self._index[eid]
+        if attr == 'battery_action':
+            action = self.action[i]
+            self.action[i] = 0
+            if action == NO_ACTION:
+                return 'noAction'
+            elif action == CHARGE:
+                return 'charge:' + str(float(self.amount[i]))
+            elif action == DISCHARGE:
+                return 'discharge:' + str(float(self.amount[i]))
+            return None
+        values = getattr(self, attr)
+        val = float(values[i])
+        values[i] = 0
+        return val
@@ -0,0 +1,213 @@
+"""
+This module contains :class:`EntityRegistry` which stores the entities of
+all grids of a simulator in a compact, columnar form.
+
+"""
+import numpy
+
+from mosaik_pypower import model
+
+
+# Entity types and their integer codes
+ETYPES = ('RefBus', 'PQBus', 'PowerNode', 'Transformer', 'Branch')
+TYPE_CODES = {etype: code for code, etype in enumerate(ETYPES)}
+BUS_INPUT_CODES = tuple(TYPE_CODES[etype] for etype in model.BUS_INPUT_TYPES)
+
+
+# The base cases and layouts of the compiled grids by their key (see
+# "model.case_key()")
+_grids = {}
+
+
+def load_grid(path, sheetnames, cache_dir=None):
+    """Return the compiled case for *path* and its :class:`GridLayout` as
+    tuple ``(ppc, layout)``.
+
+    Like :func:`mosaik_pypower.model.load_compiled_case()`, each grid is
+    only loaded once as long as its modification time doesn't change, but
+    only the layout is kept and not the compiled entities.  The case and the
+    layout are shared and must not be modified.
+
+    """
+    key = model.case_key(path, sheetnames)
+    grid = _grids.get(key)
+    if grid is None:
+        ppc, columns = model.read_case_columns(path, sheetnames, cache_dir)
+        grid = _grids[key] = (ppc, GridLayout(columns))
+    return grid
+
+
+class GridLayout:
+    """The entities of a compiled grid in a columnar form (see
+    :func:`mosaik_pypower.model.entity_columns()`).
+
+    The entities are sorted by name.  For each entity, *codes* contains the
+    type code, *rows* the row in the case's bus or branch matrix and *pos*
+    the position among the entities of the same type, which is also the
+    position in the results of :func:`mosaik_pypower.model.get_results()`
+    and in the columns of *static* (a dict mapping each entity type to a
+    dict with one array per static attribute).  *related* contains the
+    indices of the two related entities of each branch (or ``-1``).
+
+    All instances of a grid share one layout.
+
+    """
+    def __init__(self, columns):
+        names = columns['names']
+        order = sorted(range(len(names)), key=names.__getitem__)
+        self.names = [names[i] for i in order]
+        order = numpy.array(order, dtype=numpy.int64)
+        src_codes = numpy.asarray(columns['codes'])
+        # Position of each entity in the static columns of its type:
+        src_pos = numpy.empty(len(order), dtype=numpy.int64)
+        for code in range(len(columns['etypes'])):
+            members = numpy.flatnonzero(src_codes == code)
+            src_pos[members] = numpy.arange(len(members))
+        src_codes = src_codes[order]
+        src_pos = src_pos[order]
+
+        codes = [TYPE_CODES[e] for e in columns['etypes']]
+        self.codes = numpy.array(codes, dtype=numpy.int8)[src_codes]
+        # The battery and PV node is a special bus:
+        for i, name in enumerate(self.names):
+            if 'node_a1' in name:
+                self.codes[i] = TYPE_CODES['PowerNode']
+        self.rows = numpy.asarray(columns['rows'], dtype=numpy.int64)[order]
+        self.pos = numpy.empty(len(self.names), dtype=numpy.int64)
+        self.index = {}  # Result index (see "model.get_result_index()")
+        self.static = {}
+        for code, etype in enumerate(ETYPES):
+            members = numpy.flatnonzero(self.codes == code)
+            if len(members) == 0:
+                continue
+            members = members[numpy.argsort(self.rows[members],
+                                            kind='stable')]
+            self.pos[members] = numpy.arange(len(members))
+            self.static[etype] = _static_columns(
+                columns, src_codes[members], src_pos[members])
+            vl = self.static[etype].get('Vl')
+            self.index[etype] = (
+                [self.names[i] for i in members],
+                self.rows[members],
+                numpy.full(len(members), numpy.nan) if vl is None else
+                numpy.asarray(vl, dtype=float),
+            )
+
+        # Map the related entities to the sorted entities:
+        inverse = numpy.empty(len(order) + 1, dtype=numpy.int64)
+        inverse[order] = numpy.arange(len(order))
+        inverse[-1] = -1
+        self.related = inverse[numpy.asarray(columns['related'])[order]]
+
+    def __len__(self):
+        return len(self.names)
+
+
+class EntityRegistry:
+    """Stores the entities of all grids.
+
+    Each grid references the :class:`GridLayout` of its compiled grid.  Per
+    entity, the registry only stores an index entry that maps its entity ID
+    to its grid index, type code, row and position (see :meth:`lookup()`).
+    The entry is computed once when the grid is added, so that lookups
+    don't need to parse the entity ID.
+
+    """
+    def __init__(self):
+        self.layouts = []  # The layout of each grid
+        self._index = {}  # Maps eids to (grid_idx, code, row, pos)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, eid):
+        return eid in self._index
+
+    def add(self, grid_idx, layout):
+        """Register the entities of the grid *grid_idx* with the
+        :class:`GridLayout` *layout*."""
+        assert grid_idx == len(self.layouts)
+        self.layouts.append(layout)
+
+        n = len(self._index)
+        self._index.update(
+            (model.make_eid(name, grid_idx), (grid_idx, code, row, pos))
+            for name, code, row, pos in zip(layout.names,
+                                            layout.codes.tolist(),
+                                            layout.rows.tolist(),
+                                            layout.pos.tolist()))
+        assert len(self._index) == n + len(layout), 'Duplicate entity IDs'
+
+    def children(self, grid_idx):
+        """Return the entity descriptions of grid *grid_idx* for mosaik's
+        ``create()``."""
+        layout = self.layouts[grid_idx]
+        children = []
+        for i, name in enumerate(layout.names):
+            # We'll only add relations from branches to nodes (and not from
+            # nodes to branches) because this is sufficient for mosaik to
+            # build the entity graph.
+            related = layout.related[i]
+            children.append({
+                'eid': model.make_eid(name, grid_idx),
+                'type': ETYPES[layout.codes[i]],
+                'rel': [model.make_eid(layout.names[k], grid_idx)
+                        for k in related if k >= 0],
+            })
+        return children
+
+    def lookup(self, eid):
+        """Return a tuple ``(grid_idx, code, row, pos)`` for the entity
+        *eid* (see :class:`GridLayout`)."""
+        return self._index[eid]
+
+    def static(self, eid):
+        """Return a dict with the static attributes of *eid*."""
+        grid_idx, code, row, pos = self.lookup(eid)
+        columns = self.layouts[grid_idx].static[ETYPES[code]]
+        return {attr: _item(col[pos]) for attr, col in columns.items()}
+
+    def static_value(self, eid, attr):
+        """Return the static attribute *attr* of *eid*.
+
+        Raise a :exc:`KeyError` if the entity has no such attribute.
+
+        """
+        grid_idx, code, row, pos = self.lookup(eid)
+        return _item(self.layouts[grid_idx].static[ETYPES[code]][attr][pos])
+
+
+def _static_columns(columns, codes, pos):
+    """Return the static columns of the entities with the type codes *codes*
+    and the positions *pos* in the static *columns* of their type."""
+    static = {c: columns['static'][columns['etypes'][c]]
+              for c in numpy.unique(codes).tolist()}
+    if len(static) == 1:
+        result = {}
+        identity = numpy.array_equal(pos, numpy.arange(len(pos)))
+        for attr, col in static.popitem()[1].items():
+            if identity and len(col) == len(pos):
+                result[attr] = col  # Keeps memory-mapped columns shared
+            elif isinstance(col, numpy.ndarray):
+                result[attr] = col[pos]
+            else:
+                result[attr] = [col[p] for p in pos.tolist()]
+        return result
+    # Power nodes may be PQ buses in the grid file:
+    attrs = static[int(codes[0])]
+    return {attr: _column([static[c][attr][p] for c, p in
+                           zip(codes.tolist(), pos.tolist())])
+            for attr in attrs}
+
+
+def _column(values):
+    """Return *values* as array if they are numbers or as list if not."""
+    if all(isinstance(v, (bool, int, float, numpy.number, numpy.bool_))
+           for v in values):
+        return numpy.array(values)
+    return values
+
+
+def _item(value):
+    """Convert numpy scalars into Python numbers."""
+    return value.item() if isinstance(value, numpy.generic) else value
@@ -0,0 +1,838 @@
+"""
+This module contains the power flow solvers that operate on the PYPOWER cases
+created by :mod:`mosaik_pypower.model`.
+
+"""
+from __future__ import division
+import collections
+
+from pypower import idx_bus, idx_brch, idx_gen
+from pypower.api import (dSbus_dV, fdpf, gausspf, makeB, makeSbus, makeYbus,
+                         newtonpf, pfsoln, ppoption)
+from pypower.bustypes import bustypes
+from scipy.sparse import csc_matrix, csr_matrix, hstack, identity, vstack
+from scipy.sparse.csgraph import breadth_first_order, connected_components
+from scipy.sparse.linalg import splu
+import numpy
+
+
+# Default options for PYPOWER's power flow
+PPOPTION = ppoption(OUT_ALL=0, VERBOSE=0)
+
+# PYPOWER's power flow algorithms ("PF_ALG")
+ALGORITHMS = {
+    'NR': 1,  # Newton's method
+    'FDXB': 2,  # Fast-decoupled, XB version
+    'FDBX': 3,  # Fast-decoupled, BX version
+    'GS': 4,  # Gauss-Seidel
+}
+
+
+def make_ppoption(tolerance=None, max_iterations=None, algorithm='NR',
+                  enforce_q_limits=False):
+    """Return the PYPOWER options for the given solver settings.
+
+    *tolerance* is the max. power mismatch [p.u.] and *max_iterations* the
+    iteration limit of all algorithms (``None`` keeps PYPOWER's defaults).
+    *algorithm* is one of :data:`ALGORITHMS`.
+
+    """
+    try:
+        alg = ALGORITHMS[algorithm]
+    except KeyError:
+        raise ValueError('Unknown power flow algorithm: "%s"' % algorithm)
+    opts = {'PF_ALG': alg, 'ENFORCE_Q_LIMS': bool(enforce_q_limits)}
+    if tolerance is not None:
+        opts['PF_TOL'] = tolerance
+    if max_iterations is not None:
+        opts.update(PF_MAX_IT=max_iterations, PF_MAX_IT_FD=max_iterations,
+                    PF_MAX_IT_GS=max_iterations)
+    return ppoption(PPOPTION, **opts)
+
+
+class Solver:
+    """AC power flow with PYPOWER's algorithms for a single *case*.
+
+    The algorithm and its settings are taken from the PYPOWER options *ppo*
+    (see :func:`make_ppoption()`).  By default, Newton's method is used.
+
+    The admittance matrices and the bus types only depend on the grid's
+    topology, so they are computed once and reused for all following power
+    flows.  Call :meth:`invalidate()` after changing a branch's status or
+    a transformer's tap.
+
+    The case's buses must be numbered consecutively and in order (like the
+    cases created by :func:`mosaik_pypower.model.load_case()`), so that we
+    don't need PYPOWER's ``ext2int()``/``int2ext()`` conversions.
+
+    """
+    def __init__(self, case, ppo=None):
+        self.case = case
+        self.ppo = PPOPTION if ppo is None else ppo
+        self._ybus = None
+
+    def __getstate__(self):
+        # Don't pickle the cached matrices and factorizations
+        return {'case': self.case, 'ppo': self.ppo, '_ybus': None}
+
+    @property
+    def cases(self):
+        """List of all cases solved by :meth:`solve_all()`."""
+        return [self.case]
+
+    def invalidate(self):
+        """Rebuild the admittance matrices before the next power flow."""
+        self._ybus = None
+
+    def solve(self):
+        """Run a power flow and return the results.
+
+        The solver starts from the voltages in ``case['bus']``.  The results
+        are a new case dict like the one returned by PYPOWER's ``runpf()``
+        with the additional keys ``'iterations'`` and ``'mismatch'`` (the
+        largest remaining power mismatch in p.u.).
+
+        """
+        return self.solve_batch([self.case])[0]
+
+    def solve_all(self):
+        """Run a power flow for all :attr:`cases` and return the list of
+        results."""
+        return [self.solve()]
+
+    def linearize_all(self, results):
+        """Return the :class:`Sensitivities` for the *results* of
+        :meth:`solve_all()`."""
+        return [Sensitivities(self, results[0])]
+
+    def solve_batch(self, cases):
+        """Run a power flow for each of the *cases* and return the list of
+        results.
+
+        All *cases* must have the same topology (bus types, branches, taps)
+        as this solver's case.
+
+        """
+        if self._ybus is None:
+            self._prepare()
+
+        # Initial state; the generators fix the voltage of the ref/pv buses
+        v0 = numpy.array([c['bus'][:, idx_bus.VM] *
+                          numpy.exp(1j * numpy.pi / 180 * c['bus'][:, idx_bus.VA])
+                          for c in cases])
+        gens, gbus = self._vc_gens
+        vg = numpy.array([c['gen'][gens, idx_gen.VG] for c in cases])
+        v0[:, gbus] = vg / abs(v0[:, gbus]) * v0[:, gbus]
+
+        sbus = numpy.array([makeSbus(c['baseMVA'], c['bus'], c['gen'])
+                            for c in cases])
+        v, success, iterations = self._solve_voltages(sbus, v0)
+
+        return [self._results(c, v[i], success[i], iterations[i])
+                for i, c in enumerate(cases)]
+
+    def _solve_voltages(self, sbus, v0):
+        """Solve the power flow equations for the bus voltages starting from
+        *v0*.
+
+        *sbus* and *v0* are ``(k, n)`` arrays for *k* cases with *n* buses.
+        Return a tuple ``(v, success, iterations)`` with one row/entry for
+        each case.
+
+        """
+        alg = self.ppo['PF_ALG']
+        args = (self._ref, self._pv, self._pq, self.ppo)
+        if alg == ALGORITHMS['NR']:
+            res = [newtonpf(self._ybus, s, v, *args)
+                   for s, v in zip(sbus, v0)]
+        elif alg == ALGORITHMS['GS']:
+            res = [gausspf(self._ybus, s, v, *args)
+                   for s, v in zip(sbus, v0)]
+        else:
+            res = [fdpf(self._ybus, s, v, self._bp, self._bpp, *args)
+                   for s, v in zip(sbus, v0)]
+        v, success, iterations = zip(*res)
+        return numpy.array(v), numpy.array(success), numpy.array(iterations)
+
+    def _results(self, case, v, success, iterations):
+        """Return the results dict for *case* and the voltages *v*."""
+        # Add zero columns to the branch matrix for the flows:
+        branch = case['branch']
+        branch = numpy.c_[branch, numpy.zeros(
+            (len(branch), idx_brch.QT + 1 - branch.shape[1]))]
+        bus, gen, branch = pfsoln(case['baseMVA'], case['bus'].copy(),
+                                  case['gen'].copy(), branch, self._ybus,
+                                  self._yf, self._yt, v, self._ref, self._pv,
+                                  self._pq)
+
+        # Largest remaining power mismatch (like the solvers compute it)
+        sbus = makeSbus(case['baseMVA'], case['bus'], case['gen'])
+        mis = v * numpy.conj(self._ybus @ v) - sbus
+        pvpq = numpy.r_[self._pv, self._pq].astype(int)
+        mismatch = max(abs(mis[pvpq].real).max(initial=0),
+                       abs(mis[self._pq].imag).max(initial=0))
+
+        if self.ppo['ENFORCE_Q_LIMS'] and success:
+            # The grids only have pq buses and the reference bus, so there
+            # are no pv buses that could be converted to pq buses (like
+            # PYPOWER's "runpf()" does) and a violation is a failure:
+            on = gen[:, idx_gen.GEN_STATUS] > 0
+            tol = self.ppo['OPF_VIOLATION']
+            qg = gen[on, idx_gen.QG]
+            success = not ((qg > gen[on, idx_gen.QMAX] + tol).any() or
+                           (qg < gen[on, idx_gen.QMIN] - tol).any())
+
+        return {
+            'baseMVA': case['baseMVA'],
+            'bus': bus,
+            'gen': gen,
+            'branch': branch,
+            'success': int(success),
+            'iterations': int(iterations),
+            'mismatch': float(mismatch),
+            'approximated': False,
+        }
+
+    def _prepare(self):
+        """Compute the admittance matrices and bus type index sets."""
+        case = self.case
+        bus, gen, branch = case['bus'], case['gen'], case['branch']
+        self._ref, self._pv, self._pq = bustypes(bus, gen)
+        self._ybus, self._yf, self._yt = makeYbus(case['baseMVA'], bus,
+                                                  branch)
+
+        # In-service generators at voltage-controlled (ref and pv) buses
+        on = numpy.flatnonzero(gen[:, idx_gen.GEN_STATUS] > 0)
+        gbus = gen[on, idx_gen.GEN_BUS].astype(int)
+        vc = ~numpy.in1d(gbus, self._pq)
+        self._vc_gens = (on[vc], gbus[vc])
+
+        alg = self.ppo['PF_ALG']
+        if alg in (ALGORITHMS['FDXB'], ALGORITHMS['FDBX']):
+            self._bp, self._bpp = makeB(case['baseMVA'], bus, branch, alg)
+
+
+class NativeSolver(Solver):
+    """AC power flow with a built-in Newton-Raphson implementation.
+
+    It produces the same results as :class:`Solver` (PYPOWER's
+    ``newtonpf()``), but the sparsity pattern of the Jacobian is only
+    computed once per topology.  In each iteration, only the values of the
+    Jacobian are computed (in a single vectorized pass over the admittance
+    matrix) and written into the fixed pattern.  The fill-reducing column
+    ordering of the first LU factorization is kept and reused for all
+    following factorizations.
+
+    :meth:`solve_batch()` solves multiple cases together: The mismatches and
+    Jacobians of all cases are evaluated at once and the Jacobians are
+    factorized as one block-diagonal matrix.  Each case leaves the batch as
+    soon as it has converged.
+
+    """
+    def invalidate(self):
+        super().invalidate()
+        self._perm_c = None
+
+    def _solve_voltages(self, sbus, v0):
+        if self.ppo['PF_ALG'] != ALGORITHMS['NR']:
+            return super()._solve_voltages(sbus, v0)
+
+        tol = self.ppo['PF_TOL']
+        max_it = self.ppo['PF_MAX_IT']
+        pvpq, pq = self._pvpq, self._pq
+        n_pvpq = len(pvpq)
+
+        v = v0.copy()
+        f = self._mismatch(v, sbus)
+        success = abs(f).max(axis=1, initial=0) < tol
+        iterations = numpy.zeros(len(v), dtype=int)
+        active = numpy.flatnonzero(~success)
+        i = 0
+        while len(active) > 0 and i < max_it:
+            i += 1
+            iterations[active] = i
+            v_a = v[active]
+            try:
+                dx = -self._solve_jacobian(v_a, f[active])
+            except RuntimeError:
+                # A singular Jacobian (e.g., because of an islanded bus).
+                # Cases that can't be solved separately did not converge:
+                dx, ok = self._solve_jacobians(v_a, f[active])
+                active, v_a, dx = active[ok], v_a[ok], -dx[ok]
+            va = numpy.angle(v_a)
+            vm = abs(v_a)
+            va[:, pvpq] += dx[:, :n_pvpq]
+            vm[:, pq] += dx[:, n_pvpq:]
+            v_a = vm * numpy.exp(1j * va)
+            v[active] = v_a
+
+            f_a = self._mismatch(v_a, sbus[active])
+            f[active] = f_a
+            done = abs(f_a).max(axis=1, initial=0) < tol
+            success[active[done]] = True
+            active = active[~done]
+
+        return v, success, iterations
+
+    def _mismatch(self, v, sbus):
+        """Return the active (pv and pq buses) and reactive (pq buses) power
+        mismatches for the voltages *v* (one row per case)."""
+        mis = v * numpy.conj((self._ybus @ v.T).T) - sbus
+        return numpy.concatenate([mis[:, self._pvpq].real,
+                                  mis[:, self._pq].imag], axis=1)
+
+    def _solve_jacobian(self, v, f):
+        """Compute the Jacobians for the voltages *v* and solve
+        ``J dx = f`` (one row per case)."""
+        rows, cols, y, diag = self._ybus_coo
+        ibus = (self._ybus @ v.T).T
+        vnorm = v / abs(v)
+
+        # dS/dVa and dS/dVm (see PYPOWER's "dSbus_dV()") for all entries of
+        # the admittance matrix' sparsity pattern:
+        vy = v[:, rows] * numpy.conj(y * v[:, cols])
+        ds_dva = -1j * vy
+        ds_dva[:, diag] += 1j * v * numpy.conj(ibus)
+        ds_dvm = v[:, rows] * numpy.conj(y * vnorm[:, cols])
+        ds_dvm[:, diag] += numpy.conj(ibus) * vnorm
+        (j11, j12, j21, j22) = self._jac_coo[0]
+        values = numpy.concatenate([
+            ds_dva[:, j11].real, ds_dvm[:, j12].real,
+            ds_dva[:, j21].imag, ds_dvm[:, j22].imag,
+        ], axis=1)
+
+        if self._perm_c is None:
+            # Let SuperLU compute a fill-reducing column ordering once.
+            # SuperLU factorizes "J[:, argsort(perm_c)]", so that is what we
+            # store in the pattern from now on.
+            order, indices, indptr, shape = self._jac
+            lu = splu(csc_matrix((values[0, order], indices, indptr),
+                                 shape=shape))
+            self._perm_c = numpy.argsort(lu.perm_c)
+            self._set_jacobian_ordering(self._perm_c)
+
+        # Write the values into the (column permuted) pattern and build
+        # a block-diagonal matrix for all cases:
+        order, indices, indptr, shape = self._jac
+        k = len(v)
+        m = shape[0]
+        nnz = len(indices)
+        offsets = numpy.arange(k)[:, None]
+        jac = csc_matrix((values[:, order].ravel(),
+                          (indices + m * offsets).ravel(),
+                          numpy.r_[(indptr[:-1] + nnz * offsets).ravel(),
+                                   k * nnz]),
+                         shape=(k * m, k * m))
+        lu = splu(jac, permc_spec='NATURAL')
+        dx = numpy.empty_like(f)
+        dx[:, self._perm_c] = lu.solve(f.ravel()).reshape(k, m)
+        return dx
+
+    def _solve_jacobians(self, v, f):
+        """Like :meth:`_solve_jacobian()` but solve each case separately.
+
+        Return *dx* and a boolean array that is ``False`` for cases with a
+        singular Jacobian.
+
+        """
+        dx = numpy.zeros_like(f)
+        ok = numpy.ones(len(v), dtype=bool)
+        for i in range(len(v)):
+            try:
+                dx[i] = self._solve_jacobian(v[i:i + 1], f[i:i + 1])[0]
+            except RuntimeError:
+                ok[i] = False
+        return dx, ok
+
+    def _prepare(self):
+        super()._prepare()
+        self._perm_c = None
+        self._pvpq = numpy.r_[self._pv, self._pq].astype(int)
+        self._pq = numpy.asarray(self._pq, dtype=int)
+
+        # Make sure that the diagonal is part of the sparsity pattern and
+        # store it in coordinate format:
+        n = self._ybus.shape[0]
+        ybus = self._ybus.tocoo()
+        idx = numpy.arange(n)
+        pattern = csr_matrix((numpy.r_[ybus.data, numpy.zeros(n)],
+                              (numpy.r_[ybus.row, idx],
+                               numpy.r_[ybus.col, idx])), shape=(n, n))
+        pattern.sum_duplicates()
+        coo = pattern.tocoo()
+        rows, cols = coo.row, coo.col
+        diag = numpy.flatnonzero(rows == cols)
+        diag = diag[numpy.argsort(rows[diag])]
+        self._ybus_coo = (rows, cols, coo.data, diag)
+
+        # Positions of the buses in the rows/columns of the Jacobian:
+        n_pvpq = len(self._pvpq)
+        pos_a = numpy.full(n, -1)
+        pos_a[self._pvpq] = numpy.arange(n_pvpq)
+        pos_m = numpy.full(n, -1)
+        pos_m[self._pq] = numpy.arange(len(self._pq)) + n_pvpq
+
+        # Select the pattern entries of the sub-matrices
+        # J11 = dP/dVa, J12 = dP/dVm, J21 = dQ/dVa, J22 = dQ/dVm
+        blocks = []
+        jac_rows = []
+        jac_cols = []
+        for row_pos, col_pos in [(pos_a, pos_a), (pos_a, pos_m),
+                                 (pos_m, pos_a), (pos_m, pos_m)]:
+            sel = numpy.flatnonzero((row_pos[rows] >= 0) &
+                                    (col_pos[cols] >= 0))
+            blocks.append(sel)
+            jac_rows.append(row_pos[rows[sel]])
+            jac_cols.append(col_pos[cols[sel]])
+        self._jac_coo = (blocks, numpy.concatenate(jac_rows),
+                         numpy.concatenate(jac_cols))
+        self._set_jacobian_ordering(numpy.arange(n_pvpq + len(self._pq)))
+
+    def _set_jacobian_ordering(self, perm_c):
+        """Compute the CSC structure of the Jacobian with its columns
+        permuted by *perm_c* and the order in which the values of the
+        sub-matrices must be written into it."""
+        blocks, jac_rows, jac_cols = self._jac_coo
+        n = len(perm_c)
+        inv_perm = numpy.empty(n, dtype=int)
+        inv_perm[perm_c] = numpy.arange(n)
+
+        # Use the value's positions as data to find out where they end up:
+        pos = numpy.arange(1, len(jac_rows) + 1, dtype=float)
+        template = csc_matrix((pos, (jac_rows, inv_perm[jac_cols])),
+                              shape=(n, n))
+        template.sort_indices()
+        order = template.data.astype(int) - 1
+        self._jac = (order, template.indices, template.indptr, (n, n))
+
+
+class SweepSolver(Solver):
+    """AC power flow with a backward/forward sweep for radial grids.
+
+    In each iteration, the backward sweep collects the load currents from
+    the leaves to the reference bus and the forward sweep updates the
+    voltages from the reference bus to the leaves.  Both sweeps are linear
+    in the currents/voltages and are expressed as triangular sparse systems
+    (with the buses in breadth-first order) that are factorized once per
+    topology.
+
+    The branches are modelled exactly like in PYPOWER's ``makeYbus()``
+    (pi model with taps), so the results match those of the Newton solvers
+    within the power flow tolerance.  Since the sweep converges linearly,
+    the iteration limit is ``PF_MAX_IT_GS``.  The sweep stops early if the
+    mismatch grows.
+
+    If the grid is not radial (or has pv buses), this solver falls back to
+    Newton's method.
+
+    """
+    def _solve_voltages(self, sbus, v0):
+        if self._sweeps is None:
+            return super()._solve_voltages(sbus, v0)
+
+        tol = self.ppo['PF_TOL']
+        max_it = self.ppo['PF_MAX_IT_GS']
+        order, backward, forward, shunts, ysh, inv_ycc = self._sweeps
+        ref = self._ref
+
+        v = v0.copy()
+        norm = self._norm(v, sbus)
+        iterations = numpy.zeros(len(v), dtype=int)
+        active = numpy.flatnonzero(norm >= tol)
+        i = 0
+        while len(active) > 0 and i < max_it:
+            i += 1
+            iterations[active] = i
+            v_a = v[active]
+
+            # Backward sweep: Current drawn by each bus and its subtree
+            i_load = numpy.conj(-sbus[active] / v_a) + ysh * v_a
+            i_load[:, ref] = 0
+            i_load += (shunts @ v_a.T).T
+            i_bus = numpy.empty_like(v_a)
+            i_bus[:, order] = backward.solve(
+                numpy.ascontiguousarray(i_load[:, order].T)).T
+
+            # Forward sweep: Voltage drop along each branch
+            rhs = -i_bus * inv_ycc
+            rhs[:, ref] = v_a[:, ref]
+            v_a[:, order] = forward.solve(
+                numpy.ascontiguousarray(rhs[:, order].T)).T
+            v[active] = v_a
+
+            last_norm = norm[active]
+            norm[active] = self._norm(v_a, sbus[active])
+            # Stop if converged or diverging (or nan)
+            go_on = (norm[active] >= tol) & (norm[active] < last_norm)
+            active = active[go_on]
+
+        return v, norm < tol, iterations
+
+    def _norm(self, v, sbus):
+        """Return the largest power mismatch at the pq buses for each row
+        of *v*."""
+        mis = v * numpy.conj((self._ybus @ v.T).T) - sbus
+        return abs(mis[:, self._pq]).max(axis=1, initial=0)
+
+    def _prepare(self):
+        super()._prepare()
+        self._sweeps = None
+        case = self.case
+        if (self.ppo['PF_ALG'] != ALGORITHMS['NR'] or len(self._pv) > 0 or
+                len(self._ref) != 1 or not is_radial(case)):
+            return
+
+        bus, branch = case['bus'], case['branch']
+        n = len(bus)
+        online = numpy.flatnonzero(branch[:, idx_brch.BR_STATUS] != 0)
+        f_bus = branch[online, idx_brch.F_BUS].astype(int)
+        t_bus = branch[online, idx_brch.T_BUS].astype(int)
+        yff, yft, ytf, ytt = _branch_admittances(branch[online])
+
+        # Order the buses by their distance to the reference bus
+        graph = csr_matrix((numpy.ones(len(online)), (f_bus, t_bus)),
+                           shape=(n, n))
+        order, pred = breadth_first_order(graph, self._ref[0],
+                                          directed=False,
+                                          return_predecessors=True)
+        pos = numpy.empty(n, dtype=int)
+        pos[order] = numpy.arange(n)
+
+        # Find the branch connecting each bus to its parent
+        keys = numpy.r_[f_bus * n + t_bus, t_bus * n + f_bus]
+        branches = numpy.r_[numpy.arange(len(online)),
+                            numpy.arange(len(online))]
+        sort = numpy.argsort(keys)
+        keys, branches = keys[sort], branches[sort]
+        child = order[1:]
+        parent = pred[child]
+        br = branches[numpy.searchsorted(keys, parent * n + child)]
+        from_parent = f_bus[br] == parent
+
+        # Admittances from the parent's (p) and child's (c) point of view
+        ypp = numpy.where(from_parent, yff[br], ytt[br])
+        ypc = numpy.where(from_parent, yft[br], ytf[br])
+        ycp = numpy.where(from_parent, ytf[br], yft[br])
+        ycc = numpy.where(from_parent, ytt[br], yff[br])
+
+        # Backward: the current drawn by a parent p from a branch to a
+        # child c is "a * i_c + b * v_c" with the current "i_c = -i_bus[c]"
+        # that the branch injects into c.
+        a = ypp / ycp
+        b = ypc - ypp * ycc / ycp
+        eye = identity(n, dtype=complex, format='csc')
+        backward = eye + csc_matrix((a, (pos[parent], pos[child])),
+                                    shape=(n, n))
+        shunts = csr_matrix((b, (parent, child)), shape=(n, n))
+
+        # Forward: "v_c = -(i_bus[c] + ycp * v_p) / ycc"
+        forward = eye + csc_matrix((ycp / ycc, (pos[child], pos[parent])),
+                                   shape=(n, n))
+        inv_ycc = numpy.zeros(n, dtype=complex)
+        inv_ycc[child] = 1 / ycc
+
+        # The matrices are triangular, so there's no need for pivoting
+        opts = {'permc_spec': 'NATURAL', 'diag_pivot_thresh': 0}
+        ysh = (bus[:, idx_bus.GS] + 1j * bus[:, idx_bus.BS]) / case['baseMVA']
+        self._sweeps = (order, splu(backward, **opts), splu(forward, **opts),
+                        shunts, ysh, inv_ycc)
+
+
+class BatchSolver:
+    """Solves multiple instances of the same grid together.
+
+    All *cases* must be created from the same grid file.  Instances whose
+    branch states and taps are equal are solved in one batch (see
+    :meth:`Solver.solve_batch()`) by a solver created by *factory* (a solver
+    class or :func:`auto_solver()`).  Each instance keeps its own
+    convergence flag and iteration count.
+
+    """
+    max_solvers = 32  # Max. number of cached solvers (topologies)
+
+    def __init__(self, cases, ppo=None, factory=NativeSolver):
+        self.cases = cases
+        self.ppo = PPOPTION if ppo is None else ppo
+        self.factory = factory
+        self._solvers = {}
+        self._case_solvers = None  # The solver used for each case
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_solvers'] = {}
+        state['_case_solvers'] = None
+        return state
+
+    def invalidate(self):
+        """Drop all cached solvers."""
+        self._solvers = {}
+
+    def solve_all(self):
+        """Run a power flow for all :attr:`cases` and return the list of
+        results."""
+        groups = {}
+        for i, case in enumerate(self.cases):
+            key = case['branch'][:, [idx_brch.TAP, idx_brch.BR_STATUS]]
+            groups.setdefault(key.tobytes(), []).append(i)
+
+        if len(self._solvers) + len(groups) > self.max_solvers:
+            self._solvers = {}
+
+        results = [None] * len(self.cases)
+        self._case_solvers = [None] * len(self.cases)
+        for key, members in groups.items():
+            solver = self._solvers.get(key)
+            if solver is None:
+                solver = self.factory(self.cases[members[0]], self.ppo)
+                self._solvers[key] = solver
+            batch = solver.solve_batch([self.cases[i] for i in members])
+            for i, res in zip(members, batch):
+                results[i] = res
+                self._case_solvers[i] = solver
+        return results
+
+    def linearize_all(self, results):
+        """Return the :class:`Sensitivities` for the *results* of
+        :meth:`solve_all()`."""
+        return [Sensitivities(s, r)
+                for s, r in zip(self._case_solvers, results)]
+
+
+class Sensitivities:
+    """Sensitivities of the bus voltages to the buses' (re)active power
+    around the converged power flow *results* of a *solver*.
+
+    The sensitivities are the inverse of the power flow Jacobian at the
+    operating point, which is kept as a sparse LU factorization.
+    :meth:`estimate()` uses them to compute the voltages for new bus inputs
+    with a single forward/backward substitution.  The branch flows and the
+    reference bus' power are then computed exactly for these voltages.
+
+    """
+    def __init__(self, solver, results):
+        self._solver = solver
+        pv, pq = solver._pv, solver._pq
+        self._pvpq = numpy.r_[pv, pq].astype(int)
+        self._pq = numpy.asarray(pq, dtype=int)
+
+        bus = results['bus']
+        self._base_mva = results['baseMVA']
+        self._inputs = bus[:, [idx_bus.PD, idx_bus.QD]].copy()
+        self._vm = bus[:, idx_bus.VM].copy()
+        self._va = bus[:, idx_bus.VA] * numpy.pi / 180
+
+        v = self._vm * numpy.exp(1j * self._va)
+        ds_dvm, ds_dva = dSbus_dV(solver._ybus, v)
+        pvpq, pq = self._pvpq, self._pq
+        jac = vstack([
+            hstack([ds_dva[pvpq][:, pvpq].real, ds_dvm[pvpq][:, pq].real]),
+            hstack([ds_dva[pq][:, pvpq].imag, ds_dvm[pq][:, pq].imag]),
+        ], format='csc')
+        self._lu = splu(jac)
+
+    def change(self, case):
+        """Return the largest change of a bus' (re)active power demand in
+        *case* compared to the operating point (in MW)."""
+        inputs = case['bus'][:, [idx_bus.PD, idx_bus.QD]]
+        return abs(inputs - self._inputs).max(initial=0)
+
+    def estimate(self, case):
+        """Return the estimated power flow results for the inputs of
+        *case*."""
+        solver = self._solver
+        d = (case['bus'][:, [idx_bus.PD, idx_bus.QD]] - self._inputs)
+        # The injections change by the negative demand:
+        dx = self._lu.solve(-numpy.r_[d[self._pvpq, 0], d[self._pq, 1]] /
+                            self._base_mva)
+        n_pvpq = len(self._pvpq)
+        va = self._va.copy()
+        vm = self._vm.copy()
+        va[self._pvpq] += dx[:n_pvpq]
+        vm[self._pq] += dx[n_pvpq:]
+
+        res = solver._results(case, vm * numpy.exp(1j * va), True, 0)
+        res['approximated'] = True
+        return res
+
+
+class LinearizedSolver:
+    """Estimates the power flows of a *solver*'s cases with the
+    :class:`Sensitivities` of the last full power flow.
+
+    A full power flow is run if the (re)active power of any bus changed by
+    more than *max_change* (in MW) since the last full power flow, if the
+    last full power flow did not converge, after :meth:`invalidate()` and
+    at least every *interval* calls of :meth:`solve_all()`.
+
+    """
+    def __init__(self, solver, max_change, interval):
+        self.solver = solver
+        self.max_change = max_change
+        self.interval = interval
+        self._sensitivities = None
+        self._steps = 0  # Number of steps since the last full power flow
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_sensitivities'] = None
+        return state
+
+    @property
+    def cases(self):
+        return self.solver.cases
+
+    def invalidate(self):
+        self.solver.invalidate()
+        self._sensitivities = None
+
+    def solve_all(self):
+        sensitivities = self._sensitivities
+        self._steps += 1
+        if (sensitivities is not None and self._steps < self.interval and
+                all(s.change(c) <= self.max_change
+                    for s, c in zip(sensitivities, self.cases))):
+            return [s.estimate(c) for s, c in zip(sensitivities, self.cases)]
+
+        results = self.solver.solve_all()
+        self._steps = 0
+        self._sensitivities = None
+        if all(res['success'] for res in results):
+            self._sensitivities = self.solver.linearize_all(results)
+        return results
+
+
+class ResultCache:
+    """Remembers the power flow results of the last *size* operating points
+    of a case.
+
+    An operating point is defined by the (re)active power demand of all
+    buses and by the taps and states of all branches.  :meth:`get()` returns
+    the previous results if the inputs differ by no more than *tolerance*
+    (in MW) from the last solved inputs.  Otherwise, the inputs are rounded
+    to multiples of *tolerance* and looked up in an LRU cache.
+
+    """
+    def __init__(self, size=16, tolerance=0):
+        self.size = size
+        self.tolerance = tolerance
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._last = None  # (bus inputs, branch inputs, results, entry key)
+
+    def key(self, case):
+        """Return the cache key for the current inputs of *case*."""
+        bus = case['bus'][:, [idx_bus.PD, idx_bus.QD]]
+        branch = case['branch'][:, [idx_brch.TAP, idx_brch.BR_STATUS]]
+        return bus, branch
+
+    def get(self, key):
+        """Return the results for *key* or ``None`` if there are none."""
+        bus, branch = key
+        res = None
+        if self._last is not None:
+            last_bus, last_branch, last_res, qkey = self._last
+            if ((branch == last_branch).all() and
+                    (abs(bus - last_bus) <= self.tolerance).all()):
+                res = last_res
+                # Keep the entry at the most recently used end:
+                if qkey in self._entries:
+                    self._entries.move_to_end(qkey)
+        if res is None:
+            qkey = self._quantize(key)
+            res = self._entries.get(qkey)
+            if res is not None:
+                self._entries.move_to_end(qkey)
+                self._last = (bus, branch, res, qkey)
+
+        if res is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return res
+
+    def put(self, key, res):
+        """Store the results *res* for *key*."""
+        bus, branch = key
+        qkey = self._quantize(key)
+        self._last = (bus, branch, res, qkey)
+        self._entries[qkey] = res
+        self._entries.move_to_end(qkey)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        """Remove all entries from the cache."""
+        self._entries.clear()
+        self._last = None
+
+    def _quantize(self, key):
+        bus, branch = key
+        if self.tolerance > 0:
+            bus = numpy.round(bus / self.tolerance)
+        bus = bus + 0.  # Turn -0. into 0.
+        return bus.tobytes() + branch.tobytes()
+
+
+def is_radial(case):
+    """Return ``True`` if the in-service branches of *case* connect all
+    buses without forming any loops."""
+    n = len(case['bus'])
+    branch = case['branch']
+    online = branch[:, idx_brch.BR_STATUS] != 0
+    if online.sum() != n - 1:
+        return False
+    graph = csr_matrix((numpy.ones(n - 1),
+                        (branch[online, idx_brch.F_BUS].astype(int),
+                         branch[online, idx_brch.T_BUS].astype(int))),
+                       shape=(n, n))
+    n_components = connected_components(graph, directed=False,
+                                        return_labels=False)
+    return n_components == 1
+
+
+def _branch_admittances(branch):
+    """Return the arrays *yff*, *yft*, *ytf* and *ytt* of the pi models of
+    all branches (like PYPOWER's ``makeYbus()``)."""
+    stat = branch[:, idx_brch.BR_STATUS]
+    ys = stat / (branch[:, idx_brch.BR_R] + 1j * branch[:, idx_brch.BR_X])
+    bc = stat * branch[:, idx_brch.BR_B]
+    tap = numpy.where(branch[:, idx_brch.TAP] != 0, branch[:, idx_brch.TAP],
+                      1) * numpy.exp(1j * numpy.pi / 180 *
+                                     branch[:, idx_brch.SHIFT])
+    ytt = ys + 1j * bc / 2
+    yff = ytt / (tap * numpy.conj(tap))
+    yft = -ys / numpy.conj(tap)
+    ytf = -ys / tap
+    return yff, yft, ytf, ytt
+
+
+def auto_solver(case, ppo=None):
+    """Return a :class:`SweepSolver` if *case* is radial and a PYPOWER based
+    :class:`Solver` if not."""
+    cls = SweepSolver if is_radial(case) else Solver
+    return cls(case, ppo)
+
+
+def auto_batch_solver(case, ppo=None):
+    """Return a :class:`SweepSolver` if *case* is radial and a
+    :class:`NativeSolver` if not.
+
+    Unlike :class:`Solver`, both solve batches of cases in a vectorized way
+    (see :meth:`Solver.solve_batch()`).
+
+    """
+    cls = SweepSolver if is_radial(case) else NativeSolver
+    return cls(case, ppo)
+
+
+# Available solvers
+SOLVERS = {
+    'auto': auto_solver,
+    'pypower': Solver,
+    'native': NativeSolver,
+    'sweep': SweepSolver,
+}
+
+# Solvers for the cases of a BatchSolver
+BATCH_SOLVERS = dict(SOLVERS, auto=auto_batch_solver)
@@ -0,0 +1,179 @@
+"""
+This module runs time series of power flows for a single grid without
+mosaik.
+
+The active and reactive power of the buses is read from profile matrices
+with one row per time step and one column per bus.  The results of all
+steps are written chunk by chunk into ``.npy`` files, so that even long
+time series (e.g., a year in 15 minute steps) don't need to fit into memory.
+
+Usage from Python::
+
+    from mosaik_pypower import timeseries
+    timeseries.run('grid.json', 'p.csv', 'q.csv', 'results/')
+
+Or from the command line::
+
+    mosaik-pypower-timeseries grid.json p.csv -q q.csv -o results/
+
+"""
+import argparse
+import json
+import os
+import time
+
+from numpy.lib.format import open_memmap
+import numpy
+
+from mosaik_pypower import model
+from mosaik_pypower.solver import SOLVERS
+
+
+def read_profiles(path, names):
+    """Read a profile matrix (time steps x buses) from *path* and return it
+    with one column for each of the bus *names*.
+
+    CSV files must have a header line with the bus names (the entity IDs
+    without the grid index, e.g. ``Bus0``).  Missing buses get a profile of
+    zeros.  ``.npy`` files must contain one column per bus in *names*.
+
+    """
+    if os.path.splitext(path)[-1] == '.npy':
+        data = numpy.load(path, mmap_mode='r')
+        if data.ndim != 2 or data.shape[1] != len(names):
+            raise ValueError('"%s" must have %d columns (one per bus), but '
+                             'has shape %s' % (path, len(names), data.shape))
+        return data
+
+    with open(path) as f:
+        header = [n.strip() for n in f.readline().strip().split(',')]
+        data = numpy.loadtxt(f, delimiter=',', ndmin=2)
+    unknown = set(header) - set(names)
+    if unknown:
+        raise ValueError('Unknown buses in "%s": %s' %
+                         (path, ', '.join(sorted(unknown))))
+    profiles = numpy.zeros((len(data), len(names)))
+    cols = [names.index(n) for n in header]
+    profiles[:, cols] = data
+    return profiles
+
+
+def run(gridfile, p, q=None, outdir='.', sheetnames=None, solver='auto',
+        pos_loads=True, warm_start=True, chunk_size=96, attrs=None):
+    """Run a power flow for each time step of the profiles *p* and *q* in the
+    grid *gridfile* and write the results to *outdir*.
+
+    *p* and *q* are arrays or file names (see :func:`read_profiles()`) with
+    the active [W] and reactive [VAr] power of each bus in each time step.
+    *q* is optional.  Loads are positive numbers if *pos_loads* is ``True``
+    (like in :class:`~mosaik_pypower.mosaik.PyPower`).
+
+    For each entity type and output attribute (all or only *attrs*), the
+    results are written to ``<etype>.<attr>.npy`` with one row per time step
+    and one column per entity.  ``columns.json`` lists the entities of each
+    type, ``success.npy`` and ``iterations.npy`` contain the solver status
+    of each step.  The results are written every *chunk_size* steps.
+
+    Return a dict with the number of *steps* and *failed* power flows.
+
+    """
+    case, entity_map = model.load_case(gridfile, 0, sheetnames or {})
+    index = model.get_result_index(entity_map)
+    inputs = sorted((e['idx'], eid) for eid, e in entity_map.items()
+                    if e['etype'] in model.BUS_INPUT_TYPES)
+    rows = numpy.array([idx for idx, eid in inputs], dtype=int)
+    names = [model.strip_eid(eid) for idx, eid in inputs]
+
+    if isinstance(p, str):
+        p = read_profiles(p, names)
+    if q is None:
+        q = numpy.zeros_like(p)
+    elif isinstance(q, str):
+        q = read_profiles(q, names)
+    if p.shape != q.shape or p.shape[1] != len(names):
+        raise ValueError('The P and Q profiles must have the shape (steps, '
+                         '%d)' % len(names))
+    sign = 1 if pos_loads else -1
+    n_steps = len(p)
+
+    # Create the output files
+    os.makedirs(outdir, exist_ok=True)
+    columns = {}
+    files = {}
+    for etype, (eids, _, _) in index.items():
+        columns[etype] = [model.strip_eid(eid) for eid in eids]
+        for attr in sorted(model.OUTPUTS.get(etype, {})):
+            if attrs is None or attr in attrs:
+                path = os.path.join(outdir, '%s.%s.npy' % (etype, attr))
+                files[etype, attr] = open_memmap(path, mode='w+',
+                                                 shape=(n_steps, len(eids)))
+    success = open_memmap(os.path.join(outdir, 'success.npy'), mode='w+',
+                          dtype=bool, shape=(n_steps,))
+    iterations = open_memmap(os.path.join(outdir, 'iterations.npy'),
+                             mode='w+', dtype=int, shape=(n_steps,))
+    with open(os.path.join(outdir, 'columns.json'), 'w') as f:
+        json.dump(columns, f, indent=1)
+
+    s = SOLVERS[solver](case)
+    failed = 0
+    for start in range(0, n_steps, chunk_size):
+        stop = min(start + chunk_size, n_steps)
+        chunk = {key: numpy.empty((stop - start, f.shape[1]))
+                 for key, f in files.items()}
+        for i, t in enumerate(range(start, stop)):
+            model.reset_inputs(case)
+            model.set_bus_inputs(case, rows, p[t] * sign, q[t])
+            res = s.solve()
+            failed += not res['success']
+            if warm_start:
+                model.set_start_voltages(case, res)
+            else:
+                model.set_start_voltages(case)
+
+            success[t] = res['success']
+            iterations[t] = res['iterations']
+            outputs = model.get_results(res, index)
+            for etype, attr in files:
+                val = outputs[etype][attr]
+                chunk[etype, attr][i] = val * sign if attr == 'P' else val
+
+        for key, f in files.items():
+            f[start:stop] = chunk[key]
+            f.flush()
+        success.flush()
+        iterations.flush()
+
+    return {'steps': n_steps, 'failed': failed}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Run a time series of power flows for a grid.')
+    parser.add_argument('gridfile', help='JSON or Excel file with the grid')
+    parser.add_argument('p', help='CSV or .npy file with the active power '
+                                  'profiles [W] of the buses')
+    parser.add_argument('-q', help='CSV or .npy file with the reactive power '
+                                   'profiles [VAr] of the buses')
+    parser.add_argument('-o', '--outdir', default='.',
+                        help='Directory for the results (default: .)')
+    parser.add_argument('--solver', default='auto', choices=sorted(SOLVERS),
+                        help='Power flow solver (default: auto)')
+    parser.add_argument('--neg-loads', action='store_true',
+                        help='Loads are negative and feed-in is positive')
+    parser.add_argument('--no-warm-start', action='store_true',
+                        help='Start each power flow from a flat start')
+    parser.add_argument('--chunk-size', type=int, default=96,
+                        help='Number of steps per write (default: 96)')
+    parser.add_argument('--attrs', help='Comma separated list of output '
+                                        'attributes (default: all)')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    stats = run(args.gridfile, args.p, args.q, args.outdir,
+                solver=args.solver, pos_loads=not args.neg_loads,
+                warm_start=not args.no_warm_start,
+                chunk_size=args.chunk_size,
+                attrs=args.attrs.split(',') if args.attrs else None)
+    print('%d steps in %.1f s, %d power flows did not converge.' %
+          (stats['steps'], time.perf_counter() - start, stats['failed']))
+    return 1 if stats['failed'] else 0
@@ -0,0 +1,205 @@
+"""
+This module contains a minimal reader for Excel (``.xlsx``) files.
+
+The worksheets are parsed with a single streaming pass over their XML.  Only
+the cell values are read (no styles, formulas or dates), which is all that
+:class:`mosaik_pypower.model.Excel` needs.  Like xlrd, numbers are returned
+as floats, booleans as ints and empty cells as empty strings.
+
+"""
+from xml.etree.ElementTree import iterparse
+from xml.parsers import expat
+import ast
+import posixpath
+import zipfile
+
+
+_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+# Element names as reported by expat (namespace and tag):
+_C, _ROW, _SI, _T, _V = ('http://schemas.openxmlformats.org/spreadsheetml/'
+                         '2006/main %s' % t for t in ['c', 'row', 'si', 't',
+                                                      'v'])
+_REL_NS = ('{http://schemas.openxmlformats.org/officeDocument/2006/'
+           'relationships}')
+_PKG_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+
+class Workbook:
+    """Provides the rows of the sheets of the Excel file *path*.
+
+    The sheets are read when their rows are requested for the first time.
+
+    """
+    def __init__(self, path):
+        self.path = path
+        with zipfile.ZipFile(path) as zf:
+            names = set(zf.namelist())
+            with zf.open('xl/workbook.xml') as f:
+                sheets = [(e.get('name'), e.get(_REL_NS + 'id'))
+                          for _, e in iterparse(f)
+                          if e.tag == _NS + 'sheet']
+            with zf.open('xl/_rels/workbook.xml.rels') as f:
+                targets = {e.get('Id'): e.get('Target')
+                           for _, e in iterparse(f)
+                           if e.tag == _PKG_REL_NS + 'Relationship'}
+            strings = []
+            if 'xl/sharedStrings.xml' in names:
+                with zf.open('xl/sharedStrings.xml') as f:
+                    strings = _read_strings(f)
+
+        self._strings = strings
+        self._files = {}
+        for name, rid in sheets:
+            target = targets[rid]
+            if target.startswith('/'):
+                target = target[1:]
+            else:
+                target = posixpath.normpath(posixpath.join('xl', target))
+            self._files[name] = target
+        self._rows = {}
+
+    @property
+    def sheet_names(self):
+        """The names of all sheets in the workbook."""
+        return list(self._files)
+
+    def rows(self, name):
+        """Return a list with the rows (lists of cell values) of the sheet
+        *name*.
+
+        All rows have the same length.  Missing cells are empty strings.
+        Raise a :exc:`ValueError` if there is no such sheet.
+
+        """
+        try:
+            return self._rows[name]
+        except KeyError:
+            pass
+        try:
+            member = self._files[name]
+        except KeyError:
+            raise ValueError('No sheet named "%s" in "%s"' %
+                             (name, self.path)) from None
+        with zipfile.ZipFile(self.path) as zf, zf.open(member) as f:
+            rows = _read_rows(f, self._strings)
+        self._rows[name] = rows
+        return rows
+
+
+def parse_taps(value):
+    """Parse the tap dict *value* (e.g., ``"{-1: 0.975, 0: 1.0}"``) of a
+    transformer type and return a dict with int keys and float values.
+
+    Only literals are parsed, so no code from the file is executed.  Raise a
+    :exc:`ValueError` if *value* is not a dict of numbers.
+
+    """
+    try:
+        taps = ast.literal_eval(value)
+        if not isinstance(taps, dict):
+            raise TypeError
+        return {int(k): float(v) for k, v in taps.items()}
+    except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+        raise ValueError('Invalid transformer taps: %r' % (value,)) from None
+
+
+def _read_strings(f):
+    """Return the list of shared strings in *f*."""
+    strings = []
+    text = []
+    collect = False
+
+    def start(tag, attrs):
+        nonlocal collect
+        collect = tag == _T
+
+    def end(tag):
+        nonlocal collect
+        collect = False
+        if tag == _SI:
+            strings.append(''.join(text))
+            text.clear()
+
+    _parse(f, start, end, lambda data: collect and text.append(data))
+    return strings
+
+
+def _read_rows(f, strings):
+    """Return the cell values of the worksheet *f* as list of rows."""
+    rows = []
+    row = {}  # Values of the current row by column index
+    cell = [0, 'n']  # Column index and type of the current cell
+    text = []
+    collect = False
+    columns = {}  # Column indices by cell reference letters
+
+    def start(tag, attrs):
+        nonlocal collect
+        if tag == _C:
+            ref = attrs.get('r')
+            if ref:
+                letters = ref.rstrip('0123456789')
+                try:
+                    cell[0] = columns[letters]
+                except KeyError:
+                    cell[0] = columns[letters] = _column_index(letters)
+            cell[1] = attrs.get('t', 'n')
+        else:
+            collect = tag == _V or tag == _T
+
+    def end(tag):
+        nonlocal collect, row
+        collect = False
+        if tag == _C:
+            col, ctype = cell
+            if text:
+                row[col] = _cell_value(''.join(text), ctype, strings)
+                text.clear()
+            cell[0] = col + 1
+        elif tag == _ROW:
+            if row:
+                rows.append(row)
+                row = {}
+            cell[0] = 0
+
+    _parse(f, start, end, lambda data: collect and text.append(data))
+
+    # Convert the rows from dicts to lists of equal length:
+    ncols = max((max(row) + 1 for row in rows), default=0)
+    table = []
+    for row in rows:
+        values = [''] * ncols
+        for col, value in row.items():
+            values[col] = value
+        table.append(values)
+    return table
+
+
+def _parse(f, start, end, data):
+    """Parse the XML file *f* with the element *start* and *end* and
+    character *data* handlers."""
+    parser = expat.ParserCreate(namespace_separator=' ')
+    parser.buffer_text = True
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    parser.CharacterDataHandler = data
+    parser.ParseFile(f)
+
+
+def _cell_value(text, ctype, strings):
+    if ctype == 'n':
+        return float(text)
+    if ctype == 's':
+        return strings[int(text)]
+    if ctype == 'b':
+        return int(text)
+    return text  # Inline and formula strings and errors
+
+
+def _column_index(letters):
+    """Return the 0-based column index for the column *letters* of a cell
+    reference (e.g., ``"AB"``)."""
+    col = 0
+    for c in letters.upper():
+        col = col * 26 + ord(c) - 64
+    return col - 1
@@ -16,13 +16,14 @@ setup(
         'mosaik-api>=3.0',
         'numpy>=1.6,<1.23',
         'scipy>=0.9',
-        'xlrd>=0.9.2,<2',
     ],
     packages=find_packages(),
     include_package_data=True,
     entry_points={
         'console_scripts': [
             'mosaik-pypower = mosaik_pypower.mosaik:main',
+            'mosaik-pypower-timeseries = mosaik_pypower.timeseries:main',
+            'mosaik-pypower-convert = mosaik_pypower.convert:main',
         ],
     },
     classifiers=[
@@ -0,0 +1,73 @@
+import os.path
+
+import numpy as np
+import pytest
+
+from mosaik_pypower import model
+from mosaik_pypower.aggregation import InputAggregator
+from mosaik_pypower.registry import EntityRegistry, GridLayout
+
+
+@pytest.fixture
+def registry():
+    filename = os.path.join(os.path.dirname(__file__), 'data',
+                            'test_case_b.json')
+    ppc, entities = model.compile_case(filename, {})
+    layout = GridLayout(model.entity_columns(entities))
+    registry = EntityRegistry()
+    registry.add(0, layout)
+    registry.add(1, layout)
+    return registry
+
+
+def test_aggregator(registry):
+    agg = InputAggregator(registry, ('P', 'Q', 'online'), {'1-Bus2'})
+    inputs = {
+        '0-Bus1': {'P': {'a': 1, 'b': 2.5}},
+        '1-Bus2': {'Q': {'c': -1}, 'P': {'d': 4}},
+        '1-B_1': {'online': {'e': True}},
+    }
+    agg.update(inputs)
+    sums = agg.sums(inputs)
+    assert list(sums) == [3.5, -1, 4, 1, 0]
+    assert agg.learned == 1
+    assert agg.nodes == ['1-Bus2']
+    assert agg.n_inputs == [1, 2]
+    assert agg.others == [('1-B_1', 1, 4, 2, {'online': 3})]
+    rows, p, q = agg.bus_inputs[1]
+    assert list(rows) == [3]
+    assert list(sums[p]) == [4]
+    assert list(sums[q]) == [-1]
+    assert list(sums[agg.bus_inputs[0][2]]) == [0]  # No Q for "0-Bus1"
+
+    # New values, same pattern:
+    inputs['0-Bus1']['P'] = {'b': 1, 'a': 1}
+    agg.update(inputs)
+    assert list(agg.sums(inputs)) == [2, -1, 4, 1, 0]
+    assert agg.learned == 1
+
+    # New connection:
+    inputs['0-Bus1']['P']['f'] = 3
+    agg.update(inputs)
+    assert list(agg.sums(inputs)) == [5, -1, 4, 1, 0]
+    assert agg.learned == 2
+
+    # New entity:
+    inputs['0-Bus0'] = {'P': {'a': 7}}
+    agg.update(inputs)
+    assert np.array_equal(agg.sums(inputs), [5, -1, 4, 1, 7, 0])
+    assert agg.n_inputs == [2, 2]
+    assert agg.learned == 3
+
+
+def test_aggregator_invalid_attr(registry):
+    agg = InputAggregator(registry, ('P', 'Q'), set())
+    inputs = {'0-Bus1': {'P': {'a': 1}}}
+    agg.update(inputs)
+    bus_inputs = agg.bus_inputs
+
+    pytest.raises(RuntimeError, agg.update, {'0-Bus1': {'spam': {'a': 1}}})
+    # The learned pattern is kept:
+    assert agg.bus_inputs is bus_inputs
+    agg.update(inputs)
+    assert agg.learned == 1
@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from mosaik_pypower import gridgen, model, solver
+
+
+@pytest.mark.parametrize('meshed', [False, True])
+def test_make_grid(meshed):
+    grid = gridgen.make_grid(50, meshed=meshed, seed=1)
+    assert grid == gridgen.make_grid(50, meshed=meshed, seed=1)
+    assert len(grid['bus']) == 51
+    assert len(grid['trafo']) == 1
+    assert (len(grid['branch']) > 49) == meshed
+
+
+def test_make_grid_too_small():
+    pytest.raises(ValueError, gridgen.make_grid, 0)
+
+
+@pytest.mark.parametrize('meshed', [False, True])
+def test_write(meshed, tmpdir):
+    grid = gridgen.make_grid(30, meshed=meshed, seed=2)
+    json_file = str(tmpdir.join('grid.json'))
+    xlsx_file = str(tmpdir.join('grid.xlsx'))
+    gridgen.write_json(grid, json_file)
+    gridgen.write_xlsx(grid, xlsx_file)
+
+    ppc_a, emap_a = model.compile_case(json_file, {})
+    ppc_b, emap_b = model.compile_case(xlsx_file, {})
+    for key in ['bus', 'gen', 'branch']:
+        assert np.allclose(ppc_a[key], ppc_b[key])
+    assert emap_a == emap_b
+    assert solver.is_radial(ppc_a) != meshed
+
+    model.set_bus_inputs(ppc_a, np.arange(1, 31), [1e5] * 30, [2e4] * 30)
+    assert solver.Solver(ppc_a).solve()['success'] == 1
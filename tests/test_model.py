@@ -200,6 +200,85 @@ def test_load_case_extra_types(filename):
     }
 
 
+@pytest.mark.parametrize('filename', [
+    'test_case_b.old.json',
+    'test_case_b.json',
+    'test_case_b.xlsx',
+])
+def test_load_case_cached(filename, tmpdir, monkeypatch):
+    filename = os.path.join(os.path.dirname(__file__), 'data', filename)
+    monkeypatch.setattr(model, '_compiled_cases', {})
+    ppc_a, emap_a = model.load_case(filename, 0, {}, str(tmpdir))
+    assert len(tmpdir.listdir()) == 1
+
+    # Later instances are copies with relabeled entities:
+    ppc_b, emap_b = model.load_case(filename, 1, {}, str(tmpdir))
+    assert ppc_b['bus'] is not ppc_a['bus']
+    assert np.all(ppc_b['branch'] == ppc_a['branch'])
+    assert sorted(emap_b) == sorted('1-%s' % e.split('-', 1)[1]
+                                    for e in emap_a)
+    assert emap_b['1-Trafo1']['related'] == ['1-Grid', '1-Bus0']
+
+    # Later runs read the compiled case from disk:
+    monkeypatch.setattr(model, 'compile_case', None)
+    monkeypatch.setattr(model, '_compiled_cases', {})
+    ppc_c, emap_c = model.load_case(filename, 0, {}, str(tmpdir))
+    for key in ['bus', 'gen', 'branch']:
+        assert np.all(ppc_c[key] == ppc_a[key])
+    assert emap_c == emap_a
+
+    # A changed resource database invalidates the compiled cases, so the
+    # case is compiled again (which fails, see above):
+    monkeypatch.setitem(model.rdb.lines, 'spam', None)
+    monkeypatch.setattr(model, '_compiled_cases', {})
+    pytest.raises(TypeError, model.load_case, filename, 0, {}, str(tmpdir))
+
+
+@pytest.mark.parametrize('filename', [
+    'test_case_b.old.json',
+    'test_case_b.json',
+    'test_case_b.xlsx',
+])
+def test_binary_case(filename, tmpdir, monkeypatch):
+    filename = os.path.join(os.path.dirname(__file__), 'data', filename)
+    path = str(tmpdir.join('grid.npgrid'))
+    model.convert_case(filename, path)
+    model.convert_case(filename, path)  # Replaces the existing grid
+
+    ppc_a, emap_a = model.compile_case(filename, {})
+    ppc_b, emap_b = model.read_binary_case(path)
+    assert ppc_b['baseMVA'] == ppc_a['baseMVA']
+    for key in ['bus', 'gen', 'branch']:
+        assert isinstance(ppc_b[key], np.memmap)
+        assert not ppc_b[key].flags.writeable
+        assert np.all(ppc_b[key] == ppc_a[key])
+    assert emap_b == emap_a
+
+    # Copies are copy-on-write maps of the same files:
+    ppc_d = model.copy_case(ppc_b)
+    ppc_d['bus'][:, idx_bus.PD] = 1
+    for key in ['bus', 'gen', 'branch']:
+        assert isinstance(ppc_d[key], np.memmap)
+        assert ppc_d[key].flags.f_contiguous
+        assert np.all(ppc_b[key] == ppc_a[key])
+    assert np.all(ppc_d['bus'][:, idx_bus.PD] == 1)
+
+    monkeypatch.setattr(model, '_compiled_cases', {})
+    ppc_c, emap_c = model.load_case(path, 1, {})
+    assert ppc_c['bus'].flags.writeable
+    assert np.all(ppc_c['branch'] == ppc_a['branch'])
+    assert emap_c['1-Trafo1']['related'] == ['1-Grid', '1-Bus0']
+    assert emap_c['1-Trafo1']['static']['taps'][0] == 1.0
+
+
+def test_binary_case_wrong_suffix(tmpdir):
+    path = str(tmpdir.join('grid'))
+    pytest.raises(ValueError, model.write_binary_case, path,
+                  model.compile_case(os.path.join(
+                      os.path.dirname(__file__), 'data', 'test_case_b.json'),
+                      {}))
+
+
 def test_reset_inputs(ppc):
     for bus in ppc['bus']:
         bus[idx_bus.PD] = 1
@@ -225,11 +304,19 @@ def test_set_inputs(ppc):
         assert ppc['bus'][i][idx_bus.QD] == data['Q'] / 3000000
 
 
+def test_set_bus_inputs(ppc):
+    model.set_bus_inputs(ppc, np.array([3, 1]), [3000000, 6000000],
+                         [-3000000, 0])
+    assert list(ppc['bus'][:, idx_bus.PD]) == [0, 2, 0, 1, 0]
+    assert list(ppc['bus'][:, idx_bus.QD]) == [0, 0, 0, -1, 0]
+
+
 def test_set_inputs_wrong_etype(ppc):
     pytest.raises(ValueError, model.set_inputs, ppc, 'foo', 0, None, None)
 
 
-def test_perform_powerflow(ppc):
+def solve(ppc):
+    """Set the inputs of the test case *ppc* and run a power flow."""
     inputs = [
         {'P':        0, 'Q':       0},  # grid
         {'P':  1760000, 'Q':  950000},  # bus_0
@@ -243,7 +330,11 @@ def test_perform_powerflow(ppc):
     model.set_inputs(ppc, 'Transformer', 0, {'tap_turn': 0},
                      {'taps': {0: 1.0}})
 
-    res = model.perform_powerflow(ppc)
+    return model.perform_powerflow(ppc)
+
+
+def test_perform_powerflow(ppc):
+    res = solve(ppc)
 
     assert res['success'] == 1
     # Only check P, Q, Vm, Va - P and Q are 1/3 of the input values
@@ -266,13 +357,11 @@ def test_perform_powerflow(ppc):
         [ 0.48198161,  0.11293865, -0.48189201, -0.12219503],  # NOQA
     ]))
 
-    return res
-
 
 def test_get_cache_entries(ppc_eidmap):
     ppc, emap = ppc_eidmap
 
-    res = test_perform_powerflow(ppc)
+    res = solve(ppc)
     cache = model.get_cache_entries([res], emap)
 
     for eid, data in cache.items():
@@ -291,3 +380,58 @@ def test_get_cache_entries(ppc_eidmap):
         '0-B_2': {'I_real': 17.2, 'I_imag': -4.7, 'P_from': -595384.9, 'P_to': 595676.0, 'Q_from': -22694.5, 'Q_to': -163414.9},  # NOQA
         '0-B_3': {'I_real': 41.7, 'I_imag': 9.8, 'P_from': 1445944.8, 'P_to': -1445676.0, 'Q_from': 338815.9, 'Q_to': -366585.1},  # NOQA
     }
+
+
+def test_get_results_not_converged(ppc_eidmap):
+    ppc, emap = ppc_eidmap
+    ppc['success'] = 0
+    index = model.get_result_index(emap)
+    results = model.get_results(ppc, index)
+
+    assert sorted(results) == ['Branch', 'PQBus', 'RefBus', 'Transformer']
+    assert index['Branch'][0] == ['0-B_0', '0-B_1', '0-B_2', '0-B_3']
+    assert sorted(results['Branch']) == ['I_imag', 'I_real', 'P_from',
+                                         'P_to', 'Q_from', 'Q_to']
+    for columns in results.values():
+        for col in columns.values():
+            assert np.all(np.isnan(col))
+
+
+def test_get_results_lazy(ppc_eidmap):
+    ppc, emap = ppc_eidmap
+    res = solve(ppc)
+    index = model.get_result_index(emap)
+    results = model.get_results(res, index)
+
+    outputs = results['PQBus']
+    assert outputs._columns == {}
+    vm = outputs['Vm']
+    assert list(outputs._columns) == ['Vm']
+    assert outputs['Vm'] is vm
+    assert np.allclose(vm, [19998.94, 20000.41, 20013.36, 20009.22])
+    pytest.raises(KeyError, outputs.__getitem__, 'Vl')
+
+    # Both currents are computed by one call:
+    outputs = results['Branch']
+    assert np.allclose(outputs['I_real'], [-0.13, 15.41, 17.19, 41.71],
+                       atol=0.01)
+    assert list(outputs._parts) == [model._branch_current]
+    assert np.allclose(outputs['I_imag'], [-5.12, -1.70, -4.72, 9.77],
+                       atol=0.01)
+    assert len(outputs._parts) == 1
+
+
+def test_set_start_voltages(ppc):
+    res = solve(ppc)
+    assert res['iterations'] == 2
+
+    model.set_start_voltages(ppc, res)
+    assert np.all(ppc['bus'][:, idx_bus.VM] == res['bus'][:, idx_bus.VM])
+    assert np.all(ppc['bus'][:, idx_bus.VA] == res['bus'][:, idx_bus.VA])
+    # The inputs haven't changed, so the case is already solved:
+    assert model.perform_powerflow(ppc)['iterations'] == 0
+
+    res['success'] = 0
+    model.set_start_voltages(ppc, res)
+    assert np.all(ppc['bus'][:, idx_bus.VM] == 1)
+    assert np.all(ppc['bus'][:, idx_bus.VA] == 0)
@@ -1,8 +1,12 @@
+import json
 import pytest
 import os.path
 from math import isnan
 
-from mosaik_pypower import mosaik
+import numpy as np
+
+from mosaik_pypower import model, mosaik, registry
+from mosaik_pypower.solver import NativeSolver
 
 
 kV = 1000
@@ -66,7 +70,7 @@ def test_mosaik():
     sim = mosaik.PyPower()
     meta = sim.init(0, 1., 60, pos_loads=(pos_loads > 0))
     assert list(sorted(meta['models'].keys())) == [
-        'Branch', 'Grid', 'PQBus', 'RefBus', 'Transformer']
+        'Branch', 'Grid', 'PQBus', 'PowerNode', 'RefBus', 'Transformer']
 
     entities = sim.create(1, 'Grid', grid_file)
     entities[0]['children'].sort(key=lambda e: e['eid'])
@@ -187,3 +191,366 @@ def test_converge_setting(converge_exception):
         '0-Grid': ['P'],
     })
     assert isnan(data['0-Grid']['P'])
+
+
+@pytest.mark.parametrize('warm_start, iterations', [
+    (False, [2, 2]),
+    (True, [2, 0]),  # Same inputs, so already converged
+])
+def test_warm_start(warm_start, iterations):
+    sim = mosaik.PyPower()
+    sim.init(0, 1., 60, battery_capacity=0, pos_loads=(pos_loads > 0),
+             warm_start=warm_start)
+    sim.create(1, 'Grid', grid_file)
+
+    for i, time in enumerate([0, 60]):
+        sim.step(time, get_input_data(), 60)
+        data = sim.get_data({'0-grid': ['iterations'], '0-Bus0': ['Vm']})
+        assert data['0-grid']['iterations'] == iterations[i]
+        assert round(data['0-Bus0']['Vm'], 0) == 19999
+
+
+@pytest.mark.parametrize('memo_tolerance', [0, 100])
+def test_memoize(memo_tolerance):
+    sim = mosaik.PyPower()
+    sim.init(0, 1., 60, battery_capacity=0, pos_loads=(pos_loads > 0),
+             memoize=2, memo_tolerance=memo_tolerance)
+    sim.create(1, 'Grid', grid_file)
+
+    # Bus0 P offsets in W: Small changes are only hits with a tolerance
+    offsets = [0, 0, 10, 0, 200000, 0]
+    hits = {0: [0, 1, 1, 2, 2, 3], 100: [0, 1, 2, 3, 3, 4]}[memo_tolerance]
+    for i, offset in enumerate(offsets):
+        input_data = get_input_data()
+        input_data['0-Bus0']['P'][0] += offset * pos_loads
+        sim.step(i * 60, input_data, 60)
+        data = sim.get_data({
+            '0-grid': ['cache_hits', 'cache_misses', 'iterations'],
+            '0-Bus0': ['P', 'Vm'],
+        })
+        assert data['0-grid']['cache_hits'] == hits[i]
+        assert data['0-grid']['cache_misses'] == i + 1 - hits[i]
+        if offset == 0:
+            assert round(data['0-Bus0']['Vm'], 0) == 19999
+            assert round(data['0-Bus0']['P'], 0) == 1760000 * pos_loads
+
+
+def test_approximate():
+    sim = mosaik.PyPower()
+    sim.init(0, 1., 60, battery_capacity=0, pos_loads=(pos_loads > 0),
+             approx_interval=10, approx_max_change=100000)
+    sim.create(1, 'Grid', grid_file)
+
+    # Bus0 P offsets in W
+    offsets = [0, 10000, 50000, 500000]
+    for i, offset in enumerate(offsets):
+        input_data = get_input_data()
+        input_data['0-Bus0']['P'][0] += offset * pos_loads
+        sim.step(i * 60, input_data, 60)
+        data = sim.get_data({'0-grid': ['approximated'],
+                             '0-Grid': ['P'], '0-Bus0': ['Vm']})
+        assert data['0-grid']['approximated'] == (0 < offset < 100000)
+        assert round(data['0-Bus0']['Vm'], 0) == 19999
+        p_ref = (1230925 + offset) * pos_loads
+        assert abs(data['0-Grid']['P'] - p_ref) <= 0.01 * offset + 1
+
+
+def test_event_based():
+    sim = mosaik.PyPower()
+    meta = sim.init(0, 1., None, battery_capacity=0,
+                    pos_loads=(pos_loads > 0), step_mode='event-based',
+                    deadband={'P': 1000, 'Q': 1000})
+    assert meta['type'] == 'event-based'
+    assert mosaik.meta['type'] == 'time-based'
+    sim.create(1, 'Grid', grid_file)
+
+    assert sim.step(0, get_input_data(), 60) is None
+
+    # Only changed inputs arrive, the other ones are kept:
+    for time, p_bus0, iterations in [(10, 1.7605, 0), (20, 1.8, 2)]:
+        input_data = {'0-Bus0': {'P': {0: p_bus0 * MW * pos_loads}}}
+        assert sim.step(time, input_data, 60) is None
+        data = sim.get_data({'0-grid': ['iterations'], '0-Bus2': ['P']})
+        assert data['0-grid']['iterations'] == iterations
+        assert round(data['0-Bus2']['P']) == -1.98 * MW * pos_loads
+
+
+def test_event_based_meta():
+    models = mosaik.PyPower().init(0, 1., None, battery_capacity=0,
+                                   step_mode='hybrid')['models']
+    assert models['PQBus']['trigger'] == ['P', 'Q']
+    assert models['PowerNode']['trigger'] == ['P', 'Q', 'container_need']
+    assert models['Transformer']['trigger'] == ['tap_turn']
+    assert models['Branch']['trigger'] == ['online']
+    assert 'trigger' not in models['RefBus']
+    for desc in models.values():
+        assert desc['persistent'] == desc['attrs']
+
+    # Time-based simulators (and the module's meta data) have neither:
+    for models in [mosaik.PyPower().init(0, 1., 60,
+                                         battery_capacity=0)['models'],
+                   mosaik.meta['models']]:
+        for desc in models.values():
+            assert 'trigger' not in desc and 'persistent' not in desc
+
+
+def test_changed_connections():
+    sim = mosaik.PyPower()
+    sim.init(0, 1., 60, battery_capacity=0, pos_loads=(pos_loads > 0))
+    sim.create(1, 'Grid', grid_file)
+    outputs = {'0-Bus0': ['P', 'Vm'], '0-Bus1': ['P', 'Q']}
+
+    sim.step(0, get_input_data(), 60)
+    expected = sim.get_data(outputs)
+
+    # The load of Bus0 is split between two sources:
+    input_data = get_input_data()
+    p = input_data['0-Bus0']['P'].pop(0)
+    input_data['0-Bus0']['P'].update({'a': p / 4, 'b': p * 3 / 4})
+    sim.step(60, input_data, 60)
+    assert all_close(sim.get_data(outputs), expected)
+    assert sim._aggregator.learned == 2
+
+    # A source of Bus1 is disconnected and Bus3 gets no inputs:
+    input_data = get_input_data()
+    del input_data['0-Bus1']['P'][1]
+    del input_data['0-Bus3']
+    sim.step(120, input_data, 60)
+    data = sim.get_data(outputs)
+    assert data['0-Bus1']['P'] == .8 * MW * pos_loads
+    assert data['0-Bus1']['Q'] == .2 * MW
+    assert sim._aggregator.learned == 3
+
+
+def test_unknown_step_mode():
+    sim = mosaik.PyPower()
+    pytest.raises(ValueError, sim.init, 0, 1., 60, battery_capacity=0,
+                  step_mode='spam')
+    pytest.raises(ValueError, sim.init, 0, 1., 60, battery_capacity=0,
+                  deadband={'Vm': 1})
+
+
+def test_timing(tmpdir):
+    metrics_file = tmpdir.join('metrics.jsonl')
+    sim = mosaik.PyPower()
+    sim.init(0, 1., 60, battery_capacity=0, pos_loads=(pos_loads > 0),
+             metrics_file=str(metrics_file))
+    sim.create(2, 'Grid', grid_file)
+    attrs = ['t_step', 't_inputs', 't_reset', 't_lookup', 't_solve',
+             't_results', 't_get_data', 'n_entities', 'n_inputs',
+             'iterations']
+
+    for time in [0, 60]:
+        sim.step(time, get_input_data(), 60)
+        data = sim.get_data({'0-grid': attrs, '1-grid': attrs})
+    sim.finalize()
+
+    assert data['0-grid']['n_entities'] == 10
+    assert data['0-grid']['n_inputs'] == 4
+    assert data['1-grid']['n_inputs'] == 0
+    assert data['0-grid']['t_solve'] > 0
+    assert data['0-grid']['t_get_data'] > 0
+    assert data['0-grid']['t_step'] >= data['0-grid']['t_solve']
+
+    records = [json.loads(line) for line in metrics_file.readlines()]
+    assert [r['time'] for r in records] == [0, 60]
+    assert records[1]['iterations'] == [2, 2]
+    assert records[1]['n_inputs'] == [4, 0]
+    assert sorted(records[1]['times']) == sorted([
+        'inputs', 'reset', 'lookup', 'solve', 'results', 'get_data'])
+
+
+def test_timing_disabled():
+    sim = mosaik.PyPower()
+    sim.init(0, 1., 60, battery_capacity=0, pos_loads=(pos_loads > 0))
+    sim.create(1, 'Grid', grid_file)
+    sim.step(0, get_input_data(), 60)
+    data = sim.get_data({'0-grid': ['t_step', 't_solve', 'n_inputs']})
+    assert data == {'0-grid': {'t_step': 0, 't_solve': 0, 'n_inputs': 4}}
+
+
+def test_native_solver():
+    data = []
+    for solver in ['pypower', 'native']:
+        sim = mosaik.PyPower()
+        sim.init(0, 1., 60, battery_capacity=0, pos_loads=(pos_loads > 0),
+                 solver=solver)
+        sim.create(1, 'Grid', grid_file)
+        sim.step(0, get_input_data(), 60)
+        data.append(sim.get_data({'0-Grid': ['P', 'Q'],
+                                  '0-Bus3': ['Vm', 'Va'],
+                                  '0-B_3': ['I_real', 'I_imag']}))
+
+    assert all_close(data[1], data[0], ndigits=6)
+
+
+def test_native_solver_islanded_bus():
+    sim = mosaik.PyPower()
+    sim.init(0, 1., 60, pos_loads=(pos_loads > 0), solver='native')
+    sim.create(1, 'Grid', grid_file)
+
+    # Bus3 is islanded, so the power flow can't converge:
+    input_data = get_input_data()
+    input_data['0-B_2'] = {'online': {'src': 0}}
+    input_data['0-B_3'] = {'online': {'src': 0}}
+    sim.step(0, input_data, 60)
+    data = sim.get_data({'0-Bus0': ['Vm']})
+    assert isnan(data['0-Bus0']['Vm'])
+
+    input_data['0-B_2'] = {'online': {'src': 1}}
+    sim.step(60, input_data, 60)
+    data = sim.get_data({'0-Bus0': ['Vm']})
+    assert round(data['0-Bus0']['Vm'], 0) == 19999
+
+
+def test_binary_grid(tmpdir):
+    binary_file = str(tmpdir.join('grid.npgrid'))
+    model.convert_case(grid_file, binary_file)
+    data = []
+    for gridfile in [grid_file, binary_file]:
+        sim = mosaik.PyPower()
+        sim.init(0, 1., 60, battery_capacity=0, pos_loads=(pos_loads > 0))
+        entities = sim.create(1, 'Grid', gridfile)
+        sim.step(0, get_input_data(), 60)
+        data.append((entities, sim.get_data({'0-Grid': ['P', 'Q'],
+                                             '0-Bus3': ['Vm', 'Va'],
+                                             '0-B_3': ['I_real', 'I_imag']})))
+
+    assert data[1] == data[0]
+
+    # The instances keep memory-mapped copies of the grid:
+    base = registry.load_grid(binary_file, {})[0]
+    for key in ['bus', 'gen', 'branch']:
+        assert isinstance(sim._ppcs[0][key], np.memmap)
+        assert sim._ppcs[0][key].flags.writeable
+    assert not np.all(sim._ppcs[0]['bus'] == base['bus'])
+
+
+def test_unknown_solver():
+    sim = mosaik.PyPower()
+    pytest.raises(ValueError, sim.init, 0, 1., 60, battery_capacity=0,
+                  solver='spam')
+
+
+@pytest.mark.parametrize('algorithm', ['NR', 'FDXB', 'GS'])
+def test_algorithm(algorithm):
+    data = []
+    for kwargs in [{}, {'algorithm': algorithm, 'tolerance': 1e-10,
+                        'max_iterations': 1000}]:
+        sim = mosaik.PyPower()
+        sim.init(0, 1., 60, battery_capacity=0, pos_loads=(pos_loads > 0),
+                 **kwargs)
+        sim.create(1, 'Grid', grid_file)
+        sim.step(0, get_input_data(), 60)
+        data.append(sim.get_data({'0-Grid': ['P', 'Q'],
+                                  '0-Bus3': ['Vm', 'Va']}))
+        mismatch = sim.get_data({'0-grid': ['mismatch']})['0-grid']
+        assert mismatch['mismatch'] < sim._ppo['PF_TOL']
+
+    assert all_close(data[1], data[0])
+
+
+def test_unknown_algorithm():
+    sim = mosaik.PyPower()
+    pytest.raises(ValueError, sim.init, 0, 1., 60, battery_capacity=0,
+                  algorithm='spam')
+
+
+def test_batch_solver_factory():
+    sim = mosaik.PyPower()
+    sim.init(0, 1., 60, pos_loads=(pos_loads > 0), batch=True)
+    sim.create(2, 'Grid', grid_file)
+    sim.step(0, get_input_data(), 60)
+    # The meshed grid is batched with the vectorized native solver:
+    batch = sim._solvers[0]
+    assert [type(s) for s in batch._solvers.values()] == [NativeSolver]
+
+
+@pytest.mark.parametrize('batch', [False, True])
+@pytest.mark.parametrize('parallel', [None, 'thread', 'process'])
+def test_parallel(parallel, batch):
+    sim = mosaik.PyPower()
+    sim.init(0, 1., 60, battery_capacity=0, pos_loads=(pos_loads > 0),
+             parallel=parallel, workers=2, batch=batch)
+    sim.create(3, 'Grid', grid_file)
+
+    input_data = get_input_data()
+    input_data['2-Bus0'] = input_data['0-Bus0']
+    input_data['2-B_3'] = {'online': {'src': 0}}
+    sim.step(0, input_data, 60)
+    data = sim.get_data({
+        '0-Grid': ['P', 'Q'],
+        '1-Grid': ['P', 'Q'],
+        '2-Grid': ['P', 'Q'],
+        '2-B_3': ['P_from'],
+        '0-grid': ['iterations'],
+    })
+    sim.finalize()
+
+    assert all_close(data, {
+        '0-Grid': {'Q': 441486,  'P': -1230925},
+        '1-Grid': {'Q': -959406, 'P': -276},
+        '2-Grid': {'Q': 18908, 'P': -1760396},
+        '2-B_3': {'P_from': 0},
+        '0-grid': {'iterations': 2},
+    }, ndigits=0)
+
+
+def test_pipeline():
+    outputs = {'0-Bus0': ['P', 'Vm'], '0-Grid': ['P', 'Q'],
+               '0-grid': ['iterations']}
+    data = []
+    for pipeline in [False, True]:
+        sim = mosaik.PyPower()
+        sim.init(0, 1., 60, pos_loads=(pos_loads > 0), pipeline=pipeline)
+        sim.create(1, 'Grid', grid_file)
+        data.append([])
+        for i in range(3):
+            input_data = get_input_data()
+            input_data['0-Bus0']['P'][0] *= 1 + i / 10
+            assert sim.step(i * 60, input_data, 60) == (i + 1) * 60
+            # The next step waits for the pending power flows, too:
+            if i != 1:
+                data[-1].append(sim.get_data(outputs))
+        sim.finalize()
+
+    assert data[0] == data[1]
+
+
+def test_pipeline_converge_exception():
+    sim = mosaik.PyPower()
+    sim.init(0, 1., 60, pos_loads=(pos_loads > 0), converge_exception=True,
+             pipeline=True)
+    sim.create(1, 'Grid', grid_file)
+
+    assert sim.step(0, get_input_data(converge=False), 60) == 60
+    pytest.raises(RuntimeError, sim.get_data, {'0-Grid': ['P']})
+    sim.finalize()
+
+
+def test_get_array():
+    sim = mosaik.PyPower()
+    sim.init(0, 1., 60, pos_loads=(pos_loads > 0))
+    sim.create(2, 'Grid', grid_file)
+    sim.step(0, get_input_data(), 60)
+
+    eids = sim.get_eids('0-grid', 'PQBus')
+    assert eids == ['0-Bus0', '0-Bus1', '0-Bus2', '0-Bus3']
+    assert sim.get_eids('1-grid', 'Branch')[0] == '1-B_0'
+    assert sim.get_eids('0-grid', 'PowerNode') == []
+
+    for attr in ['P', 'Vm', 'Vl']:
+        data = sim.get_data({eid: [attr] for eid in eids})
+        values = mosaik.unpack_array(sim.get_array('0-grid', 'PQBus', attr))
+        assert list(values) == [data[eid][attr] for eid in eids]
+
+    values = sim.get_array('0-grid', 'Branch', 'I_real', start=1, stop=3)
+    data = sim.get_data({'0-B_1': ['I_real'], '0-B_2': ['I_real']})
+    assert list(mosaik.unpack_array(values)) == [data['0-B_1']['I_real'],
+                                                 data['0-B_2']['I_real']]
+    assert len(mosaik.unpack_array(sim.get_array('0-grid', 'PowerNode',
+                                                 'Vm'))) == 0
+
+    pytest.raises(ValueError, sim.get_array, '0-grid', 'PQBus', 'spam')
+    pytest.raises(ValueError, sim.get_array, '0-grid', 'Transformer', 'taps')
+    pytest.raises(ValueError, sim.get_array, '5-grid', 'PQBus', 'Vm')
@@ -0,0 +1,46 @@
+import copy
+import os.path
+
+import numpy as np
+import pytest
+
+from mosaik_pypower import model, parallel, solver
+
+
+class FailingSolver(solver.Solver):
+    """Raises an error if the load of bus 1 is negative."""
+    def solve_all(self):
+        if self.cases[0]['bus'][1, 2] < 0:
+            raise ValueError('Negative load')
+        return super().solve_all()
+
+
+@pytest.fixture
+def ppc():
+    filename = os.path.join(os.path.dirname(__file__), 'data',
+                            'test_case_b.json')
+    ppc, emap = model.load_case(filename, 0, {})
+    model.set_bus_inputs(ppc, np.arange(1, 5),
+                         [1760000, 600000, -1980000, 850000],
+                         [950000, 200000, -280000, 530000])
+    return ppc
+
+
+def test_process_pool_error(ppc):
+    solvers = [FailingSolver(copy.deepcopy(ppc)),
+               solver.Solver(copy.deepcopy(ppc))]
+    pool = parallel.ProcessPool(2)
+    try:
+        solvers[0].cases[0]['bus'][1, 2] = -1
+        pytest.raises(ValueError, pool.solve, solvers)
+
+        # The next step gets the results of its own inputs:
+        solvers[0].cases[0]['bus'][1, 2] = 1
+        solvers[1].cases[0]['bus'][1, 2] = 0.7
+        results = pool.solve(solvers)
+    finally:
+        pool.close()
+
+    for s, res in zip(solvers, results):
+        expected = solver.Solver(s.cases[0]).solve()
+        assert np.allclose(res['bus'], expected['bus'])
@@ -0,0 +1,143 @@
+import json
+import random
+
+import pytest
+
+from mosaik_pypower import mosaik
+from mosaik_pypower.powernode import PowerNodes
+
+
+def manage(state, capacity):
+    """Reference implementation for a single node."""
+    pv, battery, need = (state['pv_power'], state['battery_power'],
+                         state['container_need'])
+    if pv == 0 and battery == 0:
+        state['grid_energy'] = need
+    elif pv > 0:
+        if pv >= need:
+            extra = pv - need
+            if extra == 0:
+                state['battery_action'] = 'noAction'
+            elif capacity - battery > 0:
+                if capacity - battery >= extra:
+                    state['battery_action'] = 'charge:%s' % float(extra)
+                else:
+                    state['battery_action'] = ('charge:%s' %
+                                               float(capacity - battery))
+                    state['net_metering_power'] += extra - (capacity - battery)
+        elif battery > 0:
+            if battery >= need - pv:
+                state['battery_action'] = 'discharge:%s' % float(need - pv)
+            else:
+                state['battery_action'] = 'discharge:%s' % float(battery)
+                state['grid_energy'] = need - pv - battery
+        else:
+            state['grid_energy'] = need - pv
+    elif battery > 0:
+        if battery >= need:
+            state['battery_action'] = 'discharge:%s' % float(need)
+        else:
+            state['battery_action'] = 'discharge:%s' % float(battery)
+            state['grid_energy'] = need - battery
+    else:
+        state['grid_energy'] = need
+
+
+def test_power_nodes():
+    rnd = random.Random(1)
+    eids = ['0-node_%d' % i for i in range(200)]
+    capacity = {eid: rnd.choice([0, 5, 10]) for eid in eids}
+    nodes = PowerNodes()
+    nodes.add(eids[:50], capacity)
+    nodes.add(eids[50:], capacity)
+    assert len(nodes) == 200
+    states = {eid: {'battery_action': None, 'net_metering_power': 0,
+                    'grid_energy': 0} for eid in eids}
+
+    for step in range(10):
+        for eid in eids:
+            inputs = [rnd.choice([0, 3, 5, 8]) for i in range(3)]
+            nodes.set_inputs(eid, -inputs[0], *inputs[1:])
+            states[eid].update(zip(['pv_power', 'battery_power',
+                                    'container_need'], inputs))
+            manage(states[eid], capacity[eid])
+        nodes.step()
+
+        # Read the outputs of some nodes (which resets them):
+        for eid in rnd.sample(eids, 100):
+            for attr in ['battery_action', 'net_metering_power',
+                         'grid_energy']:
+                assert nodes.get(eid, attr) == states[eid][attr]
+                states[eid][attr] = None if attr == 'battery_action' else 0
+
+
+def test_power_nodes_keep_inputs():
+    nodes = PowerNodes()
+    nodes.add(['0-node_0'], 10)
+    nodes.set_inputs('0-node_0', pv_power=5, battery_power=2)
+    nodes.set_inputs('0-node_0', container_need=3)
+    nodes.step()
+    assert nodes.get('0-node_0', 'battery_action') == 'charge:2.0'
+    assert nodes.get('0-node_0', 'battery_action') is None
+
+
+@pytest.fixture
+def node_grid(tmpdir):
+    path = str(tmpdir.join('grid.json'))
+    buses = [['Grid', 'REF', 110.0], ['Bus0', 'PQ', 20.0]]
+    buses.extend(['Node%d' % i, 'NODE', 20.0] for i in range(3))
+    branches = [['B_%d' % i, 'Bus0', 'Node%d' % i, 'NA2XS2Y_185', 1.0, True]
+                for i in range(3)]
+    with open(path, 'w') as f:
+        json.dump({'bus': buses, 'branch': branches,
+                   'trafo': [['Trafo1', 'Grid', 'Bus0', 'TRAFO_40', True,
+                              0]]}, f)
+    return path
+
+
+def test_mosaik_power_nodes(node_grid):
+    sim = mosaik.PyPower()
+    sim.init(0, 1., 60, battery_capacity={'0-Node0': 10, '0-Node1': 10,
+                                          '0-Node2': 0},
+             node_sources={'pv': 'PV-*'})
+    grid = sim.create(1, 'Grid', node_grid)[0]
+    types = {c['eid']: c['type'] for c in grid['children']}
+    assert types['0-Node1'] == 'PowerNode'
+    assert types['0-Bus0'] == 'PQBus'
+
+    inputs = {}
+    for i, (pv, battery, need) in enumerate([(8, 4, 3), (1, 4, 3),
+                                             (1, 0, 3)]):
+        inputs['0-Node%d' % i] = {
+            'P': {'PV-0.pv_%d' % i: -pv, 'BatterySimulator-0.b_%d' % i:
+                  battery, 'Load-0.load_%d' % i: 1000},
+            'container_need': {'ComputeNodeSimulator-0.c_%d' % i: need},
+        }
+    sim.step(0, inputs, 60)
+
+    outputs = ['battery_action', 'net_metering_power', 'grid_energy', 'P']
+    data = sim.get_data({'0-Node%d' % i: outputs for i in range(3)})
+    assert data['0-Node0']['battery_action'] == 'charge:5.0'
+    assert data['0-Node1']['battery_action'] == 'discharge:2.0'
+    assert data['0-Node2']['battery_action'] is None
+    assert data['0-Node2']['grid_energy'] == 2
+    assert data['0-Node1']['P'] == pytest.approx(1000 + 4 - 1)
+
+    # The outputs are reset when they are read:
+    data = sim.get_data({'0-Node0': ['battery_action']})
+    assert data['0-Node0']['battery_action'] is None
+
+
+def test_mosaik_power_nodes_missing_source(node_grid):
+    sim = mosaik.PyPower()
+    sim.init(0, 1., 60, battery_capacity=10)
+    sim.create(1, 'Grid', node_grid)
+    inputs = {'0-Node0': {'P': {'CSV-0.PV_0': -1}}}
+    pytest.raises(RuntimeError, sim.step, 0, inputs, 60)
+
+
+def test_mosaik_power_nodes_no_capacity(node_grid):
+    sim = mosaik.PyPower()
+    sim.init(0, 1., 60)
+    pytest.raises(ValueError, sim.create, 1, 'Grid', node_grid)
+    pytest.raises(ValueError, sim.init, 0, 1., 60, node_sources={'x': '*'})
@@ -0,0 +1,100 @@
+import os.path
+
+import numpy as np
+import pytest
+
+from mosaik_pypower import model
+from mosaik_pypower import registry as registry_mod
+from mosaik_pypower.registry import ETYPES, EntityRegistry, GridLayout
+
+
+FILENAME = os.path.join(os.path.dirname(__file__), 'data', 'test_case_b.json')
+
+
+@pytest.fixture
+def compiled():
+    return model.compile_case(FILENAME, {})
+
+
+def test_layout(compiled):
+    layout = GridLayout(model.entity_columns(compiled[1]))
+    assert len(layout) == 10
+    assert layout.names == sorted(compiled[1])
+
+    # Same result index as for the entity map:
+    index = model.get_result_index(compiled[1])
+    assert layout.index.keys() == index.keys()
+    for etype, (eids, rows, vl) in index.items():
+        assert layout.index[etype][0] == eids
+        assert np.all(layout.index[etype][1] == rows)
+        assert np.allclose(layout.index[etype][2], vl, equal_nan=True)
+        for pos, name in enumerate(eids):
+            i = layout.names.index(name)
+            assert ETYPES[layout.codes[i]] == etype
+            assert layout.pos[i] == pos
+
+
+def test_layout_power_node(compiled):
+    ppc, entities = compiled
+    entities['node_a1'] = entities.pop('Bus3')
+    for attrs in entities.values():
+        if 'related' in attrs:
+            attrs['related'] = [n.replace('Bus3', 'node_a1')
+                                for n in attrs['related']]
+    layout = GridLayout(model.entity_columns(entities))
+    assert 'PowerNode' in layout.index
+    assert 'node_a1' in layout.index['PowerNode'][0]
+
+
+def test_load_grid(monkeypatch):
+    monkeypatch.setattr(registry_mod, '_grids', {})
+    ppc, layout = registry_mod.load_grid(FILENAME, {})
+    # Instances share the case and the layout:
+    assert registry_mod.load_grid(FILENAME, {}) == (ppc, layout)
+    assert list(registry_mod._grids) == [model.case_key(FILENAME, {})]
+    assert len(layout) == 10
+
+
+def test_load_grid_binary(tmpdir, monkeypatch):
+    monkeypatch.setattr(registry_mod, '_grids', {})
+    path = str(tmpdir.join('grid.npgrid'))
+    model.convert_case(FILENAME, path)
+    ppc, layout = registry_mod.load_grid(path, {})
+
+    # The case and the static attributes stay memory-mapped:
+    for key in ['bus', 'gen', 'branch']:
+        assert isinstance(ppc[key], np.memmap)
+    assert isinstance(layout.static['Branch']['length'], np.memmap)
+
+    # Same layout as for the grid file:
+    expected = registry_mod.load_grid(FILENAME, {})[1]
+    assert layout.names == expected.names
+    for attr in ['codes', 'rows', 'pos', 'related']:
+        assert np.all(getattr(layout, attr) == getattr(expected, attr))
+    assert layout.static.keys() == expected.static.keys()
+    for etype, columns in expected.static.items():
+        for attr, col in columns.items():
+            assert list(layout.static[etype][attr]) == list(col)
+
+
+def test_registry(compiled):
+    registry = EntityRegistry()
+    layout = GridLayout(model.entity_columns(compiled[1]))
+    registry.add(0, layout)
+    registry.add(1, layout)
+    assert len(registry) == 20
+    assert '1-Bus2' in registry
+
+    assert registry.lookup('1-Bus2') == (1, ETYPES.index('PQBus'), 3, 2)
+    assert registry.lookup('0-B_1') == (0, ETYPES.index('Branch'), 2, 1)
+    assert registry.static('0-B_1') == compiled[1]['B_1']['static']
+    assert registry.static_value('1-Grid', 'Vl') == 110000
+    assert registry.static_value('0-Trafo1', 'taps')[0] == 1.0
+    pytest.raises(KeyError, registry.static_value, '0-Bus0', 'spam')
+    pytest.raises(KeyError, registry.lookup, '2-Bus0')
+
+    children = registry.children(1)
+    assert len(children) == 10
+    assert {'eid': '1-Trafo1', 'type': 'Transformer',
+            'rel': ['1-Grid', '1-Bus0']} in children
+    assert {'eid': '1-Bus0', 'type': 'PQBus', 'rel': []} in children
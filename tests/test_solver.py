@@ -0,0 +1,248 @@
+import copy
+import os.path
+
+import numpy as np
+import pytest
+
+from mosaik_pypower import model, solver
+
+
+@pytest.fixture
+def ppc():
+    filename = os.path.join(os.path.dirname(__file__), 'data',
+                            'test_case_b.json')
+    ppc, emap = model.load_case(filename, 0, {})
+    model.set_bus_inputs(ppc, np.arange(1, 5),
+                         [1760000, 600000, -1980000, 850000],
+                         [950000, 200000, -280000, 530000])
+    return ppc
+
+
+def test_solver_reuses_ybus(ppc):
+    s = solver.Solver(ppc)
+    res_a = s.solve()
+    ybus = s._ybus
+    res_b = s.solve()
+    assert s._ybus is ybus
+    assert res_a['success'] == res_b['success'] == 1
+    assert np.allclose(res_a['bus'], res_b['bus'])
+
+
+def test_solver_invalidate(ppc):
+    s = solver.Solver(ppc)
+    p_ref = s.solve()['gen'][0, 1]
+
+    taps = {0: 1.0, 1: 1.1}
+    assert not model.set_inputs(ppc, 'Transformer', 0, {'tap_turn': 0},
+                                {'taps': taps})
+    assert model.set_inputs(ppc, 'Transformer', 0, {'tap_turn': 1},
+                            {'taps': taps})
+    assert s.solve()['gen'][0, 1] == p_ref  # Stale admittance matrix
+    s.invalidate()
+    assert s.solve()['gen'][0, 1] != p_ref
+
+    assert model.set_inputs(ppc, 'Branch', 1, {'online': False}, {})
+    s.invalidate()
+    res = s.solve()
+    assert res['success'] == 1
+    assert np.all(res['branch'][1, -4:] == 0)
+
+
+def test_native_solver(ppc):
+    expected = solver.Solver(ppc).solve()
+    native = solver.NativeSolver(ppc)
+    for i in range(2):
+        # The second run reuses the Jacobian's pattern and column ordering
+        res = native.solve()
+        assert res['success'] == 1
+        assert res['iterations'] == expected['iterations']
+        for key in ['bus', 'gen', 'branch']:
+            assert np.allclose(res[key], expected[key])
+
+    assert native._perm_c is not None
+    native.invalidate()
+    assert native._perm_c is None
+    assert np.allclose(native.solve()['bus'], expected['bus'])
+
+
+def test_native_solver_not_converged(ppc):
+    ppc['bus'][1, 2] = 10000
+    res = solver.NativeSolver(ppc).solve()
+    assert res['success'] == 0
+    assert res['iterations'] == solver.PPOPTION['PF_MAX_IT']
+
+
+def test_native_solver_islanded_bus(ppc):
+    # Disconnect all branches of bus 4:
+    branch = ppc['branch']
+    branch[(branch[:, 0] == 4) | (branch[:, 1] == 4), 10] = 0
+    res = solver.NativeSolver(ppc).solve()
+    assert res['success'] == 0
+    assert res['iterations'] == 1
+
+    results = solver.BatchSolver([ppc, copy.deepcopy(ppc)]).solve_all()
+    assert [r['success'] for r in results] == [0, 0]
+
+
+def test_is_radial(ppc):
+    assert not solver.is_radial(ppc)
+    ppc['branch'][4, 10] = 0  # B_3 offline
+    assert solver.is_radial(ppc)
+    ppc['branch'][3, 10] = 0  # B_2 offline, Bus3 is disconnected
+    assert not solver.is_radial(ppc)
+
+
+def test_auto_solver(ppc):
+    assert type(solver.auto_solver(ppc)) is solver.Solver
+    ppc['branch'][4, 10] = 0
+    assert type(solver.auto_solver(ppc)) is solver.SweepSolver
+
+
+def test_auto_batch_solver(ppc):
+    assert type(solver.auto_batch_solver(ppc)) is solver.NativeSolver
+    ppc['branch'][4, 10] = 0
+    assert type(solver.auto_batch_solver(ppc)) is solver.SweepSolver
+
+
+def test_sweep_solver(ppc):
+    ppc['branch'][4, 10] = 0
+    ppc['branch'][0, 8] = 1 / 1.04  # Use a tap other than 1
+    expected = solver.Solver(ppc).solve()
+    sweep = solver.SweepSolver(ppc)
+    res = sweep.solve()
+
+    assert sweep._sweeps is not None
+    assert res['success'] == 1
+    for key in ['bus', 'gen', 'branch']:
+        assert np.allclose(res[key], expected[key], atol=1e-7)
+
+
+def test_sweep_solver_meshed(ppc):
+    sweep = solver.SweepSolver(ppc)
+    res = sweep.solve()
+    assert sweep._sweeps is None
+    assert np.allclose(res['bus'], solver.Solver(ppc).solve()['bus'])
+
+
+def test_sweep_solver_diverging(ppc):
+    ppc['branch'][4, 10] = 0
+    ppc['bus'][1, 2] = 10000
+    res = solver.SweepSolver(ppc).solve()
+    assert res['success'] == 0
+    assert res['iterations'] < solver.PPOPTION['PF_MAX_IT_GS']
+
+
+@pytest.mark.parametrize('algorithm', ['FDXB', 'FDBX', 'GS'])
+@pytest.mark.parametrize('cls', [solver.Solver, solver.NativeSolver,
+                                 solver.SweepSolver])
+def test_algorithms(ppc, cls, algorithm):
+    expected = solver.Solver(ppc).solve()
+    ppo = solver.make_ppoption(tolerance=1e-10, max_iterations=1000,
+                               algorithm=algorithm)
+    res = cls(ppc, ppo).solve()
+    assert res['success'] == 1
+    assert res['mismatch'] < 1e-10
+    for key in ['bus', 'gen', 'branch']:
+        assert np.allclose(res[key], expected[key], atol=1e-6)
+
+
+@pytest.mark.parametrize('cls', [solver.Solver, solver.NativeSolver,
+                                 solver.SweepSolver])
+def test_tolerance(ppc, cls):
+    ppc['branch'][4, 10] = 0  # Radial, so that the sweep solver is used
+    loose = cls(ppc, solver.make_ppoption(tolerance=1e-3)).solve()
+    tight = cls(ppc, solver.make_ppoption(tolerance=1e-12)).solve()
+    assert loose['success'] == tight['success'] == 1
+    assert loose['iterations'] < tight['iterations']
+    assert tight['mismatch'] < 1e-12 <= loose['mismatch'] < 1e-3
+
+
+def test_max_iterations(ppc):
+    res = solver.Solver(ppc, solver.make_ppoption(max_iterations=1)).solve()
+    assert res['success'] == 0
+    assert res['iterations'] == 1
+    assert res['mismatch'] > solver.PPOPTION['PF_TOL']
+
+
+def test_enforce_q_limits(ppc):
+    ppc['gen'][0, 3] = 0.1  # QMAX [MVAr]
+    assert solver.Solver(ppc).solve()['success'] == 1
+    ppo = solver.make_ppoption(enforce_q_limits=True)
+    assert solver.Solver(ppc, ppo).solve()['success'] == 0
+
+
+def test_unknown_algorithm():
+    pytest.raises(ValueError, solver.make_ppoption, algorithm='spam')
+
+
+@pytest.mark.parametrize('factory', [solver.Solver, solver.NativeSolver,
+                                     solver.SweepSolver])
+def test_batch_solver(ppc, factory):
+    cases = [copy.deepcopy(ppc) for i in range(4)]
+    for i, case in enumerate(cases):
+        case['bus'][1:5, 2] *= 1 + i / 10
+        case['branch'][4, 10] = 0  # Radial for the sweep solver
+    cases[2]['bus'][1, 2] = 10000  # Does not converge
+    cases[3]['branch'][0, 8] = 1 / 1.04  # Other topology
+
+    batch = solver.BatchSolver(cases, factory=factory)
+    results = batch.solve_all()
+    assert len(batch._solvers) == 2
+
+    for case, res in zip(cases, results):
+        expected = factory(case).solve()
+        assert res['success'] == expected['success']
+        assert res['iterations'] == expected['iterations']
+        if expected['success']:
+            for key in ['bus', 'gen', 'branch']:
+                assert np.allclose(res[key], expected[key])
+    assert [r['success'] for r in results] == [1, 1, 0, 1]
+
+
+@pytest.mark.parametrize('cls', [solver.Solver, solver.NativeSolver])
+def test_sensitivities(ppc, cls):
+    s = cls(ppc)
+    sens, = s.linearize_all(s.solve_all())
+
+    ppc['bus'][1:5, 2:4] *= 1.01
+    assert sens.change(ppc) == pytest.approx(0.01 * 1.98 / 3)
+    res = sens.estimate(ppc)
+    expected = s.solve()
+    assert res['approximated']
+    assert res['iterations'] == 0
+    assert np.allclose(res['bus'][:, 7:9], expected['bus'][:, 7:9],
+                       atol=1e-5)
+    assert np.allclose(res['branch'][:, -4:], expected['branch'][:, -4:],
+                       atol=1e-4)
+
+
+def test_linearized_solver(ppc):
+    s = solver.LinearizedSolver(solver.Solver(ppc), max_change=0.1,
+                                interval=3)
+    approximated = []
+    for change in [0, 0.01, 0.02, 0.03, 0.2, 0.2]:
+        ppc['bus'][1, 2] = 0.5 + change
+        res, = s.solve_all()
+        approximated.append(res['approximated'])
+    # Full power flows: first step, interval, change > max_change
+    assert approximated == [False, True, True, False, False, True]
+
+    s.invalidate()
+    assert not s.solve_all()[0]['approximated']
+
+
+def test_result_cache_lru(ppc):
+    cache = solver.ResultCache(size=2)
+    keys = {}
+    for name, pd in [('a', 1), ('b', 2), ('c', 3)]:
+        ppc['bus'][1, 2] = pd
+        keys[name] = cache.key(ppc)
+
+    cache.put(keys['a'], 'a')
+    cache.put(keys['b'], 'b')
+    assert cache.get(keys['a']) == 'a'
+    assert cache.get(keys['a']) == 'a'  # Hit of the last results
+    cache.put(keys['c'], 'c')  # Evicts the least recently used "b"
+    assert cache.get(keys['b']) is None
+    assert cache.get(keys['a']) == 'a'
+    assert (cache.hits, cache.misses) == (3, 1)
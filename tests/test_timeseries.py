@@ -0,0 +1,81 @@
+import json
+import os.path
+
+import numpy as np
+import pytest
+
+from mosaik_pypower import timeseries
+
+
+MW = 1000 ** 2
+grid_file = os.path.join(os.path.dirname(__file__), 'data', 'test_case_b.json')
+
+
+@pytest.fixture
+def profiles(tmpdir):
+    """Three time steps, the second one is the case from "test_mosaik"."""
+    p = tmpdir.join('p.csv')
+    p.write('Bus3,Bus0,Bus1,Bus2\n'
+            '0,0,0,0\n'
+            '0.85e6,1.76e6,0.6e6,-1.98e6\n'
+            '0.85e6,1.76e6,0.6e6,-1.98e6\n')
+    q = tmpdir.join('q.npy')
+    np.save(str(q), np.array([[0, 0, 0, 0],
+                              [.95, .2, -.28, .53],
+                              [.95, .2, -.28, .53]]) * MW)
+    return str(p), str(q)
+
+
+def test_run(profiles, tmpdir):
+    outdir = str(tmpdir.join('out'))
+    stats = timeseries.run(grid_file, profiles[0], profiles[1], outdir,
+                           chunk_size=2)
+    assert stats == {'steps': 3, 'failed': 0}
+
+    columns = json.load(open(os.path.join(outdir, 'columns.json')))
+    assert columns['RefBus'] == ['Grid']
+    assert columns['PQBus'] == ['Bus0', 'Bus1', 'Bus2', 'Bus3']
+
+    def load(name):
+        return np.load(os.path.join(outdir, '%s.npy' % name))
+
+    assert list(load('success')) == [True, True, True]
+    assert list(load('iterations')) == [2, 2, 0]  # Warm start
+    assert np.allclose(load('RefBus.P')[:, 0], [276, 1230925, 1230925],
+                       atol=1)
+    assert np.allclose(load('RefBus.Q')[:, 0], [-959406, 441486, 441486],
+                       atol=1)
+    assert np.allclose(load('PQBus.P')[1], [1.76e6, 0.6e6, -1.98e6, 0.85e6])
+    assert np.allclose(load('PQBus.Vm')[1], [19999, 20000, 20013, 20009],
+                       atol=1)
+    assert load('Branch.I_real').shape == (3, 4)
+
+
+def test_run_attrs(profiles, tmpdir):
+    p = timeseries.read_profiles(profiles[0], ['Bus0', 'Bus1', 'Bus2',
+                                               'Bus3'])
+    outdir = str(tmpdir.join('out'))
+    timeseries.run(grid_file, -p, outdir=outdir, pos_loads=False,
+                   warm_start=False, attrs=['P'])
+    assert sorted(os.listdir(outdir)) == [
+        'PQBus.P.npy', 'RefBus.P.npy', 'columns.json', 'iterations.npy',
+        'success.npy']
+    assert list(np.load(os.path.join(outdir, 'iterations.npy'))) == [2, 2, 2]
+    ref_p = np.load(os.path.join(outdir, 'RefBus.P.npy'))[:, 0]
+    assert np.all(ref_p[1:] < -1e6)
+
+
+def test_read_profiles_errors(profiles, tmpdir):
+    pytest.raises(ValueError, timeseries.read_profiles, profiles[0],
+                  ['Bus0', 'Bus1'])
+    pytest.raises(ValueError, timeseries.read_profiles, profiles[1],
+                  ['Bus0', 'Bus1'])
+
+
+def test_main(profiles, tmpdir, capsys):
+    outdir = str(tmpdir.join('out'))
+    assert timeseries.main([grid_file, profiles[0], '-q', profiles[1],
+                            '-o', outdir, '--solver', 'native',
+                            '--attrs', 'Vm,Va']) == 0
+    assert '3 steps in' in capsys.readouterr().out
+    assert np.load(os.path.join(outdir, 'PQBus.Va.npy')).shape == (3, 4)
@@ -0,0 +1,63 @@
+import os.path
+
+import pytest
+
+from mosaik_pypower import gridgen, model, xlsx
+
+
+data_dir = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def test_workbook():
+    wb = xlsx.Workbook(os.path.join(data_dir, 'test_case_extra_types.xlsx'))
+    assert wb.sheet_names == ['Nodes', 'Lines', 'Line Types', 'Transformers']
+
+    rows = wb.rows('Line Types')
+    assert rows == [
+        ['Type name', "R' [Ω/km]", "X' [Ω/km]", "C' [nF/km]", 'I_max [A]'],
+        ['SPAM_200', 0.1337, 0.0815, 0., 404.],
+    ]
+    assert wb.rows('Line Types') is rows  # Sheets are only read once
+
+    rows = wb.rows('Lines')
+    assert rows[2] == ['Trafo1', 'Grid', 'Bus0', 'TRAFO_23', 1., 1., 0., '']
+    assert rows[-1] == ['B_3', 'Bus2', 'Bus3', 'SPAM_200', 0.3, 1., '', '']
+
+    pytest.raises(ValueError, wb.rows, 'Spam')
+
+
+def test_workbook_inline_strings(tmpdir):
+    grid = gridgen.make_grid(30, seed=1)
+    path = str(tmpdir.join('grid.xlsx'))
+    gridgen.write_xlsx(grid, path)
+
+    rows = xlsx.Workbook(path).rows('Nodes')
+    assert rows[1:] == [[bid, btype, kv] for bid, btype, kv in grid['bus']]
+
+
+def test_parse_taps():
+    assert xlsx.parse_taps('{-1: 0.975, 0: 1, 1: 1.025}') == {
+        -1: 0.975, 0: 1., 1: 1.025}
+
+
+@pytest.mark.parametrize('value', [
+    '__import__("os").getcwd()',
+    '[1, 2]',
+    '{0: "spam"}',
+    '{0: 1.0',
+    1.0,
+])
+def test_parse_taps_invalid(value):
+    pytest.raises(ValueError, xlsx.parse_taps, value)
+
+
+def test_excel_cache(tmpdir):
+    path = str(tmpdir.join('grid.xlsx'))
+    gridgen.write_xlsx(gridgen.make_grid(3, seed=1), path)
+    wb = model.Excel.open(path)
+    assert model.Excel.open(path) is wb
+
+    # The file is read again if it changes:
+    gridgen.write_xlsx(gridgen.make_grid(4, seed=1), path)
+    os.utime(path, ns=(0, 0))
+    assert len(model.Excel.open(path).rows('Nodes')) == 6